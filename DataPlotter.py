@@ -1,11 +1,24 @@
-import pandas as pd
-from lightweight_charts import Chart
+from time import sleep, time, perf_counter
+_module_started = perf_counter()  # Start of the imports, for the time-to-first-candle log
 import os
+import argparse
 import threading
-from time import sleep, time
 from datetime import datetime
+from file_tail import CsvTail
+from vwap import VwapEngine, SESSION_START
+from timeframes import TIMEFRAMES, BASE_TIMEFRAME, TimeframeCache
+from metrics import METRICS
+from rules import alerts_path
+# NumPy, pandas and the storage modules are imported where they are used, the loader thread imports them
+# while the main thread starts the chart window
 
-def set_chart_options(chart):
+_render_seconds = METRICS.histogram('plotter_update_seconds', 'Duration of chart frames')
+_arrival_to_chart = METRICS.histogram('tick_arrival_to_chart_seconds', 'Time from the tick timestamp to the frame that drew it')
+_chart_ticks = METRICS.counter('plotter_ticks_total', 'Ticks drawn on the chart')
+_chart_resyncs = METRICS.counter('plotter_full_sets_total', 'Full chart.set calls after the initial load')
+_first_candle = METRICS.gauge('plotter_time_to_first_candle_seconds', 'Seconds from the start of the plotter to the first candle on the chart')
+
+def set_chart_options(chart, symbol, timeframe=BASE_TIMEFRAME):
     # Set chart layout
     chart.layout(background_color='#090008', text_color='#FFFFFF', font_size=16, font_family='Helvetica')
 
@@ -14,33 +27,408 @@ def set_chart_options(chart):
 
     # Set volume configuration to match TradingView colors
     chart.volume_config(up_color='#008000', down_color='#FF0000')
-    chart.topbar.textbox('symbol', 'NVDA')
-    chart.watermark('1 min', color='rgba(180, 180, 240, 0.7)')
+    chart.topbar.textbox('symbol', symbol)
+    # The plot loop reads the selected timeframe from the switcher
+    chart.topbar.switcher('timeframe', tuple(TIMEFRAMES), default=timeframe, func=lambda chart: None)
+    set_watermark(chart, timeframe)
+
+
+def set_watermark(chart, timeframe):
+    chart.watermark(TIMEFRAMES[timeframe][1], color='rgba(180, 180, 240, 0.7)')
+
+
+def handle_chart_events(chart):
+    """Runs the callbacks of the chart widgets, like chart.show(block=True) would. Returns False once the window is closed."""
+    from lightweight_charts import Chart
+    from lightweight_charts.util import parse_event_message
+
+    queue = Chart.WV.emit_queue
+    while not queue.empty():
+        message = queue.get()
+        if message == 'exit':
+            chart.exit()
+            return False
+        func, args = parse_event_message(chart.win, message)
+        func(*args)
+    return True
 
 
 def calculate_vwap(df):
-    # Initialize an empty DataFrame with the desired columns
-    vwap_df = pd.DataFrame(columns=['time', 'VWAP'])
-
-    # Calculate typical price
-    df['typical_price'] = (df['high'] + df['low'] + df['close']) / 3
-    
-    # Calculate dollar volume (typical price * volume)
-    df['dollar_volume'] = df['typical_price'] * df['volume']
-    
-    # Calculate cumulative dollar volume and cumulative volume
-    df['cumulative_dollar_volume'] = df['dollar_volume'].cumsum()
-    df['cumulative_volume'] = df['volume'].cumsum()
-    
-    # Calculate VWAP
-    df['VWAP'] = df['cumulative_dollar_volume'] / df['cumulative_volume']
-    
-    # Fill the empty DataFrame with the time and VWAP values
-    vwap_df['time'] = df['date']
-    vwap_df['VWAP'] = df['VWAP']
-    
-    # Return the filled DataFrame
-    return vwap_df
+    """Calculates the VWAP of every bar in `df` without modifying it."""
+    import pandas as pd
+    # Calculate typical price and dollar volume (typical price * volume)
+    typical_price = (df['high'] + df['low'] + df['close']) / 3
+    dollar_volume = typical_price * df['volume']
+
+    # Calculate VWAP from the cumulative dollar volume and cumulative volume
+    vwap = dollar_volume.cumsum() / df['volume'].cumsum()
+
+    return pd.DataFrame({'time': df['date'], 'VWAP': vwap})
+
+
+def create_vwap_lines(chart, engine):
+    """Creates a chart line for the VWAP and each of its bands, keyed by line name."""
+    lines = {'VWAP': chart.create_line(name='VWAP', color='red')}
+    for name in engine.line_names[1:]:
+        lines[name] = chart.create_line(name=name, color='rgba(255, 120, 120, 0.6)', style='dotted', width=1)
+    return lines
+
+
+def set_vwap_lines(lines, engine, df):
+    """Feeds every bar of `df` to the engine and sets the full VWAP lines, used for the initial load."""
+    import pandas as pd
+    points = [engine.update_bar(bar.date, bar.high, bar.low, bar.close, bar.volume) for bar in df.itertuples()]
+    vwap_df = pd.DataFrame([point for point in points if point is not None], columns=['time'] + engine.line_names)
+    for name, line in lines.items():
+        line.set(vwap_df[['time', name]])
+
+
+def update_vwap_lines(lines, point):
+    """Pushes a single VWAP point to the chart lines."""
+    import pandas as pd
+    for name, line in lines.items():
+        line.update(pd.Series({'time': point['time'], name: point[name]}))
+
+def bars_to_frame(rows, columns):
+    """Builds a bar DataFrame from CSV rows read by CsvTail."""
+    import pandas as pd
+    from csv_operations import bar_key
+    df = pd.DataFrame(rows, columns=columns)
+    df['date'] = pd.to_datetime(df['date'].map(bar_key), errors='coerce')
+    for column in ['open', 'high', 'low', 'close', 'volume']:
+        df[column] = df[column].astype(float)
+    return df
+
+
+def ticks_to_frame(rows, columns):
+    """Builds a tick DataFrame from CSV rows read by CsvTail."""
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=columns)
+    df['price'] = df['price'].astype(float)
+    return df
+
+
+class RenderScheduler:
+    """Coalesces bar, tick and VWAP changes into at most `fps` chart updates per second.
+
+    Between frames only the newest state is kept: each changed candle with the open,
+    the accumulated high, low and volume and the latest price, and the latest VWAP
+    point. A frame pushes them with incremental update calls, oldest candle first.
+
+    lightweight_charts can only update the newest candle. A change to an older one,
+    e.g. the final values of the previous minute arriving after the first ticks of
+    the next, is drawn by setting the whole history again, at most every
+    `resync_interval` seconds.
+
+    Ticks are added to the candle of their `bar_length` period, so the same
+    scheduler draws any timeframe as long as add_bars gets bars of that timeframe.
+    """
+
+    def __init__(self, chart, vwap_engine, vwap_lines, fps=20, resync_interval=30.0, bar_length=None):
+        import pandas as pd
+        self.chart = chart
+        self.vwap_engine = vwap_engine
+        self.vwap_lines = vwap_lines
+        self.bar_length = pd.Timedelta(minutes=1) if bar_length is None else bar_length
+        self.frame_interval = 1.0 / fps
+        self.resync_interval = resync_interval
+
+        self.candle = None  # Newest candle as a dict: time, open, high, low, close, volume
+        self.loaded = False  # Whether the chart has any bars, update needs a previous bar
+        self.pending = {}  # Candle time -> candle changed since the last frame
+        self.vwap_points = {}  # Point time -> latest VWAP point since the last frame
+        self.stale = False  # An older candle changed, the history has to be set again
+        self.last_frame = 0.0
+        self.last_resync = time()
+        self.tick_times = []  # Timestamps of the ticks waiting for a frame, only with metrics enabled
+
+    def load(self, df):
+        """Remembers the newest candle of the history that was set on the chart."""
+        self.loaded = not df.empty
+        if not df.empty:
+            bar = df.iloc[-1]
+            self.candle = {'time': bar['date'], 'open': bar['open'], 'high': bar['high'],
+                           'low': bar['low'], 'close': bar['close'], 'volume': bar['volume']}
+
+    def _add_vwap_point(self, point):
+        if point is not None:
+            self.vwap_points[point['time']] = point
+
+    def add_bars(self, bars):
+        """Queues new or rewritten bars (a DataFrame with 'date', ohlc and 'volume')."""
+        for bar in bars.itertuples():
+            self._add_vwap_point(self.vwap_engine.update_bar(bar.date, bar.high, bar.low, bar.close, bar.volume))
+            if self.candle is not None and bar.date < self.candle['time']:
+                self.stale = True
+                continue
+            self.candle = {'time': bar.date, 'open': bar.open, 'high': bar.high,
+                           'low': bar.low, 'close': bar.close, 'volume': bar.volume}
+            self.pending[bar.date] = self.candle
+
+    def add_ticks(self, ticks, sizes_from=None):
+        """Queues new ticks (a DataFrame with 'time', 'price' and an optional 'size').
+
+        The sizes of ticks before `sizes_from` are not added to the volume, their
+        bars already have them.
+        """
+        bar_times = ticks['time'].dt.floor(self.bar_length).tolist()
+        prices = ticks['price'].tolist()
+        sizes = ticks['size'] if 'size' in ticks else None
+        if sizes is not None and sizes_from is not None:
+            sizes = sizes.where(ticks['time'] >= sizes_from, 0.0)
+        sizes = sizes.tolist() if sizes is not None else [0.0] * len(prices)
+        candle = self.candle
+
+        for bar_time, price, size in zip(bar_times, prices, sizes):
+            if candle is not None and bar_time < candle['time']:
+                continue
+            if candle is None or bar_time > candle['time']:
+                candle = {'time': bar_time, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
+                self.pending[bar_time] = candle
+            else:
+                if price > candle['high']:
+                    candle['high'] = price
+                if price < candle['low']:
+                    candle['low'] = price
+                candle['close'] = price
+                candle['volume'] += size
+                self.pending[bar_time] = candle
+            self._add_vwap_point(self.vwap_engine.update_tick(bar_time, price))
+
+        self.candle = candle
+        if METRICS.enabled:
+            self.tick_times.append(ticks['time'].values)
+
+    def has_pending(self):
+        return bool(self.pending or self.vwap_points or self.stale)
+
+    def time_to_next_frame(self):
+        return max(0.0, self.last_frame + self.frame_interval - time())
+
+    def render(self, history):
+        """Draws a frame if one is due. `history` is the BarHistory of the drawn timeframe, used for a resync.
+
+        Returns True if something was drawn.
+        """
+        import numpy as np
+        import pandas as pd
+        now = time()
+        if now - self.last_frame < self.frame_interval or not self.has_pending():
+            return False
+        started = perf_counter()
+        self.last_frame = now
+
+        resync_due = self.stale and now - self.last_resync >= self.resync_interval
+        if (resync_due or not self.loaded) and not history.empty:
+            self.chart.set(history.frame())
+            _chart_resyncs.inc()
+            self.loaded = True
+            self.last_resync = now
+            self.stale = False
+            # The newest candle may only exist in the ticks so far
+            last_time = history.last_time
+            self.pending = {time: candle for time, candle in self.pending.items() if time >= last_time}
+            if self.candle is not None and self.candle['time'] > last_time:
+                self.pending[self.candle['time']] = self.candle
+
+        if not self.loaded:
+            return False
+
+        for _, candle in sorted(self.pending.items(), key=lambda item: item[0]):
+            self.chart.update(pd.Series(candle))
+        for _, point in sorted(self.vwap_points.items(), key=lambda item: item[0]):
+            update_vwap_lines(self.vwap_lines, point)
+        self.pending = {}
+        self.vwap_points = {}
+
+        if METRICS.enabled:
+            _render_seconds.observe(perf_counter() - started)
+            if self.tick_times:
+                # Tick timestamps are the arrival times in the streamer
+                latencies = (np.datetime64(datetime.now(), 'ns') - np.concatenate(self.tick_times).astype('M8[ns]')) / np.timedelta64(1, 's')
+                for latency in latencies:
+                    _arrival_to_chart.observe(latency)
+                _chart_ticks.inc(len(latencies))
+                self.tick_times = []
+        return True
+
+
+class CsvSource:
+    """Reads new bars and ticks from the CSV files written by the streamer."""
+
+    def __init__(self, symbol):
+        from csv_operations import historical_data_path, market_data_path, BAR_REWRITE_WINDOW
+        # Only the rows added since the previous read are parsed, and the newest bars that the streamer may still correct
+        self.bar_tail = CsvTail(historical_data_path(symbol), reread_rows=BAR_REWRITE_WINDOW)
+        self.tick_tail = CsvTail(market_data_path(symbol))
+        self.recent_rows = {}  # date -> row of the bars read again on every change
+
+    def state(self):
+        """Returns the read positions for a warm-start snapshot."""
+        return {'bars': self.bar_tail.state(), 'ticks': self.tick_tail.state()}
+
+    def restore(self, state):
+        """Continues from the read positions of a snapshot, so only the rows written since then are parsed."""
+        self.tick_tail.restore(state['ticks'])
+        return self.bar_tail.restore(state['bars'])
+
+    def read_bars(self):
+        """Returns the new or rewritten bars as a DataFrame, or None if there are none."""
+        rows = self.bar_tail.read_new_rows()
+        changed = [row for row in rows if self.recent_rows.get(row[0]) != row]
+        if rows:
+            self.recent_rows = {row[0]: row for row in rows[-self.bar_tail.reread_rows:]}
+        return bars_to_frame(changed, self.bar_tail.header) if changed else None
+
+    def read_ticks(self):
+        """Returns the new ticks as a DataFrame, or None if there are none."""
+        rows = self.tick_tail.read_new_rows()
+        return ticks_to_frame(rows, self.tick_tail.header) if rows else None
+
+
+class RingSource:
+    """Reads new bars and ticks from the memory-mapped rings of the numpy storage backend.
+
+    The records are used as they are in the map, nothing is parsed. If the
+    streamer has not created the rings yet, opening them is tried again every
+    `check_interval` seconds.
+    """
+
+    check_interval = 1.0
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.recent_bars = {}  # time -> record of the bars read again on every change
+        self.bar_reader = self.tick_reader = None
+        self.last_open_attempt = None
+        self._ensure_readers()
+
+    def _ensure_readers(self):
+        """Opens the readers if they are not open yet. Returns False if the rings do not exist yet."""
+        if self.bar_reader is not None:
+            return True
+        if self.last_open_attempt is not None and time() - self.last_open_attempt < self.check_interval:
+            return False
+
+        first_attempt = self.last_open_attempt is None
+        self.last_open_attempt = time()
+        try:
+            self.open_readers()
+        except (FileNotFoundError, ValueError):
+            # ValueError: the streamer is still creating the ring file
+            if first_attempt:
+                print(f"Waiting for the streamer to create the rings of {self.symbol}.")
+            return False
+        return True
+
+    def state(self):
+        return {}
+
+    def restore(self, state):
+        """The rings are read without parsing, so they are always read from the start."""
+        return False
+
+    def open_readers(self):
+        from csv_operations import BAR_REWRITE_WINDOW
+        from storage import MappedRing, RingReader, BAR_DTYPE, TICK_DTYPE, bar_ring_path, tick_ring_path
+        bar_reader = RingReader(MappedRing(bar_ring_path(self.symbol), BAR_DTYPE, writable=False), reread=BAR_REWRITE_WINDOW)
+        tick_reader = RingReader(MappedRing(tick_ring_path(self.symbol), TICK_DTYPE, writable=False))
+        self.bar_reader, self.tick_reader = bar_reader, tick_reader
+
+    def read_bars(self):
+        import numpy as np
+        import pandas as pd
+        if not self._ensure_readers():
+            return None
+        records = self.bar_reader.read_new()
+        if len(records) == 0:
+            return None
+
+        # Only the bars that are new or were corrected since the previous read
+        recent, times = self.recent_bars, records['time']
+        window = self.bar_reader.reread
+        self.recent_bars = {int(time): record.item() for time, record in zip(times[-window:], records[-window:])}
+        if recent:
+            seen = int(np.searchsorted(times, max(recent), side='right'))
+            unchanged = [index for index in range(seen) if recent.get(int(times[index])) == records[index].item()]
+            if unchanged:
+                records = np.delete(records, unchanged)
+                if len(records) == 0:
+                    return None
+        return pd.DataFrame({
+            'date': records['time'].astype('datetime64[ns]'),
+            'open': records['open'],
+            'high': records['high'],
+            'low': records['low'],
+            'close': records['close'],
+            'volume': records['volume'],
+        }, copy=False)
+
+    def read_ticks(self):
+        import pandas as pd
+        if not self._ensure_readers():
+            return None
+        records = self.tick_reader.read_new()
+        if len(records) == 0:
+            return None
+        return pd.DataFrame({'time': records['time'].astype('datetime64[ns]'), 'price': records['price'], 'size': records['size']}, copy=False)
+
+
+class SharedMemorySource(RingSource):
+    """Reads the shared memory rings of the shm storage backend.
+
+    When there has been no new data for `check_interval` seconds, checks whether
+    the streamer has restarted with new blocks and attaches to them.
+    """
+
+    def open_readers(self):
+        from csv_operations import BAR_REWRITE_WINDOW
+        from storage import SharedRing, RingReader, BAR_DTYPE, TICK_DTYPE, bar_shm_name, tick_shm_name
+        bar_reader = RingReader(SharedRing(bar_shm_name(self.symbol), BAR_DTYPE, writable=False), reread=BAR_REWRITE_WINDOW)
+        tick_reader = RingReader(SharedRing(tick_shm_name(self.symbol), TICK_DTYPE, writable=False))
+        self.bar_reader, self.tick_reader = bar_reader, tick_reader
+        self.last_data = time()
+
+    def _check_writer(self, frame):
+        if self.bar_reader is None:
+            return frame  # Not attached yet, see _ensure_readers
+        if frame is not None:
+            self.last_data = time()
+        elif time() - self.last_data >= self.check_interval:
+            self.last_data = time()
+            if not (self.bar_reader.ring.is_current() and self.tick_reader.ring.is_current()):
+                try:
+                    self.open_readers()
+                    print(f"Attached to new shared memory blocks of {self.symbol}.")
+                except FileNotFoundError:
+                    pass  # The streamer is not running, keep the old data
+        return frame
+
+    def read_bars(self):
+        return self._check_writer(super().read_bars())
+
+    def read_ticks(self):
+        return self._check_writer(super().read_ticks())
+
+
+SOURCES = {'csv': CsvSource, 'numpy': RingSource, 'shm': SharedMemorySource}
+
+
+def draw_timeframe(chart, history, vwap_lines, timeframe, fps):
+    """Sets the bars of `history` and their VWAP on the chart, returns the RenderScheduler for the updates."""
+    import pandas as pd
+    df = history.frame()
+    chart.set(df)
+    set_watermark(chart, timeframe)
+
+    # VWAP of the drawn bars is calculated once, after that it is updated point by point
+    # Bars longer than 30 minutes start before the session start and would all be ignored
+    vwap_engine = VwapEngine(session_start=SESSION_START if TIMEFRAMES[timeframe][0] <= 1800 else None)
+    set_vwap_lines(vwap_lines, vwap_engine, df)
+
+    renderer = RenderScheduler(chart, vwap_engine, vwap_lines, fps=fps, bar_length=pd.Timedelta(seconds=TIMEFRAMES[timeframe][0]))
+    renderer.load(df)
+    return renderer
 
 # Tarvii filtteröidä pois sellaiset tickit joista on jo tehty candle dataa
 def filter_new_ticks(df1, df2):
@@ -62,6 +450,8 @@ def filter_new_ticks(df1, df2):
     if 'time' not in df2.columns:
         raise ValueError("DataFrame df2 must have a 'time' column")
 
+    import pandas as pd
+
     # Convert 'date' and 'time' columns to datetime format
     df1['date'] = pd.to_datetime(df1['date'], errors='coerce')
     df2['time'] = pd.to_datetime(df2['time'], errors='coerce')
@@ -81,84 +471,164 @@ def filter_new_ticks(df1, df2):
 
 
 
-if __name__ == '__main__':
+def load_history(history, source, snapshot, storage):
+    """Restores the bar history from a snapshot (state, arrays) and reads the bars written since then.
+
+    Returns 'snapshot' if the source continued from the snapshot, 'full' if every bar was read.
+    """
+    state, arrays = snapshot
+    resumed = False
+    if state is not None and state['storage'] == storage:
+        history.upsert_arrays(arrays['times'], arrays['values'])
+        resumed = source.restore(state['source'])
+
+    df = source.read_bars()
+    if df is not None:
+        history.upsert(df)
+    return 'snapshot' if resumed else 'full'
+
+
+def save_plotter_snapshot(path, history, source, storage):
+    from snapshot import save_snapshot
+    times, values = history.arrays()
+    try:
+        save_snapshot(path, {'storage': storage, 'source': source.state()}, times=times, values=values)
+    except Exception as e:
+        print(f"Error saving the snapshot: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Live chart of the data written by LiveDataStreamer.')
+    parser.add_argument('symbol', nargs='?', default='NVDA')
+    parser.add_argument('--storage', choices=list(SOURCES), default='csv', help='storage backend used by the streamer')
+    parser.add_argument('--fps', type=float, default=20, help='max chart updates per second')
+    parser.add_argument('--timeframe', choices=list(TIMEFRAMES), default=BASE_TIMEFRAME, help='timeframe shown first')
+    parser.add_argument('--retention-days', type=float, default=5, help='days of bars kept in memory, 0 = all')
+    parser.add_argument('--snapshot-interval', type=float, default=60, help='seconds between warm-start snapshots')
+    parser.add_argument('--cold-start', action='store_true', help='ignore the snapshot of the previous run')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-log-interval', type=float, help='seconds between metrics log lines')
+    args = parser.parse_args(argv)
+    imported = perf_counter()
+
+    if args.metrics_port is not None or args.metrics_log_interval:
+        METRICS.enable(args.metrics_port, log_interval=args.metrics_log_interval)
+
+    symbol = args.symbol
+    poll_interval = 0.05  # Seconds to wait when there is no new data
+    loaded = {}
+
+    # The data libraries are imported and the history is loaded while the chart library is imported and the window starts
+    def load():
+        try:
+            import pandas as pd
+            from bar_history import BarHistory
+            from snapshot import snapshot_path, load_snapshot
+            loaded['path'] = path = snapshot_path(f'plotter_{symbol}')
+            loaded['source'] = source = SOURCES[args.storage](symbol)
+            loaded['history'] = history = BarHistory(retention=pd.Timedelta(days=args.retention_days) if args.retention_days else None)
+            snapshot = (None, {}) if args.cold_start else load_snapshot(path)
+            loaded['kind'] = load_history(history, source, snapshot, args.storage)
+            loaded['seconds'] = perf_counter() - imported
+        except BaseException as e:
+            loaded['error'] = e  # Raised in the main thread after the join
+
+    loader = threading.Thread(target=load, name='HistoryLoader')
+    loader.start()
+
+    from lightweight_charts import Chart
 
     chart = Chart()
-    
-    # Calculate VWAP from history data
-    df = pd.read_csv('historical_data.csv')
-    vwap_df = calculate_vwap(df)
-   
-    chart.set(df)
-    
-    set_chart_options(chart)
-    line = chart.create_line(name='VWAP', color='red')
-    line.set(vwap_df)
+    timeframe = args.timeframe
+    set_chart_options(chart, symbol, timeframe)
+    vwap_lines = create_vwap_lines(chart, VwapEngine(session_start=SESSION_START))
     chart.show()
+    shown = perf_counter()
+    loader.join()
+    if 'error' in loaded:
+        raise loaded['error']
+    import pandas as pd
+    source, history, path = loaded['source'], loaded['history'], loaded['path']
+    base_bar_length = pd.Timedelta(seconds=TIMEFRAMES[BASE_TIMEFRAME][0])
+
+    # Higher timeframes are resampled from the 1-minute bars and kept up to date as they arrive
+    timeframes = TimeframeCache()
+    view = timeframes.get(symbol, timeframe, history)
+
+    # Only the initial load and timeframe switches use chart.set, after that the changes are pushed frame by frame
+    renderer = draw_timeframe(chart, view, vwap_lines, timeframe, args.fps)
+    first_candle = None
+
+    # Rule alerts of the streamer are drawn as markers
+    alert_tail = CsvTail(alerts_path(symbol))
+    alert_tail.read_new_rows()  # Only alerts raised from now on
+
+    # Newest tick drawn so far, older ticks are skipped
+    last_tick_time = None
+    last_snapshot = time()
 
-    # Initialize a set to remember which tick timestamps were updated
-    updated_timestamps = set()
-    last_minute_processed = None
-    last_tick_timestamp = None
-
-    while True:
-
-        df2 = pd.read_csv('market_data.csv', header=0)
-        
-        # Filter new ticks
-        df_t = filter_new_ticks(df, df2)
-
-        # Filter out rows with timestamps already in updated_timestamps
-        df_t = df_t[~df_t['time'].isin(updated_timestamps)]        
-
-        if not df_t.empty or df.empty:
-            last_row_history = df.iloc[-1]
-            last_row_tick = df_t.iloc[-1] if not df_t.empty else None
-            
-            if last_row_tick is not None:
-                    # Print the last history data with an explanation
-                print(f"Last history: {last_row_history['date']}")
-
-                # Print the last tick data with an explanation
-                print(f"Last tick: {last_row_tick['time']}")
-                        
-            # Print the number of data points found
-            print(f"Found {len(df_t)} data point(s) from CSV.")
-            
-            
-
-            for _, row in df_t.iterrows():
-                current_time = row['time']
-                current_price = row['price']
-                
-                # Convert current_time to a string in the format 'YYYY-MM-DD HH:MM'
-                current_time_str = current_time.strftime('%Y-%m-%d %H:%M')
-
-                # Only update the chart if the timestamp has not been updated before
-                if current_time not in updated_timestamps:
-                    chart.update_from_tick(row)
-                    updated_timestamps.add(current_time)  # Add the timestamp to the set
-                    print(f"Updated chart for timestamp {current_time} with price {current_price}.")
-                else:
-                    print(f"Skipped updating chart for timestamp {current_time} as it was updated earlier.")
-
-                # Check if this is the first iteration or if a new minute has started
-                if last_tick_timestamp is None or current_time_str != last_tick_timestamp.strftime('%Y-%m-%d %H:%M'):
-                    
-                    print(f"Minute change detected. Updating chart with historical data at {current_time_str}.")
-                    sleep(5)
-                    # Read only the last row from the CSV file
-                    last_row = pd.read_csv('historical_data.csv').tail(1)
-
-                    # Append the last row to the existing DataFrame
-                    df = pd.concat([df, last_row], ignore_index=True)
-
-                    # Update the chart with the new data
-                    chart.set(df)
-                    vwap_df = calculate_vwap(df)
-                    line.set(vwap_df)
-                
-                # Update last_tick_timestamp to the current time
-                last_tick_timestamp = current_time
-        else:
-            sleep(1)
\ No newline at end of file
+    try:
+        while True:
+
+            new_bars = source.read_bars()
+            ticks = source.read_ticks()
+
+            if new_bars is not None:
+                # New or rewritten bars from the streamer
+                history.upsert(new_bars)
+                if timeframe == BASE_TIMEFRAME:
+                    renderer.add_bars(new_bars)
+                changed = timeframes.update(symbol, history, new_bars['date'].min())
+                if timeframe in changed:
+                    renderer.add_bars(changed[timeframe])
+
+            if ticks is not None and not history.empty:
+                ticks['time'] = pd.to_datetime(ticks['time'], errors='coerce')
+                # Only ticks newer than the previous ones, from the minute of the newest bar on. The streamer
+                # rewrites the forming bar every few seconds, the ticks in between are merged into its candle.
+                fresh = ticks['time'] >= history.last_time
+                if last_tick_time is not None:
+                    fresh &= ticks['time'] > last_tick_time
+                ticks = ticks[fresh]
+
+                if not ticks.empty:
+                    last_tick_time = ticks['time'].iloc[-1]
+                    renderer.add_ticks(ticks, sizes_from=history.last_time + base_bar_length)
+
+            for alert_time, rule, message, _ in alert_tail.read_new_rows():
+                chart.marker(time=pd.Timestamp(alert_time), position='above', shape='arrow_down', color='#ffcc00', text=rule)
+                print(f"{alert_time} {rule}: {message}")
+
+            if not handle_chart_events(chart):
+                break
+            selected = chart.topbar['timeframe'].value
+            if selected != timeframe:
+                timeframe = selected
+                started = perf_counter()
+                view = timeframes.get(symbol, timeframe, history)
+                renderer = draw_timeframe(chart, view, vwap_lines, timeframe, args.fps)
+                print(f"Timeframe {timeframe}: {len(view)} bars in {(perf_counter() - started) * 1000:.1f} ms")
+
+            renderer.render(view)
+
+            if first_candle is None and renderer.loaded:
+                first_candle = perf_counter() - _module_started
+                _first_candle.set(first_candle)
+                print(f"First candle {first_candle:.2f} s after start: imports {imported - _module_started:.2f} s, "
+                      f"{loaded['kind']} history load {loaded['seconds']:.2f} s, window {shown - imported:.2f} s, "
+                      f"{len(history)} bars.")
+
+            if args.snapshot_interval and time() - last_snapshot >= args.snapshot_interval:
+                last_snapshot = time()
+                save_plotter_snapshot(path, history, source, args.storage)
+
+            if new_bars is None and ticks is None:
+                sleep(renderer.time_to_next_frame() if renderer.has_pending() else poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        save_plotter_snapshot(path, history, source, args.storage)
+
+
+if __name__ == '__main__':
+    main()
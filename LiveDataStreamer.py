@@ -2,105 +2,500 @@ from ibapi.client import EClient
 from ibapi.common import TickerId
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
-from datetime import datetime
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo
 import threading
 import csv
 from ibapi.ticktype import TickTypeEnum
 import time
 import os
-from csv_operations import save_historical_data, save_market_data
+from csv_operations import bar_key
+from storage import create_storage
+from data_writer import DataWriter
+from backfill import BackfillScheduler
+from bar_aggregator import Bar, BarAggregator
+from rules import RuleEngine, AlertLog, print_alert, NoEntryBelowVwap, MaxTradesPerHour, MaxStopDistanceAtr
+from metrics import METRICS
+from snapshot import snapshot_path, save_snapshot, load_snapshot
 
 port = 7497
+metrics_port = None  # e.g. 9464 to serve Prometheus metrics on http://127.0.0.1:9464/metrics
+metrics_log_interval = None  # Seconds between metrics log lines, None = no log line
+
+_ticks = METRICS.counter('ticks_total', 'LAST ticks received')
+_tick_callback = METRICS.histogram('tick_price_seconds', 'Duration of tickPrice for LAST ticks')
+_round_trip = METRICS.histogram('historical_request_round_trip_seconds', 'Time from reqHistoricalData to historicalDataEnd',
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+_historical_errors = METRICS.counter('historical_request_errors_total', 'Historical requests that ended in an error')
+
+# Symbols streamed by one TestApp
+WATCHLIST = ["NVDA"]
+
+# Trading rules checked for every symbol, see rules.py
+RULES = [NoEntryBelowVwap(), MaxTradesPerHour(4), MaxStopDistanceAtr(1.5)]
+
+
+def is_warning(errorCode):
+    """Returns True for TWS messages that are only notices, e.g. 2176 or 10167 (delayed data), not request failures."""
+    return 2100 <= errorCode < 2200 or errorCode == 10167
+
+
+def create_stock_contract(symbol):
+    contract = Contract()
+    contract.symbol = symbol
+    contract.secType = "STK"
+    contract.exchange = "SMART"
+    contract.currency = "USD"
+    return contract
+
+
+class SymbolStream:
+    """Per-symbol state: contract, files and backfill scheduling."""
+
+    def __init__(self, symbol, bar_intervals=(60,), storage='csv'):
+        self.symbol = symbol
+        self.contract = create_stock_contract(symbol)
+        self.storage = create_storage(storage, symbol)  # Ticks and bars are only written by the writer thread
+
+        # Only the missing window is requested, a full day only on cold start or after a gap
+        self.backfill = BackfillScheduler(bar_size_seconds=60)
+        self.next_request_time = None  # Wall clock time of the next historical request
+        self.market_data_req_id = None
+        self.last_trade = None  # (timestamp, price) of the LAST tick waiting for its LAST_SIZE
+
+        # Live bars built from the ticks, interval in seconds -> aggregator
+        self.aggregators = {interval: BarAggregator(interval) for interval in set(bar_intervals) | {60}}
+        self.minute_bars = self.aggregators[60]  # Same bar size as the historical data
+        self.last_bar_write = 0.0  # Monotonic time the forming minute bar was last queued
+
 
 class TestApp(EClient, EWrapper):
-    def __init__(self):
+    def __init__(self, writer_policy='drop_oldest'):
         EClient.__init__(self, self)
         self.orderId = None
-        self.historical_data = []
+        self.ready = threading.Event()  # Set by nextValidId once the connection is usable
         self.last_minute = None
-        self.tick_buffer = []  # Buffer to hold ticks before writing to the CSV file
-        self.buffer_limit = 1  # Number of ticks to buffer before writing to the file
-        self.historical_data_path = 'historical_data.csv'
-        self.tick_data_path = 'market_data.csv'
+        self.streams = {}  # symbol -> SymbolStream
+        self.streams_by_req_id = {}  # reqId -> SymbolStream, for both market data and historical requests
+        self.historical_data = {}  # reqId -> bars collected so far
+        self.request_started = {}  # reqId -> perf_counter time of the request, only when metrics are enabled
+        self.id_lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.first_bars_written = None  # Seconds from start to the first bars on disk, for the startup log
+
+        # Callbacks only queue the data, the writer thread does the file I/O. Live data must not wait for the
+        # disk, so ticks are dropped when the queue is full; replays use 'block' to keep every tick.
+        self.writer = DataWriter({'tick': self.write_ticks, 'bars': self.write_bars, 'archive': self.archive_sessions},
+                                 policy=writer_policy)
+        self.writer.start()
+
+        self.keep_up_to_date = False  # True -> one streaming request per symbol instead of polling
+        self.request_interval = 60  # Seconds between historical requests of one symbol
+        self.first_request_second = 2  # Second of the minute when the first symbol is requested
+        self.request_spacing = 1.0  # Max seconds between the requests of consecutive symbols
+
+        self.bar_intervals = (60,)  # Live bar sizes in seconds built for every symbol, only the minute bars are stored
+        self.bar_write_interval = 0.25  # Min seconds between writes of the forming minute bar
+        self.bar_time_zone = None  # Time zone of the IB bar timestamps, None = local time
+        self.volume_multiplier = 100  # IB reports stock volume in lots of 100
+        self.clock = datetime.now  # Source of tick timestamps, replaced when replaying recorded data
+        self.storage = 'csv'  # Storage backend for new symbols: 'csv', 'numpy' or 'shm'
+        self.rules = None  # RuleEngine evaluated on the live ticks, bars and executions
+        self.checked_stops = set()  # (orderId, stop price) of the stop orders already given to the rules
+        self.session_end = dtime(20, 0)  # Local time after which the day's ticks and bars are archived
+        self.archived_date = None  # Date of the last end-of-session archive
+        self.snapshot_interval = 60  # Seconds between warm-start snapshots
+        self.snapshot_max_age = 8 * 3600  # Older snapshots are ignored and a full day is requested
+        self.last_req_id = 0  # Newest request id of the previous run, from the snapshot
+
+    def stop_writer(self):
+        """Stops the writer thread after the queued records are written. Returns the number of dropped ticks."""
+        self.writer.stop()
+        dropped = self.writer.stats()['dropped']
+        if dropped:
+            print(f"Warning: {dropped} ticks were dropped because the writer queue was full.")
+        return dropped
+
+    def enable_metrics(self, port=None, log_interval=None):
+        """Turns on the instrumentation, serving it on `port` and logging it every `log_interval` seconds."""
+        METRICS.gauge('writer_queue_depth', 'Records waiting for the writer thread', function=self.writer.queue_depth)
+        METRICS.gauge('writer_dropped_ticks', 'Ticks dropped because the writer queue was full', function=lambda: self.writer.dropped)
+        METRICS.gauge('writer_errors', 'Writer handler errors', function=lambda: self.writer.errors)
+        METRICS.enable(port, log_interval=log_interval)
 
     def nextValidId(self, orderId):
-        self.orderId = orderId
-    
+        with self.id_lock:
+            # Never go back to ids that were already used, e.g. when this arrives late
+            self.orderId = max(orderId, self.last_req_id, self.orderId or 0)
+        self.ready.set()
+
     def nextId(self):
-        self.orderId += 1
-        return self.orderId
-    
+        with self.id_lock:
+            self.orderId += 1
+            return self.orderId
+
     def error(self, reqId, errorCode, errorString):
         """Handle errors by printing details unless the error code is 2176."""
         if errorCode != 2176:
-            print(f"reqId: {reqId}, errorCode: {errorCode}, errorString: {errorString}")
+            stream = self.streams_by_req_id.get(reqId)
+            symbol = f", symbol: {stream.symbol}" if stream else ""
+            print(f"reqId: {reqId}{symbol}, errorCode: {errorCode}, errorString: {errorString}")
+
+        if errorCode == 1100:  # Connectivity between IB and TWS lost
+            for stream in self.streams.values():
+                stream.backfill.reset()
+        elif reqId in self.historical_data and not is_warning(errorCode):
+            if self.request_started.pop(reqId, None) is not None:
+                _historical_errors.inc()
+            self.streams_by_req_id[reqId].backfill.on_error(reqId)
+            self.end_historical_request(reqId)
+
+    def connectionClosed(self):
+        for stream in self.streams.values():
+            stream.backfill.reset()
+
+    def add_symbol(self, symbol):
+        """Adds a symbol to the watchlist and returns its stream."""
+        stream = self.streams.get(symbol)
+        if stream is None:
+            stream = self.streams[symbol] = SymbolStream(symbol, self.bar_intervals, self.storage)
+            stream.minute_bars.on_bar_close = lambda bar: self.on_minute_bar_close(stream, bar)
+        return stream
+
+    def start_market_data(self):
+        """Subscribes to market data for every symbol in the watchlist."""
+        for stream in self.streams.values():
+            stream.market_data_req_id = self.nextId()
+            self.streams_by_req_id[stream.market_data_req_id] = stream
+            self.reqMktData(stream.market_data_req_id, stream.contract, "", False, False, [])
 
 
     def tickPrice(self, reqId: int, tickType, price, attrib):
-        """Handles tick price updates."""
-        save_market_data(self.tick_data_path, self.tick_buffer, tickType, price, self.buffer_limit)
+        """Handles LAST price ticks. The tick is queued for the writer thread once its size arrives, see tickSize."""
+        if TickTypeEnum.to_str(tickType) == "LAST":
+            stream = self.streams_by_req_id.get(reqId)
+            if stream is not None:
+                started = time.perf_counter() if METRICS.enabled else None
+                timestamp = self.clock()
+                if stream.last_trade is not None:
+                    # No LAST_SIZE came for the previous trade
+                    self.writer.put_tick((reqId, tickType), (stream, *stream.last_trade, 0.0))
+                stream.last_trade = (timestamp, price)
+                self.update_live_bars(stream, price)
+                if self.rules is not None:
+                    # Same bar as the aggregator put the trade in, see bar_clock
+                    self.rules.on_tick(stream.symbol, timestamp, price, stream.minute_bars.bar.time)
+                if started is not None:
+                    _ticks.inc()
+                    _tick_callback.observe(time.perf_counter() - started)
+
+    def tickSize(self, reqId: TickerId, tickType, size):
+        """Queues the LAST tick with its size (LAST_SIZE) and adds the traded volume to the live bars (VOLUME).
+
+        The IB decoder calls tickSize with LAST_SIZE right after tickPrice with LAST,
+        from the same message.
+        """
+        tick_type = TickTypeEnum.to_str(tickType)
+        if tick_type == "LAST_SIZE":
+            stream = self.streams_by_req_id.get(reqId)
+            if stream is not None and stream.last_trade is not None:
+                self.writer.put_tick((reqId, TickTypeEnum.LAST), (stream, *stream.last_trade, float(size) * self.volume_multiplier))
+                stream.last_trade = None
+        elif tick_type == "VOLUME":
+            stream = self.streams_by_req_id.get(reqId)
+            if stream is not None:
+                bar_time = self.bar_clock()
+                for aggregator in stream.aggregators.values():
+                    aggregator.on_total_volume(bar_time, float(size) * self.volume_multiplier)
+
+    def bar_clock(self):
+        """Returns the current time in the time zone of the IB bars, without tzinfo."""
+        if self.bar_time_zone is None:
+            return self.clock()
+        return datetime.now(ZoneInfo(self.bar_time_zone)).replace(tzinfo=None)
+
+    def update_live_bars(self, stream, price):
+        """Feeds a trade to the live bar aggregators and queues the forming minute bar."""
+        bar_time = self.bar_clock()
+        forming = stream.minute_bars.bar
+
+        for aggregator in stream.aggregators.values():
+            aggregator.on_price(bar_time, price)
+
+        rows = []
+        if forming is not None and forming is not stream.minute_bars.bar:
+            rows.append(forming.to_row())  # Final values of the bar that just closed
+
+        if stream.backfill.covered_until is None:
+            # Wait for the backfill, the bar store ignores bars older than its last bar
+            return
+
+        now = time.monotonic()
+        if rows or now - stream.last_bar_write >= self.bar_write_interval:
+            rows.append(stream.minute_bars.bar.to_row())
+            stream.last_bar_write = now
+            self.writer.put_bars(stream.market_data_req_id, (stream, rows))
+
+    def on_minute_bar_close(self, stream, bar):
+        """Called by the minute bar aggregator when a live bar closes."""
+        if self.rules is not None:
+            self.rules.on_bar(stream.symbol, bar)
+
+    def execDetails(self, reqId, contract, execution):
+        """Checks the entry rules for executions, also of orders placed in TWS."""
+        if self.rules is not None:
+            self.rules.on_execution(contract.symbol, self.clock(), execution.side, execution.price, float(execution.shares))
+
+    def openOrder(self, orderId, contract, order, orderState):
+        """Checks the stop rules when a stop order is placed or modified.
+
+        TWS sends openOrder again on every status change and reqOpenOrders, each
+        stop price of an order is checked only once.
+        """
+        if self.rules is not None and order.orderType in ('STP', 'STP LMT', 'TRAIL'):
+            if (orderId, order.auxPrice) in self.checked_stops:
+                return
+            self.checked_stops.add((orderId, order.auxPrice))
+            self.rules.on_stop_order(contract.symbol, self.clock(), order.auxPrice)
 
     def historicalData(self, reqId, bar):
         # Scale volume by a factor of 100
-        scaled_volume = bar.volume * 100
-        
+        scaled_volume = bar.volume * self.volume_multiplier
+
         # Collect the historical data with scaled volume
-        self.historical_data.append([
+        self.historical_data.setdefault(reqId, []).append([
             bar.date, bar.open, bar.high, bar.low, bar.close, scaled_volume
         ])
-    
+
+    def historicalDataUpdate(self, reqId, bar):
+        """Handles bar updates of a keepUpToDate request."""
+        stream = self.streams_by_req_id.get(reqId)
+        if stream is not None:
+            self.writer.put_bars(reqId, (stream, [[bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume * self.volume_multiplier]]))
+
     def historicalDataEnd(self, reqId, start, end):
+        stream = self.streams_by_req_id.get(reqId)
+        bars = self.historical_data.get(reqId, [])
+        if stream is None:
+            return
+
+        started = self.request_started.pop(reqId, None)
+        if started is not None:
+            _round_trip.observe(time.perf_counter() - started)
+
+        last_bar_date = bars[-1][0] if bars else None
+        stream.backfill.on_response(reqId, last_bar_date)
+
+        if self.rules is not None:
+            # Warm up the rule indicators with the closed bars, the last one may still be forming.
+            # Done before the reconcile below, whose closed bars would otherwise be taken as the newest ones.
+            closed = []
+            for row in bars[:-1]:
+                try:
+                    bar_time = datetime.strptime(bar_key(row[0]), '%Y%m%d %H:%M:%S')
+                except ValueError:
+                    continue
+                closed.append(Bar(bar_time, row[1], row[2], row[3], row[4], row[5]))
+            self.rules.warm_up(stream.symbol, closed)
+
+        # IB bars are authoritative for the live bars that are still kept in memory
+        for row in bars[-stream.minute_bars.history - 1:]:
+            try:
+                bar_time = datetime.strptime(bar_key(row[0]), '%Y%m%d %H:%M:%S')
+            except ValueError:
+                continue
+            stream.minute_bars.reconcile(bar_time, row[1], row[2], row[3], row[4], row[5])
+
+        # Queue the historical data for the writer thread
+        self.writer.put_bars(reqId, (stream, bars))
+
+        self.end_historical_request(reqId)
+
+    def end_historical_request(self, reqId):
+        """Forgets the routing of a finished historical request."""
+        self.historical_data.pop(reqId, None)
+        if not self.keep_up_to_date:
+            self.streams_by_req_id.pop(reqId, None)
+
+    @METRICS.timed('storage_write_ticks_seconds', 'Duration of tick batch writes in the writer thread')
+    def write_ticks(self, ticks):
+        """Writer thread handler for queued ticks."""
+        by_stream = {}
+        for stream, timestamp, price, size in ticks:
+            by_stream.setdefault(stream, []).append((timestamp, price, size))
+
+        for stream, stream_ticks in by_stream.items():
+            stream.storage.write_ticks(stream_ticks)
+
+    @METRICS.timed('storage_write_bars_seconds', 'Duration of bar batch writes in the writer thread')
+    def write_bars(self, bar_lists):
+        """Writer thread handler for queued historical data."""
+        for stream, bars in bar_lists:
+            stream.storage.write_bars(bars)
+        if self.first_bars_written is None:
+            self.first_bars_written = time.perf_counter() - self.started
+            print(f"First bars written {self.first_bars_written:.2f} s after start.")
+
+
+    def save_snapshot(self):
+        """Saves what a restarted streamer needs to continue: backfill coverage, rule indicators and the last request id."""
+        symbols = {symbol: {'covered_until': stream.backfill.covered_until_epoch(), 'last_bar_date': stream.backfill.last_bar_date}
+                   for symbol, stream in self.streams.items()}
+        state = {'last_req_id': self.orderId or 0, 'symbols': symbols,
+                 'rules': self.rules.snapshot() if self.rules is not None else {}}
+        try:
+            save_snapshot(snapshot_path('streamer'), state)
+        except Exception as e:
+            print(f"Error saving the snapshot: {e}")
+
+    def restore_snapshot(self):
+        """Continues from the snapshot of the previous run, so only the gap since then is requested.
+
+        A symbol is resumed only if its storage still has the bars the snapshot had
+        seen, e.g. not on a new day or with new shared memory blocks.
+        """
+        state, _ = load_snapshot(snapshot_path('streamer'), max_age=self.snapshot_max_age)
+        if state is None:
+            return []
 
-        # Save the historical data using the csv_operations module
-        num_new_rows = save_historical_data(self.historical_data_path, self.historical_data)
-        
-        # Clear the historical data after saving
-        self.historical_data = []
-        
+        resumed = []
+        for symbol, saved in state['symbols'].items():
+            stream = self.streams.get(symbol)
+            if stream is None or saved['covered_until'] is None or saved['last_bar_date'] is None:
+                continue
+            stored = stream.storage.last_bar_key()
+            if stored is None or stored < bar_key(saved['last_bar_date']):
+                continue
+            stream.backfill.resume(saved['covered_until'], saved['last_bar_date'])
+            resumed.append(symbol)
 
-    def monitor_time_and_request_historical_data(self, contract):
+        if self.rules is not None:
+            self.rules.restore({symbol: rules for symbol, rules in state['rules'].items() if symbol in resumed})
+        self.last_req_id = state['last_req_id']
+        if resumed:
+            print(f"Resumed {', '.join(resumed)} from the snapshot, only the gap is requested.")
+        return resumed
+
+    def archive_sessions(self, streams_lists):
+        """Writer thread handler that archives the session of the queued streams."""
+        for streams in streams_lists:
+            for stream in streams:
+                stream.storage.archive_session()
+
+    def archive_if_session_ended(self, current_time):
+        """Queues the end-of-session archive of every symbol once a day, after session_end."""
+        if current_time.time() >= self.session_end and self.archived_date != current_time.date():
+            self.archived_date = current_time.date()
+            self.writer.put('archive', None, list(self.streams.values()))
+
+    def request_historical_data(self, stream, current_time, req_id=None):
+        """Requests the bars missing since the previous request of the symbol."""
+        if req_id is None:
+            req_id = self.nextId()
+        self.streams_by_req_id[req_id] = stream
+        self.historical_data[req_id] = []
+        if METRICS.enabled:
+            self.request_started[req_id] = time.perf_counter()
+
+        if self.keep_up_to_date:
+            # Streaming bars need an empty end time
+            stream.backfill.on_request(req_id)
+            self.reqHistoricalData(req_id, stream.contract, "", "1 D", "1 min", "TRADES", 0, 1, True, [])
+            return req_id
+
+        formatted_time = current_time.strftime('%Y%m%d %H:%M:%S US/Eastern')
+        duration = stream.backfill.next_duration()
+
+        stream.backfill.on_request(req_id)
+        self.reqHistoricalData(req_id, stream.contract, formatted_time, duration, "1 min", "TRADES", 0, 1, False, [])
+        return req_id
+
+    def schedule_historical_requests(self, now):
+        """Staggers the first historical request of each symbol across the request interval."""
+        streams = list(self.streams.values())
+        spacing = min(self.request_spacing, self.request_interval / max(len(streams), 1))
+        cycle_start = now - now % self.request_interval + self.first_request_second
+        if cycle_start < now:
+            cycle_start += self.request_interval
+
+        for index, stream in enumerate(streams):
+            stream.next_request_time = cycle_start + index * spacing
+
+    def monitor_time_and_request_historical_data(self):
+        # The first request goes out right away, a warm start only asks for the gap
+        for stream in self.streams.values():
+            try:
+                self.request_historical_data(stream, datetime.now())
+            except Exception as e:
+                print(f"Error making request for {stream.symbol}: {e}")
+        if not self.keep_up_to_date:
+            self.schedule_historical_requests(time.time())
+
+        last_snapshot = time.monotonic()
         while True:
             current_time = datetime.now()
-            current_second = current_time.second
-
-            # Calculate the seconds until the next 2-second mark
-            seconds_until_next_request = (2 - current_second % 60) % 60
-
-            if seconds_until_next_request <= 0:
-                # Prepare the request parameters
-                req_id = self.nextId()
-                formatted_time = current_time.strftime('%Y%m%d %H:%M:%S US/Eastern')
-                
-                # Debugging output
-                #print(f"Request ID: {req_id}")
-                #print(f"Request Time: {formatted_time}")
-                #print(f"Contract: {contract}")
-
-                # Perform the historical data request
-                try:
-                    self.reqHistoricalData(req_id, contract, formatted_time, "1 D", "1 min", "TRADES", 0, 1, False, [])
-                except Exception as e:
-                    print(f"Error making request: {e}")
+            if not self.keep_up_to_date:
+                self.request_due_historical_data(time.time(), current_time)
+            self.archive_if_session_ended(current_time)
 
-                # Sleep until the next second to prevent multiple requests within the same second
-                time.sleep(1)
+            if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                last_snapshot = time.monotonic()
+                self.save_snapshot()
 
             # Sleep for a short duration before checking the time again
-            time.sleep(0.5)  # Check every 0.5 seconds
+            time.sleep(0.1)
+
+    def request_due_historical_data(self, now, current_time):
+        """Sends the historical requests whose time has come. `now` is epoch seconds."""
+        for stream in self.streams.values():
+            if stream.next_request_time > now:
+                continue
+
+            # Perform the historical data request
+            try:
+                self.request_historical_data(stream, current_time)
+            except Exception as e:
+                print(f"Error making request for {stream.symbol}: {e}")
+
+            # Skip missed slots instead of sending them all at once
+            while stream.next_request_time <= now:
+                stream.next_request_time += self.request_interval
+
+
+def main(symbols=WATCHLIST, host="127.0.0.1"):
+    app = TestApp()
+    for symbol in symbols:
+        app.add_symbol(symbol)
+
+    app.rules = RuleEngine(RULES, alert_handlers=[print_alert, AlertLog()])
+    app.restore_snapshot()
+
+    if metrics_port is not None or metrics_log_interval:
+        app.enable_metrics(metrics_port, metrics_log_interval)
 
+    app.connect(host, port, 0)
+    threading.Thread(target=app.run, name='EReader', daemon=True).start()
+    if not app.ready.wait(10):
+        print("No nextValidId from TWS within 10 s, continuing after the request ids of the previous run.")
+        with app.id_lock:
+            if app.orderId is None:
+                app.orderId = app.last_req_id
 
-app = TestApp()
-app.connect("127.0.0.1", port, 0)
-threading.Thread(target=app.run).start()
-time.sleep(1)
+    app.reqMarketDataType(1)
+    app.reqAutoOpenOrders(True)  # Orders placed in TWS are reported to client 0 for the rules
+    app.start_market_data()
+    try:
+        # Requests the historical data on schedule until Ctrl+C
+        app.monitor_time_and_request_historical_data()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.save_snapshot()
+        app.disconnect()
+        app.stop_writer()
+        for stream in app.streams.values():
+            stream.storage.close()
 
-mycontract = Contract()
-mycontract.symbol = "NVDA"
-mycontract.secType = "STK"
-mycontract.exchange = "SMART"
-mycontract.currency = "USD"
 
-app.reqMarketDataType(1)
-app.reqMktData(app.nextId(), mycontract, "", False, False, [])
-# Start a separate thread to monitor the time and request historical data
-threading.Thread(target=app.monitor_time_and_request_historical_data, args=(mycontract,)).start()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Compressed archive of past sessions: one Parquet file per symbol, kind and day.
+
+    archive/NVDA/2024-06-03_ticks.parquet
+    archive/NVDA/2024-06-03_bars.parquet
+    archive/index.csv
+
+The files hold the records of the storage rings (see storage.TICK_DTYPE and
+BAR_DTYPE) with 'time' as a timestamp column, compressed with zstd. index.csv
+lists every file with its symbol, kind, date, row count and first and last time,
+so a query opens only the files of the days it needs and reads only the
+requested columns:
+
+    python archive.py NVDA --start 2024-05-01 --end 2024-06-01 --fields close,volume
+
+pandas and pyarrow are only imported when the archive is read or written.
+"""
+import argparse
+import csv
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from csv_operations import atomic_write_csv, BAR_REWRITE_WINDOW
+
+
+KINDS = ('ticks', 'bars')
+INDEX_HEADERS = ['symbol', 'kind', 'date', 'path', 'rows', 'first_time', 'last_time']
+
+_index_lock = threading.RLock()  # Every storage of the process updates the same index, read_index may rebuild it
+
+
+def partition_path(symbol, kind, day):
+    """Returns the path of a day file relative to the archive root."""
+    return os.path.join(symbol, f'{day}_{kind}.parquet')
+
+
+def _to_datetime64(value):
+    return None if value is None else np.datetime64(value, 'ns')
+
+
+class Archive:
+    """Date-partitioned Parquet archive of ticks and bars under `root`."""
+
+    def __init__(self, root='archive'):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.csv')
+
+    def read_index(self):
+        """Returns the index rows as dicts, rebuilding the index from the files if it is missing."""
+        if not os.path.exists(self.index_path):
+            return self.rebuild_index() if os.path.isdir(self.root) else []
+        with open(self.index_path, 'r', newline='') as file:
+            return list(csv.DictReader(file))
+
+    def _write_index(self, rows):
+        os.makedirs(self.root, exist_ok=True)
+        rows = sorted(rows, key=lambda row: (row['symbol'], row['kind'], row['date']))
+        atomic_write_csv(self.index_path, INDEX_HEADERS, [[row[header] for header in INDEX_HEADERS] for row in rows])
+
+    def rebuild_index(self):
+        """Scans the day files under the root and rewrites the index, e.g. for files archived before it existed."""
+        import pyarrow.parquet as pq
+
+        rows = []
+        for symbol in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, symbol)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                day, _, kind = name.removesuffix('.parquet').partition('_')
+                if not name.endswith('.parquet') or kind not in KINDS:
+                    continue
+                times = pq.read_table(os.path.join(directory, name), columns=['time'])['time'].to_numpy()
+                rows.append(self._index_row(symbol, kind, day, times))
+        with _index_lock:
+            self._write_index(rows)
+        return rows
+
+    @staticmethod
+    def _index_row(symbol, kind, day, times):
+        return {'symbol': symbol, 'kind': kind, 'date': str(day), 'path': partition_path(symbol, kind, day),
+                'rows': len(times),
+                'first_time': str(times[0].astype('M8[us]')) if len(times) else '',
+                'last_time': str(times[-1].astype('M8[us]')) if len(times) else ''}
+
+    def write(self, symbol, kind, records):
+        """Archives ring records (a structured array with an int64 ns 'time' field) of any number of days.
+
+        Records are merged into the existing day files: the rows of a file from the
+        first new record on are replaced, so archiving the same session again, e.g.
+        after a restart, does not duplicate it.
+        """
+        import pandas as pd
+
+        if kind not in KINDS:
+            raise ValueError(f"Unknown archive kind '{kind}', expected one of {KINDS}")
+        if len(records) == 0:
+            return
+
+        df = pd.DataFrame(np.asarray(records))
+        df['time'] = df['time'].astype('datetime64[ns]')
+        days = df['time'].values.astype('M8[D]')
+        written = []
+        for day in np.unique(days):
+            day_df = df[days == day]
+            path = os.path.join(self.root, partition_path(symbol, kind, day))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                old = pd.read_parquet(path)
+                old = old[old['time'] < day_df['time'].iloc[0]]
+                day_df = pd.concat([old, day_df], ignore_index=True)
+
+            # Written next to the file and renamed over it, readers never see a partial file
+            temp_path = path + '.tmp'
+            day_df.to_parquet(temp_path, compression='zstd', index=False)
+            os.replace(temp_path, path)
+            written.append(self._index_row(symbol, kind, day, day_df['time'].values))
+            print(f"Archived {len(day_df)} {kind} of {symbol} for {day} to '{path}'.")
+
+        with _index_lock:
+            keys = {(row['symbol'], row['kind'], row['date']) for row in written}
+            rows = [row for row in self.read_index() if (row['symbol'], row['kind'], row['date']) not in keys]
+            self._write_index(rows + written)
+
+    def partitions(self, symbol, kind='bars', start=None, end=None):
+        """Returns the index rows of the day files of `symbol` that have records in [start, end)."""
+        start, end = _to_datetime64(start), _to_datetime64(end)
+        selected = []
+        for row in self.read_index():
+            if row['symbol'] != symbol or row['kind'] != kind or not int(row['rows']):
+                continue
+            if start is not None and np.datetime64(row['last_time'], 'ns') < start:
+                continue
+            if end is not None and np.datetime64(row['first_time'], 'ns') >= end:
+                continue
+            selected.append(row)
+        return sorted(selected, key=lambda row: row['date'])
+
+    def load(self, symbol, start=None, end=None, fields=None, kind='bars'):
+        """Returns the archived records of `symbol` with start <= time < end as a DataFrame.
+
+        `fields` are the columns besides 'time' to read, all of them if None. Only
+        the day files that overlap the range are opened, and only the requested
+        columns of them are read.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = None if fields is None else ['time'] + [field for field in fields if field != 'time']
+        tables = [pq.read_table(os.path.join(self.root, row['path']), columns=columns)
+                  for row in self.partitions(symbol, kind, start, end)]
+        if not tables:
+            import pandas as pd
+            return pd.DataFrame(columns=columns or ['time'])
+
+        df = pa.concat_tables(tables).to_pandas()
+        # Only the first and last day can have records outside the range
+        times = df['time'].values
+        first = 0 if start is None else np.searchsorted(times, _to_datetime64(start))
+        last = len(df) if end is None else np.searchsorted(times, _to_datetime64(end))
+        if first or last < len(df):
+            df = df.iloc[first:last].reset_index(drop=True)
+        return df
+
+
+def load(symbol, start=None, end=None, fields=None, kind='bars', root='archive'):
+    """Reads archived bars or ticks of `symbol` with start <= time < end, see Archive.load."""
+    return Archive(root).load(symbol, start, end, fields, kind)
+
+
+class SessionArchiver:
+    """Collects the ticks and bars of the running session and archives them when the day changes or on close.
+
+    Used by the storage backends that do not keep the whole session themselves.
+    Bars are upserted like in the bar ring: a bar with the time of one of the
+    newest BAR_REWRITE_WINDOW bars replaces it and older bars are ignored.
+    """
+
+    def __init__(self, symbol, archive, tick_dtype, bar_dtype, chunk_size=65536):
+        self.symbol = symbol
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.buffers = {'ticks': np.zeros(chunk_size, dtype=tick_dtype), 'bars': np.zeros(chunk_size, dtype=bar_dtype)}
+        self.counts = {'ticks': 0, 'bars': 0}
+
+    def _roll_day(self, kind, first_time_ns):
+        count = self.counts[kind]
+        if count and (first_time_ns // 86_400_000_000_000) > (int(self.buffers[kind]['time'][count - 1]) // 86_400_000_000_000):
+            self.flush(kind)
+
+    def _append(self, kind, records):
+        buffer, count = self.buffers[kind], self.counts[kind]
+        if count + len(records) > len(buffer):
+            grown = np.zeros(count + len(records) + self.chunk_size, dtype=buffer.dtype)
+            grown[:count] = buffer[:count]
+            buffer = self.buffers[kind] = grown
+        buffer[count:count + len(records)] = records
+        self.counts[kind] = count + len(records)
+
+    def add_ticks(self, records):
+        if len(records):
+            self._roll_day('ticks', int(records['time'][0]))
+            self._append('ticks', records)
+
+    def add_bar(self, record):
+        """Adds one bar record (a tuple in the order of the bar dtype)."""
+        buffer, count = self.buffers['bars'], self.counts['bars']
+        if count:
+            if record[0] <= int(buffer['time'][count - 1]):
+                start = max(count - BAR_REWRITE_WINDOW, 0)
+                index = start + int(np.searchsorted(buffer['time'][start:count], record[0]))
+                if buffer['time'][index] == record[0]:
+                    buffer[index] = record
+                return
+        self._roll_day('bars', record[0])
+        self._append('bars', np.array([record], dtype=buffer.dtype))
+
+    def flush(self, kind=None):
+        """Archives the collected records of `kind`, or of both kinds, and starts over."""
+        for kind in ([kind] if kind else KINDS):
+            count = self.counts[kind]
+            if not count:
+                continue
+            try:
+                self.archive.write(self.symbol, kind, self.buffers[kind][:count])
+            except Exception as e:
+                print(f"Error archiving {kind} of {self.symbol}: {e}")
+            self.counts[kind] = 0
+
+
+def archive_csv_files(symbol, archive, bars_path, ticks_path):
+    """Archives the bars and ticks left in the CSV files of an earlier day before they are cleared.
+
+    The tick CSV only keeps the newest ticks, the whole session is archived by the
+    SessionArchiver of the CSV storage on close. This keeps the data of a session
+    that ended without closing the storage.
+    """
+    import pandas as pd
+    from storage import TICK_DTYPE, BAR_DTYPE, bar_time_ns
+    from csv_operations import read_second_row, process_timestamp_from_row
+
+    for kind, path in (('bars', bars_path), ('ticks', ticks_path)):
+        first_date = process_timestamp_from_row(read_second_row(path)) if os.path.exists(path) else None
+        if first_date is None or first_date >= date.today():
+            continue
+        try:
+            df = pd.read_csv(path)
+            if kind == 'bars':
+                records = np.array([(bar_time_ns(row.date), row.open, row.high, row.low, row.close, row.volume)
+                                    for row in df.itertuples()], dtype=BAR_DTYPE)
+            else:
+                records = np.zeros(len(df), dtype=TICK_DTYPE)
+                records['time'] = pd.to_datetime(df['time'], format='mixed').values.astype('M8[ns]').astype('i8')
+                records['price'] = df['price'].values
+            archive.write(symbol, kind, records)
+        except Exception as e:
+            print(f"Error archiving '{path}': {e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the archive of past sessions.")
+    parser.add_argument('symbol')
+    parser.add_argument('--kind', choices=KINDS, default='bars')
+    parser.add_argument('--start', help="first time to load, e.g. 2024-05-01")
+    parser.add_argument('--end', help="time to load up to (exclusive)")
+    parser.add_argument('--fields', help="comma separated columns, all by default")
+    parser.add_argument('--root', default='archive')
+    parser.add_argument('--rebuild-index', action='store_true', help="rebuild index.csv from the files first")
+    args = parser.parse_args()
+
+    archive = Archive(args.root)
+    if args.rebuild_index:
+        print(f"Archive index of '{args.root}' rebuilt with {len(archive.rebuild_index())} files.")
+
+    started = time.perf_counter()
+    df = archive.load(args.symbol, args.start and datetime.fromisoformat(args.start),
+                      args.end and datetime.fromisoformat(args.end), args.fields and args.fields.split(','), args.kind)
+    print(f"Loaded {len(df)} {args.kind} of {args.symbol} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(df)
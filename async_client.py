@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from LiveDataStreamer import TestApp, WATCHLIST, RULES, port, metrics_port, metrics_log_interval, is_warning
+from rules import RuleEngine, AlertLog, print_alert
+
+
+class HistoricalDataError(Exception):
+    """A historical request ended in an error from TWS."""
+
+    def __init__(self, reqId, errorCode, errorString):
+        super().__init__(f"reqId {reqId}: {errorCode} {errorString}")
+        self.reqId = reqId
+        self.errorCode = errorCode
+
+
+class PacingLimiter:
+    """Keeps historical requests within the IB pacing limits.
+
+    At most `max_per_key` requests for the same contract in any `key_period`
+    seconds, and if `max_requests` is set, at most that many requests in any
+    `period` seconds. The defaults are the limits of TWS: 6 requests of one
+    contract per 2 seconds, and no overall limit. TWS limits bars of 30 seconds or
+    less to 60 requests per 10 minutes, see for_bar_size.
+    """
+
+    def __init__(self, max_requests=None, period=600.0, max_per_key=6, key_period=2.0, clock=time.monotonic):
+        self.max_requests = max_requests
+        self.period = period
+        self.max_per_key = max_per_key
+        self.key_period = key_period
+        self.clock = clock
+        self.sent = deque()  # Send times of the requests within `period`
+        self.sent_by_key = {}  # key -> deque of send times within `key_period`
+        self.waits = 0  # Requests that had to wait
+
+    @classmethod
+    def for_bar_size(cls, bar_size_seconds, **kwargs):
+        """Returns a limiter with the limits TWS applies to requests of `bar_size_seconds` bars."""
+        if bar_size_seconds <= 30:
+            kwargs.setdefault('max_requests', 60)
+        return cls(**kwargs)
+
+    def delay(self, key=None):
+        """Returns the seconds until a request for `key` is allowed, 0 if it is allowed now."""
+        now = self.clock()
+        while self.sent and now - self.sent[0] >= self.period:
+            self.sent.popleft()
+        delay = 0.0
+        if self.max_requests is not None and len(self.sent) >= self.max_requests:
+            delay = self.sent[0] + self.period - now
+
+        key_sent = self.sent_by_key.get(key)
+        if key_sent:
+            while key_sent and now - key_sent[0] >= self.key_period:
+                key_sent.popleft()
+            if len(key_sent) >= self.max_per_key:
+                delay = max(delay, key_sent[0] + self.key_period - now)
+        return delay
+
+    def record(self, key=None):
+        now = self.clock()
+        self.sent.append(now)
+        self.sent_by_key.setdefault(key, deque()).append(now)
+
+    async def acquire(self, key=None):
+        """Waits until a request for `key` is allowed and records it."""
+        delay = self.delay(key)
+        if delay > 0:
+            self.waits += 1
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.delay(key)
+        self.record(key)
+
+
+class AsyncTestApp(TestApp):
+    """TestApp driven by an asyncio event loop instead of the sleep-polling thread.
+
+    The EReader thread still decodes the messages and calls the EWrapper methods;
+    the results are handed to the event loop with call_soon_threadsafe.
+    connect_async waits for nextValidId, request_historical returns the bars of one
+    request or raises on error or timeout, and run_schedule sends the requests of
+    every symbol on a fixed wall-clock grid through a PacingLimiter.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self._ready = None  # Future resolved by nextValidId
+        self._requests = {}  # reqId -> future of a historical request
+        self.limiter = PacingLimiter.for_bar_size(60)  # Requests of 1 min bars
+        self.request_timeout = 30.0  # Seconds to wait for historicalDataEnd
+
+    def _resolve(self, future, result=None, exception=None):
+        def resolve():
+            if not future.done():
+                if exception is not None:
+                    future.set_exception(exception)
+                else:
+                    future.set_result(result)
+        self.loop.call_soon_threadsafe(resolve)
+
+    def nextValidId(self, orderId):
+        super().nextValidId(orderId)
+        if self._ready is not None:
+            self._resolve(self._ready, orderId)
+
+    def historicalDataEnd(self, reqId, start, end):
+        bars = self.historical_data.get(reqId, [])
+        super().historicalDataEnd(reqId, start, end)
+        future = self._requests.get(reqId)
+        if future is not None:
+            self._resolve(future, bars)
+
+    def error(self, reqId, errorCode, errorString):
+        future = self._requests.get(reqId) if reqId in self.historical_data and not is_warning(errorCode) else None
+        super().error(reqId, errorCode, errorString)
+        if future is not None:
+            self._resolve(future, exception=HistoricalDataError(reqId, errorCode, errorString))
+
+    def connectionClosed(self):
+        super().connectionClosed()
+        if self.loop is not None:
+            for future in list(self._requests.values()):
+                self._resolve(future, exception=ConnectionError("Connection to TWS closed"))
+
+    async def connect_async(self, host, port, clientId, timeout=10.0):
+        """Connects and starts the reader thread. Returns when TWS has sent nextValidId."""
+        self.loop = asyncio.get_running_loop()
+        self._ready = self.loop.create_future()
+        await self.loop.run_in_executor(None, self.connect, host, port, clientId)
+        if not self.isConnected():
+            raise ConnectionError(f"Could not connect to TWS on {host}:{port}")
+
+        threading.Thread(target=self.run, name='EReader', daemon=True).start()
+        return await asyncio.wait_for(self._ready, timeout)
+
+    async def request_historical(self, stream, timeout=None):
+        """Requests the missing bars of a symbol and returns them as rows once historicalDataEnd arrives."""
+        await self.limiter.acquire(stream.symbol)
+
+        req_id = self.nextId()
+        future = self._requests[req_id] = self.loop.create_future()
+        try:
+            self.request_historical_data(stream, self.clock(), req_id)
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        except asyncio.TimeoutError:
+            # The next request covers the window again
+            self.cancelHistoricalData(req_id)
+            stream.backfill.on_error(req_id)
+            self.end_historical_request(req_id)
+            raise
+        finally:
+            self._requests.pop(req_id, None)
+
+    async def poll_symbol(self, stream, offset):
+        """Requests the bars of one symbol every request_interval seconds, `offset` seconds into each interval.
+
+        The send times are computed from the wall clock every time, so they do not
+        drift, and a slot that was missed is skipped instead of sent late.
+        """
+        interval = self.request_interval
+        while True:
+            now = time.time()
+            next_time = ((now - offset) // interval + 1) * interval + offset
+            await asyncio.sleep(next_time - now)
+
+            started = time.perf_counter()
+            try:
+                bars = await self.request_historical(stream)
+            except asyncio.TimeoutError:
+                print(f"Historical request of {stream.symbol} timed out after {self.request_timeout} s")
+                continue
+            except (HistoricalDataError, ConnectionError) as e:
+                print(f"Historical request of {stream.symbol} failed: {e}")
+                continue
+            late = time.time() - next_time
+            print(f"{stream.symbol}: {len(bars)} bars in {time.perf_counter() - started:.3f} s, sent {late:.3f} s after the slot")
+
+    async def run_schedule(self):
+        """Runs the historical requests of every symbol on this event loop."""
+        # The first request goes out right away, a warm start only asks for the gap
+        results = await asyncio.gather(*(self.request_historical(stream) for stream in self.streams.values()),
+                                       return_exceptions=True)
+        for stream, result in zip(self.streams.values(), results):
+            if isinstance(result, BaseException):
+                print(f"First historical request of {stream.symbol} failed: {result!r}")
+        if self.keep_up_to_date:
+            return
+
+        streams = list(self.streams.values())
+        spacing = min(self.request_spacing, self.request_interval / max(len(streams), 1))
+        await asyncio.gather(*(self.poll_symbol(stream, self.first_request_second + index * spacing)
+                               for index, stream in enumerate(streams)))
+
+    async def save_snapshots(self):
+        """Saves a warm-start snapshot every snapshot_interval seconds."""
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            self.save_snapshot()
+
+    async def archive_sessions_when_ended(self, interval=1.0):
+        """Checks every `interval` seconds whether the session has ended and queues its archive, see archive_if_session_ended."""
+        while True:
+            await asyncio.sleep(interval)
+            self.archive_if_session_ended(self.clock())
+
+
+async def main(symbols=WATCHLIST, host="127.0.0.1"):
+    app = AsyncTestApp()
+    for symbol in symbols:
+        app.add_symbol(symbol)
+
+    app.rules = RuleEngine(RULES, alert_handlers=[print_alert, AlertLog()])
+    app.restore_snapshot()
+    if metrics_port is not None or metrics_log_interval:
+        app.enable_metrics(metrics_port, metrics_log_interval)
+
+    await app.connect_async(host, port, 0)
+    app.reqMarketDataType(1)
+    app.reqAutoOpenOrders(True)
+    app.start_market_data()
+    try:
+        await asyncio.gather(app.run_schedule(), app.save_snapshots(), app.archive_sessions_when_ended())
+    finally:
+        app.save_snapshot()
+        app.disconnect()
+        app.stop_writer()
+        for stream in app.streams.values():
+            stream.storage.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,84 @@
+import time
+
+
+# Durations in seconds that are tried from the smallest up when filling a gap
+DURATION_LADDER = [60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 28800]
+
+
+class BackfillScheduler:
+    """Picks the smallest reqHistoricalData duration that covers the missing bars.
+
+    The scheduler remembers when the last successful request was sent. The next
+    request only has to cover the time since then plus `margin_bars` bars, so that
+    the bar that was still forming gets its final values. A full day is requested on
+    cold start, after a disconnect and when the gap is longer than `max_gap` seconds.
+
+    Times are measured with the local monotonic clock, so the result does not depend
+    on the time zone of the bar timestamps. After a restart, resume() continues from
+    the coverage saved by the previous process, so only the gap is requested.
+    """
+
+    def __init__(self, bar_size_seconds=60, margin_bars=1, max_gap=DURATION_LADDER[-1], full_duration="1 D"):
+        self.bar_size_seconds = bar_size_seconds
+        self.margin_bars = margin_bars
+        self.max_gap = max_gap
+        self.full_duration = full_duration
+        self.covered_until = None  # Monotonic time up to which we have all bars
+        self.resumed_until = None  # Monotonic time covered by the previous process, see resume
+        self.last_bar_date = None  # Date string of the newest bar received
+        self._pending = {}  # reqId -> monotonic time the request was sent
+
+    def next_duration(self, now=None):
+        """Returns the duration string for the next request."""
+        covered_until = self.covered_until if self.covered_until is not None else self.resumed_until
+        if covered_until is None:
+            return self.full_duration
+
+        now = time.monotonic() if now is None else now
+        gap = now - covered_until + self.margin_bars * self.bar_size_seconds
+        if gap > self.max_gap:
+            return self.full_duration
+
+        for seconds in DURATION_LADDER:
+            if seconds >= gap:
+                return f"{seconds} S"
+        return self.full_duration
+
+    def on_request(self, reqId, now=None):
+        """Records that a request was sent."""
+        self._pending[reqId] = time.monotonic() if now is None else now
+
+    def on_response(self, reqId, last_bar_date=None):
+        """Records that a request completed; everything up to its send time is now covered."""
+        sent = self._pending.pop(reqId, None)
+        if sent is None:
+            return
+        if self.covered_until is None or sent > self.covered_until:
+            self.covered_until = sent
+        if last_bar_date is not None:
+            self.last_bar_date = last_bar_date
+
+    def on_error(self, reqId):
+        """Forgets a failed request so that the next one covers its window again."""
+        self._pending.pop(reqId, None)
+
+    def covered_until_epoch(self):
+        """Returns covered_until as epoch seconds for a snapshot, or None."""
+        if self.covered_until is None:
+            return None
+        return time.time() - (time.monotonic() - self.covered_until)
+
+    def resume(self, covered_until_epoch, last_bar_date=None):
+        """Continues from the coverage of an earlier process (epoch seconds, see covered_until_epoch).
+
+        covered_until stays None until the first response, so callers still wait
+        for the gap to be filled before writing live bars.
+        """
+        self.resumed_until = time.monotonic() - (time.time() - covered_until_epoch)
+        self.last_bar_date = last_bar_date
+
+    def reset(self):
+        """Forgets all state, e.g. after a disconnect, so the next request is a full day."""
+        self.covered_until = None
+        self.resumed_until = None
+        self._pending.clear()
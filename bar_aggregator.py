@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+
+class Bar:
+    """OHLCV bar that starts at `time`."""
+
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time, open, high, low, close, volume=0.0):
+        self.time = time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    def to_row(self, date_format='%Y%m%d %H:%M:%S'):
+        """Returns the bar as a row in the layout of the historical data CSV."""
+        return [self.time.strftime(date_format), self.open, self.high, self.low, self.close, self.volume]
+
+    def __repr__(self):
+        return f"Bar({self.time}, {self.open}, {self.high}, {self.low}, {self.close}, {self.volume})"
+
+
+class BarAggregator:
+    """Builds OHLCV bars of `interval_seconds` from live ticks.
+
+    Prices come from LAST ticks through on_price. Volume comes from the cumulative
+    VOLUME tick through on_total_volume, the difference to the previous value is
+    added to the forming bar. A bar is closed when the first tick of a later bar
+    arrives; closed bars are passed to `on_bar_close` and the newest `history` of
+    them are kept for reconciliation.
+
+    IB historical bars are authoritative: reconcile replaces the values of the
+    forming bar or a kept closed bar with the ones from IB.
+    """
+
+    def __init__(self, interval_seconds, on_bar_close=None, history=10):
+        if 86400 % interval_seconds != 0:
+            raise ValueError(f"Interval of {interval_seconds} s does not divide a day evenly")
+
+        self.interval_seconds = interval_seconds
+        self.on_bar_close = on_bar_close
+        self.history = history
+        self.bar = None  # Forming bar
+        self.closed_bars = []  # Newest last
+        self.last_total_volume = None
+
+    def bar_start(self, timestamp):
+        """Returns the start time of the bar that `timestamp` belongs to."""
+        midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds = (timestamp - midnight).total_seconds()
+        return midnight + timedelta(seconds=seconds - seconds % self.interval_seconds)
+
+    def _roll(self, start, price):
+        """Closes the forming bar if `start` is later and returns the bar for `start`."""
+        if self.bar is not None and start <= self.bar.time:
+            return self.bar if start == self.bar.time else None
+
+        if self.bar is not None:
+            self.closed_bars.append(self.bar)
+            del self.closed_bars[:-self.history]
+            if self.on_bar_close is not None:
+                self.on_bar_close(self.bar)
+
+        self.bar = Bar(start, price, price, price, price)
+        return self.bar
+
+    def on_price(self, timestamp, price):
+        """Adds a trade price. Returns the forming bar, or None for a tick older than it."""
+        bar = self._roll(self.bar_start(timestamp), price)
+        if bar is None:
+            return None
+
+        if price > bar.high:
+            bar.high = price
+        if price < bar.low:
+            bar.low = price
+        bar.close = price
+        return bar
+
+    def on_total_volume(self, timestamp, total_volume):
+        """Adds the volume traded since the previous cumulative VOLUME tick to the forming bar."""
+        previous, self.last_total_volume = self.last_total_volume, total_volume
+        if previous is None or total_volume < previous:
+            # First value of the day, or the counter was reset
+            return
+
+        if self.bar is not None and self.bar_start(timestamp) >= self.bar.time:
+            self.bar.volume += total_volume - previous
+
+    def reconcile(self, time, open, high, low, close, volume):
+        """Replaces the values of the bar starting at `time` with the ones from IB.
+
+        Returns the bar that was updated or created, or None if the bar is too old.
+        """
+        if self.bar is None or time > self.bar.time:
+            bar = self._roll(time, close)
+        elif time == self.bar.time:
+            # Live ticks are newer than the IB snapshot, keep their close and extremes
+            bar = self.bar
+            bar.open = open
+            bar.high = max(high, bar.high)
+            bar.low = min(low, bar.low)
+            bar.volume = volume
+            return bar
+        else:
+            bar = next((closed for closed in reversed(self.closed_bars) if closed.time == time), None)
+            if bar is None:
+                return None
+
+        bar.open = open
+        bar.high = high
+        bar.low = low
+        bar.close = close
+        bar.volume = volume
+        return bar
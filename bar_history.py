@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+
+class BarHistory:
+    """Session history of OHLCV bars in preallocated NumPy columns.
+
+    The columns grow in chunks of `chunk_size` bars, so appending a bar costs O(1)
+    amortized and never copies the history like pd.concat does. Bars older than
+    `retention` (a pandas Timedelta or anything it accepts, None = keep all)
+    before the newest bar are dropped; their space is reused by moving the kept
+    bars to the front once the dropped part is larger than the kept part.
+
+    Times are int64 nanoseconds of the naive bar start time.
+    """
+
+    columns = ('open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, chunk_size=4096, retention=None):
+        self.chunk_size = chunk_size
+        self.retention = None if retention is None else pd.Timedelta(retention).value
+        self.times = np.zeros(chunk_size, dtype='i8')
+        self.values = np.zeros((len(self.columns), chunk_size), dtype='f8')
+        self.start = 0  # First kept bar
+        self.end = 0  # One past the newest bar
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def empty(self):
+        return self.end == self.start
+
+    @property
+    def last_time(self):
+        """Start time of the newest bar as a pandas Timestamp, or None."""
+        return pd.Timestamp(self.times[self.end - 1]) if self.end > self.start else None
+
+    def _make_room(self, count):
+        if self.end + count <= len(self.times):
+            return
+        kept = self.end - self.start
+        if self.start >= kept and kept + count <= len(self.times):
+            # Move the kept bars over the dropped ones
+            self.times[:kept] = self.times[self.start:self.end]
+            self.values[:, :kept] = self.values[:, self.start:self.end]
+        else:
+            capacity = len(self.times)
+            while capacity < kept + count:
+                capacity += self.chunk_size
+            times = np.zeros(capacity, dtype='i8')
+            values = np.zeros((len(self.columns), capacity), dtype='f8')
+            times[:kept] = self.times[self.start:self.end]
+            values[:, :kept] = self.values[:, self.start:self.end]
+            self.times, self.values = times, values
+        self.start, self.end = 0, kept
+
+    def upsert(self, bars):
+        """Adds bars from a DataFrame with 'date' and OHLCV columns, sorted by date.
+
+        A bar with the time of a kept bar replaces it, newer bars are appended.
+        Returns the number of bars appended.
+        """
+        times = bars['date'].values.astype('M8[ns]')
+        values = np.array([bars[column].values for column in self.columns], dtype='f8')
+        valid = ~np.isnat(times)
+        if not valid.all():
+            times, values = times[valid], values[:, valid]
+        return self.upsert_arrays(times.view('i8'), values)
+
+    def upsert_arrays(self, times, values):
+        """Like upsert, from int64 nanosecond times and a (5, n) array of OHLCV values."""
+        if len(times) == 0:
+            return 0
+
+        # Bars up to the newest one replace kept bars with the same time
+        split = np.searchsorted(times, self.times[self.end - 1], side='right') if self.end > self.start else 0
+        if split:
+            kept_times = self.times[self.start:self.end]
+            positions = np.searchsorted(kept_times, times[:split])
+            found = positions < len(kept_times)
+            found[found] = kept_times[positions[found]] == times[:split][found]
+            self.values[:, self.start + positions[found]] = values[:, :split][:, found]
+
+        count = len(times) - split
+        if count:
+            self._make_room(count)
+            self.times[self.end:self.end + count] = times[split:]
+            self.values[:, self.end:self.end + count] = values[:, split:]
+            self.end += count
+            self._apply_retention()
+        return count
+
+    def _apply_retention(self):
+        if self.retention is None:
+            return
+        oldest = self.times[self.end - 1] - self.retention
+        self.start += int(np.searchsorted(self.times[self.start:self.end], oldest))
+
+    def arrays(self, since=None):
+        """Returns views of the times and (5, n) values of the kept bars starting at or after `since` (int64 ns)."""
+        start = self.start
+        if since is not None:
+            start += int(np.searchsorted(self.times[self.start:self.end], since))
+        return self.times[start:self.end], self.values[:, start:self.end]
+
+    def frame(self):
+        """Returns the kept bars as a DataFrame for chart.set, built on views of the columns.
+
+        The frame is only valid until the next upsert, copy it to keep it.
+        """
+        return arrays_to_frame(*self.arrays())
+
+
+def arrays_to_frame(times, values):
+    """Builds a bar DataFrame on views of int64 nanosecond times and a (5, n) array of OHLCV values."""
+    df = pd.DataFrame(values.T, columns=list(BarHistory.columns), copy=False)
+    df.insert(0, 'date', times.view('M8[ns]'))
+    return df
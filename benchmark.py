@@ -0,0 +1,434 @@
+"""Benchmarks for the tick and bar persistence paths.
+
+Replays a synthetic or recorded tick stream through a TestApp that is never
+connected to TWS and measures per-call latency percentiles, throughput, file I/O
+and peak memory for each storage backend. Results are saved as JSON and can be
+compared against an earlier run to catch regressions:
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --compare results.json
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from csv_operations import save_market_data, save_historical_data, close_historical_data_stores
+from DataPlotter import calculate_vwap, filter_new_ticks
+from LiveDataStreamer import TestApp
+from vwap import VwapEngine
+from bar_history import BarHistory
+from archive import Archive
+from storage import BAR_DTYPE, bar_record
+
+SYMBOL = 'NVDA'
+LAST = 4  # TickTypeEnum LAST
+LAST_SIZE = 5  # TickTypeEnum LAST_SIZE
+VOLUME = 8  # TickTypeEnum VOLUME
+
+
+def synthetic_session(ticks=200_000, start=None, open_price=130.0, seed=1):
+    """Generates a session of (datetime, price, total_volume) ticks.
+
+    The tick rate is highest at the opening auction and decays during the first
+    half hour, similar to a busy NVDA open.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.now().replace(hour=9, minute=30, second=0, microsecond=0)
+    timestamp = start
+    price = open_price
+    total_volume = 0
+    session = []
+    for _ in range(ticks):
+        elapsed = (timestamp - start).total_seconds()
+        rate = 50 + 2000 * np.exp(-elapsed / 600)  # Ticks per second
+        timestamp += timedelta(seconds=rng.expovariate(rate))
+        price = round(price + rng.gauss(0, 0.02), 2)
+        total_volume += rng.randint(1, 20)
+        session.append((timestamp, price, total_volume))
+    return session
+
+
+def recorded_session(csv_file_path):
+    """Reads (datetime, price, total_volume) ticks from a tick CSV with 'time' and 'price' columns."""
+    session = []
+    with open(csv_file_path, 'r', newline='') as file:
+        for index, row in enumerate(csv.DictReader(file)):
+            session.append((datetime.fromisoformat(row['time']), float(row['price']), index))
+    return session
+
+
+class BenchApp(TestApp):
+    """TestApp that never talks to TWS. Requests are ignored and the clock follows the replay."""
+
+    def __init__(self, storage):
+        super().__init__(writer_policy='block')
+        self.orderId = 0
+        self.storage = storage
+        self.replay_time = None
+        self.clock = lambda: self.replay_time
+
+    def reqMktData(self, *args):
+        pass
+
+    def reqHistoricalData(self, *args):
+        pass
+
+    def reqMarketDataType(self, *args):
+        pass
+
+
+class IoCounter:
+    """Counts read/write system calls and bytes of this process from /proc/self/io."""
+
+    fields = ('syscr', 'syscw', 'rchar', 'wchar')
+
+    @staticmethod
+    def read():
+        try:
+            with open('/proc/self/io') as file:
+                values = dict(line.split(': ') for line in file.read().splitlines())
+            return {field: int(values[field]) for field in IoCounter.fields}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def __enter__(self):
+        self.start = self.read()
+        self.result = None
+        return self
+
+    def __exit__(self, *exc):
+        end = self.read()
+        if self.start is not None and end is not None:
+            self.result = {field: end[field] - self.start[field] for field in self.fields}
+
+
+def latency_summary(latencies_ns):
+    """Returns latency percentiles in microseconds."""
+    if len(latencies_ns) == 0:
+        return {}
+    values = np.asarray(latencies_ns, dtype='f8') / 1000
+    percentiles = np.percentile(values, [50, 90, 99, 99.9])
+    return {
+        'p50_us': percentiles[0],
+        'p90_us': percentiles[1],
+        'p99_us': percentiles[2],
+        'p999_us': percentiles[3],
+        'max_us': values.max(),
+        'mean_us': values.mean(),
+    }
+
+
+def run_measured(name, backend, function, measure_memory):
+    """Runs `function` (returning (latencies_ns, items, extra)) and collects the metrics."""
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            with IoCounter() as io:
+                started = time.perf_counter()
+                latencies, items, extra = function()
+                elapsed = time.perf_counter() - started
+
+            peak_memory = None
+            if measure_memory:
+                # Separate pass, tracemalloc would distort the latencies
+                for path in os.listdir('.'):
+                    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+                tracemalloc.start()
+                function()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    result = {
+        'name': name,
+        'backend': backend,
+        'items': items,
+        'seconds': elapsed,
+        'throughput_per_s': items / elapsed if elapsed else None,
+        'latency': latency_summary(latencies),
+        'io': io.result,
+        'peak_memory_bytes': peak_memory,
+    }
+    result.update(extra)
+    print(f"{name:<28} {backend:<6} {items:>8} items  {result['throughput_per_s'] or 0:>12.0f}/s  "
+          f"p99 {result['latency'].get('p99_us', 0):>9.1f} us")
+    return result
+
+
+def bench_tick_path(session, backend):
+    """Replays ticks through tickPrice/tickSize and waits until the writer has drained the queue."""
+    def run():
+        app = BenchApp(backend)
+        stream = app.add_symbol(SYMBOL)
+        stream.market_data_req_id = app.nextId()
+        app.streams_by_req_id[stream.market_data_req_id] = stream
+        stream.backfill.covered_until = 0.0  # Pretend the backfill is done so live bars are written
+        req_id = stream.market_data_req_id
+
+        latencies = np.empty(len(session), dtype='i8')
+        perf_counter_ns = time.perf_counter_ns
+        for index, (timestamp, price, total_volume) in enumerate(session):
+            app.replay_time = timestamp
+            started = perf_counter_ns()
+            app.tickPrice(req_id, LAST, price, None)
+            app.tickSize(req_id, LAST_SIZE, 1)
+            app.tickSize(req_id, VOLUME, total_volume)
+            latencies[index] = perf_counter_ns() - started
+
+        if app.stop_writer():
+            raise RuntimeError("The writer dropped ticks, the results do not cover the whole session")
+        stream.storage.close()
+        stats = app.writer.stats()
+        return latencies, len(session), {'writer': stats}
+
+    return run
+
+
+def bench_legacy_market_data(session):
+    """Per-tick save_market_data, the original CSV path."""
+    def run():
+        tick_buffer = []
+        latencies = np.empty(len(session), dtype='i8')
+        for index, (_, price, _) in enumerate(session):
+            started = time.perf_counter_ns()
+            save_market_data('market_data.csv', tick_buffer, LAST, price, 1)
+            latencies[index] = time.perf_counter_ns() - started
+        return latencies, len(session), {}
+
+    return run
+
+
+def synthetic_day_bars(minutes=390, start=None, open_price=130.0, seed=1):
+    """Generates the 1-minute bar rows of a regular trading session, as IB would return them."""
+    rng = random.Random(seed)
+    start = start or datetime.now().replace(hour=9, minute=30, second=0, microsecond=0)
+    price = open_price
+    bars = []
+    for minute in range(minutes):
+        open_ = price
+        price = round(price + rng.gauss(0, 0.2), 2)
+        high = round(max(open_, price) + abs(rng.gauss(0, 0.05)), 2)
+        low = round(min(open_, price) - abs(rng.gauss(0, 0.05)), 2)
+        date = (start + timedelta(minutes=minute)).strftime('%Y%m%d %H:%M:%S')
+        bars.append([date, open_, high, low, price, rng.randint(100, 5000) * 100])
+    return bars
+
+
+def session_bars(session):
+    """Builds the 1-minute bar rows of a recorded tick session, as IB would return them."""
+    bars = {}
+    for timestamp, price, _ in session:
+        key = timestamp.strftime('%Y%m%d %H:%M:00')
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = [key, price, price, price, price, 1]
+        else:
+            bar[2] = max(bar[2], price)
+            bar[3] = min(bar[3], price)
+            bar[4] = price
+            bar[5] += 1
+    return list(bars.values())
+
+
+def bench_historical(bars, window):
+    """Calls save_historical_data once per minute with the last `window` bars (None = all so far)."""
+    def run():
+        latencies = np.empty(len(bars), dtype='i8')
+        for minute in range(1, len(bars) + 1):
+            response = bars[:minute] if window is None else bars[max(minute - window, 0):minute]
+            started = time.perf_counter_ns()
+            save_historical_data('historical_data.csv', response)
+            latencies[minute - 1] = time.perf_counter_ns() - started
+        close_historical_data_stores()
+        return latencies, len(bars), {}
+
+    return run
+
+
+def bench_plotter_functions(bars, session):
+    """filter_new_ticks and calculate_vwap against the streaming VwapEngine."""
+    df = pd.DataFrame(bars, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+    df['date'] = pd.to_datetime(df['date'], format='%Y%m%d %H:%M:%S')
+    ticks = pd.DataFrame([(timestamp, price) for timestamp, price, _ in session[-200:]], columns=['time', 'price'])
+
+    def run_filter():
+        latencies = []
+        for _ in range(200):
+            started = time.perf_counter_ns()
+            filter_new_ticks(df.copy(), ticks.copy())
+            latencies.append(time.perf_counter_ns() - started)
+        return latencies, 200, {'bars': len(df)}
+
+    def run_vwap():
+        latencies = []
+        for _ in range(200):
+            started = time.perf_counter_ns()
+            calculate_vwap(df)
+            latencies.append(time.perf_counter_ns() - started)
+        return latencies, 200, {'bars': len(df)}
+
+    def run_engine():
+        engine = VwapEngine()
+        rows = list(df.itertuples())
+        latencies = np.empty(len(rows), dtype='i8')
+        for index, bar in enumerate(rows):
+            started = time.perf_counter_ns()
+            engine.update_bar(bar.date, bar.high, bar.low, bar.close, bar.volume)
+            latencies[index] = time.perf_counter_ns() - started
+        return latencies, len(rows), {'bars': len(df)}
+
+    return run_filter, run_vwap, run_engine
+
+
+def bench_bar_history(bars, preloaded_days=10):
+    """Appending one bar at a time with pd.concat against BarHistory.upsert, after `preloaded_days` of history."""
+    df = pd.DataFrame(bars, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+    df['date'] = pd.to_datetime(df['date'], format='%Y%m%d %H:%M:%S')
+    # One-bar frames like the ones the plotter reads
+    rows = [pd.DataFrame([row], columns=df.columns) for row in df.itertuples(index=False)]
+    preloaded = pd.concat([df.assign(date=df['date'] - pd.Timedelta(days=day)) for day in range(preloaded_days, 0, -1)],
+                          ignore_index=True)
+
+    def run_concat():
+        history = preloaded
+        latencies = np.empty(len(rows), dtype='i8')
+        for index, row in enumerate(rows):
+            started = time.perf_counter_ns()
+            history = pd.concat([history, row], ignore_index=True)
+            latencies[index] = time.perf_counter_ns() - started
+        return latencies, len(rows), {}
+
+    def run_history():
+        history = BarHistory()
+        history.upsert(preloaded)
+        latencies = np.empty(len(rows), dtype='i8')
+        for index, row in enumerate(rows):
+            started = time.perf_counter_ns()
+            history.upsert(row)
+            latencies[index] = time.perf_counter_ns() - started
+        return latencies, len(rows), {}
+
+    return run_concat, run_history
+
+
+def bench_archive_load(bars, days=21, loads=20):
+    """Archives `days` copies of the session's bars, then loads the whole range `loads` times."""
+    records = np.array([bar_record(row) for row in bars], dtype=BAR_DTYPE)
+    day_ns = 86_400_000_000_000
+
+    def run():
+        archive = Archive('archive')
+        for day in range(days, 0, -1):
+            shifted = records.copy()
+            shifted['time'] -= day * day_ns
+            archive.write(SYMBOL, 'bars', shifted)
+
+        start = (records['time'][0] - days * day_ns).astype('M8[ns]')
+        latencies = np.empty(loads, dtype='i8')
+        for index in range(loads):
+            started = time.perf_counter_ns()
+            df = archive.load(SYMBOL, start, records['time'][0].astype('M8[ns]'))
+            latencies[index] = time.perf_counter_ns() - started
+        return latencies, loads * len(df), {'bars_per_load': len(df)}
+
+    return run
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against a baseline run and returns the number of regressions."""
+    previous = {(r['name'], r['backend']): r for r in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get((result['name'], result['backend']))
+        if old is None or not old.get('throughput_per_s') or not old['latency'].get('p99_us'):
+            continue
+        throughput = result['throughput_per_s'] / old['throughput_per_s']
+        p99 = result['latency']['p99_us'] / old['latency']['p99_us']
+        regressed = throughput < 1 - threshold or p99 > 1 + threshold
+        regressions += regressed
+        print(f"{result['name']:<28} {result['backend']:<6} throughput x{throughput:.2f}  p99 x{p99:.2f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks', type=int, default=200_000, help='number of synthetic ticks')
+    parser.add_argument('--replay', help='tick CSV to replay instead of a synthetic session')
+    parser.add_argument('--legacy-ticks', type=int, default=2_000, help='ticks for the slow per-tick save_market_data path')
+    parser.add_argument('--backends', default='csv,numpy', help='comma separated storage backends')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory pass')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown before a regression is reported')
+    args = parser.parse_args()
+
+    session = recorded_session(args.replay) if args.replay else synthetic_session(args.ticks)
+    bars = session_bars(session) if args.replay else synthetic_day_bars()
+    measure_memory = not args.no_memory
+    print(f"Replaying {len(session)} ticks, {len(bars)} one-minute bars.")
+
+    results = []
+    for backend in args.backends.split(','):
+        results.append(run_measured('tick_path', backend, bench_tick_path(session, backend), measure_memory))
+
+    results.append(run_measured('save_market_data_legacy', 'csv', bench_legacy_market_data(session[:args.legacy_ticks]), measure_memory))
+    results.append(run_measured('save_historical_data_1D', 'csv', bench_historical(bars, None), measure_memory))
+    results.append(run_measured('save_historical_data_2bars', 'csv', bench_historical(bars, 2), measure_memory))
+
+    run_filter, run_vwap, run_engine = bench_plotter_functions(bars, session)
+    results.append(run_measured('filter_new_ticks', 'pandas', run_filter, measure_memory))
+    results.append(run_measured('calculate_vwap', 'pandas', run_vwap, measure_memory))
+    results.append(run_measured('vwap_engine_update_bar', 'python', run_engine, measure_memory))
+
+    run_concat, run_history = bench_bar_history(bars)
+    results.append(run_measured('bar_append_concat', 'pandas', run_concat, measure_memory))
+    results.append(run_measured('bar_append_history', 'numpy', run_history, measure_memory))
+
+    results.append(run_measured('archive_load_month', 'parquet', bench_archive_load(bars), measure_memory))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'version': git_version(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'ticks': len(session),
+        'bars': len(bars),
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, default=float)
+    print(f"Results saved to '{args.output}'.")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
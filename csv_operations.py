@@ -1,10 +1,27 @@
 import os
+import io
 import csv
+import time
+import threading
+import numpy as np
 from datetime import datetime
 from ibapi.ticktype import TickTypeEnum
 from datetime import datetime, timedelta
+from tick_ring import TickRing
+from metrics import METRICS
 
 
+_file_rewrites = METRICS.counter('csv_file_rewrites_total', 'CSV files rewritten or truncated')
+
+
+def historical_data_path(symbol):
+    """Returns the path of the historical bar CSV of a symbol."""
+    return f'historical_data_{symbol}.csv'
+
+def market_data_path(symbol):
+    """Returns the path of the tick CSV of a symbol."""
+    return f'market_data_{symbol}.csv'
+
 # true if csv is there, otherwise false
 def is_csv_found(csv_file_path):
     return os.path.exists(csv_file_path)
@@ -56,6 +73,8 @@ def recreate_csv_file(csv_file_path):
         writer = csv.writer(file)
         if headers:
             writer.writerow(headers)  # Write the headers back into the file
+    if METRICS.enabled:
+        _file_rewrites.inc()
     print(f"CSV file '{csv_file_path}' recreated with existing headers.")
     return True
 
@@ -221,9 +240,7 @@ def remove_excess_data(csv_file_path, lines_to_remove=400):
         header = rows[0]
         remaining_rows = rows[:1] + rows[lines_to_remove + 1:]  # Keep the header and remove the first `lines_to_remove` rows
 
-        with open(csv_file_path, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(remaining_rows)
+        atomic_write_csv(csv_file_path, header, remaining_rows[1:])
 
         print(f"Removed the first {lines_to_remove} data rows from '{csv_file_path}'. {len(remaining_rows) - 1} rows remain.")
         return True
@@ -231,28 +248,20 @@ def remove_excess_data(csv_file_path, lines_to_remove=400):
     return False
 
 
+@METRICS.timed('save_historical_data_seconds', 'Duration of save_historical_data calls')
 def save_historical_data(csv_file_path, historical_data):
-    """Main function to save historical data to a CSV file, handling creation and recreation if needed."""
-    
-    headers = ['date', 'open', 'high', 'low', 'close', 'volume']
-    
-    if not is_csv_found(csv_file_path):
-    # Create CSV if it doesn't exist
-        create_csv_file(csv_file_path,headers)
+    """Main function to save historical data to a CSV file, handling creation and recreation if needed.
 
-    if is_there_old_data(csv_file_path): # Jos csv:ssä on vanhaa dataa tee se uudelleen
-    # Recreate leaving headers if there was old data to be found
-        recreate_csv_file(csv_file_path)
-        existing_timestamps = set()  # Start with an empty set since the file was recreated
-    else:
-        # Only read existing timestamps if the file was not recreated
-        existing_timestamps = read_existing_timestamps(csv_file_path)
-    
-    # Filter and save new data
-    new_rows = filter_new_data(historical_data, existing_timestamps)
-    append_new_data_to_csv(csv_file_path, new_rows)
+    Uses a HistoricalBarStore per file, so each call only costs as much as the number of new bars.
+    """
+    store = _bar_stores.get(csv_file_path)
+    if store is None:
+        store = _bar_stores[csv_file_path] = HistoricalBarStore(csv_file_path)
+
+    return store.upsert(historical_data)
 
 
+@METRICS.timed('save_market_data_seconds', 'Duration of save_market_data calls')
 def save_market_data(csv_file_path, tick_buffer, tickType, price, buffer_limit):
     """Handles incoming tick price updates, buffers the data, and writes to CSV when the buffer is full.
 
@@ -274,3 +283,343 @@ def save_market_data(csv_file_path, tick_buffer, tickType, price, buffer_limit):
   # Process the tick price data
     process_last_price_tick(tick_buffer, tickType, price, buffer_limit, csv_file_path)
 
+
+
+def atomic_write_csv(csv_file_path, headers, rows, retries=5):
+    """Writes a CSV file into a temporary file and renames it over `csv_file_path`.
+
+    Readers see either the old or the new file, never a half-written one.
+    """
+    temp_path = csv_file_path + '.tmp'
+    with open(temp_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        writer.writerows(rows)
+        file.flush()
+        os.fsync(file.fileno())
+
+    for attempt in range(retries):
+        try:
+            os.replace(temp_path, csv_file_path)
+            if METRICS.enabled:
+                _file_rewrites.inc()
+            return
+        except PermissionError:
+            # Windowsilla lukija voi pitää tiedostoa hetken auki
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.01)
+
+
+def bar_key(date_str):
+    """Returns the comparable part of a bar timestamp, i.e. without the time zone suffix."""
+    return ' '.join(str(date_str).split()[:2])
+
+
+def encode_csv_rows(rows):
+    """Encodes rows into CSV bytes the same way csv.writer writes them to a file."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+# Newest bars that can still be corrected in place, e.g. by the final values from IB
+# after the live bar has closed. Covers the closed bars kept by the live bar aggregators.
+BAR_REWRITE_WINDOW = 16
+
+
+class HistoricalBarStore:
+    """Incremental store for the historical bar CSV file.
+
+    The timestamps, encoded lines and file offsets of the newest `rewrite_window`
+    bars are kept in memory. upsert appends only bars newer than the last one and
+    rewrites the file from the oldest of the kept bars that changed, so the final
+    values of a closed bar replace its live ones and the file is never re-read
+    after it has been opened. Older bars are left as they are.
+
+    Rows are written with the date as bar_key and the values as floats, so a bar
+    from IB (two spaces in the date, Decimal volume) and the same bar from the live
+    aggregator encode to the same line and are not rewritten for nothing.
+    """
+
+    headers = ['date', 'open', 'high', 'low', 'close', 'volume']
+
+    def __init__(self, csv_file_path, rewrite_window=BAR_REWRITE_WINDOW):
+        self.csv_file_path = csv_file_path
+        self.rewrite_window = rewrite_window
+        self.last_key = None  # bar_key of the last persisted bar
+        self.date = None  # Date of the data currently in the file
+        self._tail = []  # [bar_key, file offset, encoded row] of the newest bars, oldest first
+        self._file = None
+        self._open()
+
+    def _open(self):
+        """Opens the store, reading an existing file once to find the last bars."""
+        if not is_csv_found(self.csv_file_path):
+            create_csv_file(self.csv_file_path, self.headers)
+
+        self._file = open(self.csv_file_path, 'a+b')
+        self._file.seek(0)
+        self._file.readline()  # Skip the header
+
+        first_line = None
+        offset = self._file.tell()
+        for line in iter(self._file.readline, b''):
+            if first_line is None:
+                first_line = line
+            self._tail.append([None, offset, line])
+            del self._tail[:-self.rewrite_window]
+            offset += len(line)
+
+        for entry in self._tail:
+            entry[0] = bar_key(next(csv.reader([entry[2].decode()]))[0])
+
+        if first_line is not None:
+            first_row = next(csv.reader([first_line.decode()]))
+            self.date = process_timestamp_from_row([bar_key(first_row[0])])
+            self.last_key = self._tail[-1][0]
+
+            if self.date is not None and self.date < datetime.today().date():  # Vanhaa dataa -> tyhjennetään
+                self._truncate_to_header()
+
+    def _truncate_to_header(self):
+        """Removes every bar from the file, keeping the header."""
+        self._file.seek(0)
+        header_length = len(self._file.readline())
+        self._file.truncate(header_length)
+        self.last_key = None
+        self.date = None
+        self._tail = []
+        if METRICS.enabled:
+            _file_rewrites.inc()
+        print(f"CSV file '{self.csv_file_path}' recreated with existing headers.")
+
+    def upsert(self, historical_data):
+        """Appends bars newer than the last stored bar and updates the kept bars that changed.
+
+        Returns the number of rows written.
+        """
+        new_rows = []
+        updated = {}  # Index in _tail -> changed row
+        last_key = self.last_key
+        positions = {entry[0]: index for index, entry in enumerate(self._tail)}
+
+        for row in historical_data:
+            key = bar_key(row[0])
+            row = [key] + [float(value) for value in row[1:]]
+            if last_key is None or key > last_key:
+                if not new_rows and self.date is not None:
+                    # A bar from a later day starts a new file
+                    bar_date = process_timestamp_from_row([key])
+                    if bar_date is not None and bar_date > self.date:
+                        self._truncate_to_header()
+                        updated, positions = {}, {}
+                new_rows.append(row)
+                last_key = key
+            elif key in positions:
+                index = positions[key]
+                if encode_csv_rows([row]) != self._tail[index][2]:
+                    updated[index] = row
+
+        if not updated and not new_rows:
+            return 0
+
+        # (bar_key, encoded row) of everything written, from the oldest changed bar on
+        lines = [(row[0], encode_csv_rows([row])) for row in new_rows]
+        offset = self._file.seek(0, os.SEEK_END)
+        if updated:
+            # Kirjoitetaan muuttuneet kynttilät ja niiden jälkeiset uudelleen
+            first = min(updated)
+            offset = self._tail[first][1]
+            rewritten = [(key, encode_csv_rows([updated[index]]) if index in updated else line)
+                         for index, (key, _, line) in enumerate(self._tail) if index >= first]
+            lines = rewritten + lines
+            del self._tail[first:]
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+        for key, line in lines:
+            self._tail.append([key, offset, line])
+            offset += self._file.write(line)
+        self._file.flush()
+        del self._tail[:-self.rewrite_window]
+
+        self.last_key = self._tail[-1][0]
+        if self.date is None:
+            self.date = process_timestamp_from_row([self._tail[0][0]])
+
+        if new_rows:
+            print(f"{len(new_rows)} new rows added to '{self.csv_file_path}'.")
+            print("Last row added:", new_rows[-1])
+        return len(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_bar_stores = {}  # csv_file_path -> HistoricalBarStore, used by save_historical_data
+
+
+def close_historical_data_stores():
+    """Closes the stores opened by save_historical_data, e.g. before the files are moved."""
+    for store in _bar_stores.values():
+        store.close()
+    _bar_stores.clear()
+
+
+class TickJournal:
+    """Append-only writer for the tick CSV file.
+
+    Keeps one file handle open and appends ticks in batches. The row count and the
+    date of the data are tracked in memory, so the file is never re-read on the tick
+    path. The newest ticks are also kept in `recent_ticks`, a TickRing of
+    `rows_to_keep` ticks.
+
+    Ticks given to `write` are flushed when `batch_size` of them are buffered, and
+    at the latest `flush_interval` seconds after the first of them arrived, by a
+    timer thread when no more ticks come.
+
+    The file is rolled over when the day changes (only the header is kept) and when
+    it grows past `max_rows` (only the ticks in `recent_ticks` are kept). Rollovers
+    are written to a temporary file and renamed over the old one, so readers never
+    see a torn file. The file layout is the same as the one written by
+    save_market_data.
+    """
+
+    headers = ['time', 'price']
+    timestamp_format = '%Y-%m-%d %H:%M:%S.%f%z'
+
+    def __init__(self, csv_file_path, batch_size=10, flush_interval=0.5, max_rows=200, rows_to_keep=100):
+        self.csv_file_path = csv_file_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.rows_to_keep = rows_to_keep
+        self.row_count = 0
+        self.date = None  # Date of the data currently in the file
+        self.buffer = []  # (datetime, price) or (datetime, price, size) ticks not yet written, the size is not journaled
+        self.last_flush = time.monotonic()
+        self.recent_ticks = TickRing(rows_to_keep)  # Newest ticks, used when rolling over by size
+        self.rewrites = 0
+        self._file = None
+        self._writer = None
+        self._lock = threading.RLock()  # The flush timer runs on its own thread
+        self._timer = None
+        self._open()
+
+    def _open(self):
+        """Opens the journal, reading an existing file once to restore the in-memory state."""
+        if is_csv_found(self.csv_file_path):
+            with open(self.csv_file_path, 'r', newline='') as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip the header
+                rows = [row for row in reader if row]
+
+            if rows:
+                self.date = process_timestamp_from_row(rows[0])
+                self.row_count = len(rows)
+                recent = rows[-self.rows_to_keep:]
+                try:
+                    times = np.array([row[0] for row in recent], dtype='M8[us]').astype('M8[ns]').astype('i8')
+                    self.recent_ticks.extend(times, [float(row[1]) for row in recent])
+                except ValueError as e:
+                    print(f"Error reading old ticks from '{self.csv_file_path}': {e}")
+
+            if self.date is not None and self.date < datetime.today().date():
+                self._rewrite(keep_recent=False)
+                return
+        else:
+            create_csv_file(self.csv_file_path, self.headers)
+
+        self._file = open(self.csv_file_path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+
+    def _rewrite(self, keep_recent):
+        """Atomically replaces the file with the header and, optionally, the ticks in recent_ticks."""
+        if self._file is not None:
+            self._file.close()
+
+        rows = []
+        if keep_recent:
+            times, prices = self.recent_ticks.last()
+            timestamps = np.char.replace(np.datetime_as_string(times.astype('M8[ns]'), unit='us'), 'T', ' ')
+            rows = list(zip(timestamps.tolist(), prices.tolist()))
+        else:
+            self.recent_ticks.clear()
+
+        atomic_write_csv(self.csv_file_path, self.headers, rows)
+        self.rewrites += 1
+
+        self.row_count = len(rows)
+        self.date = process_timestamp_from_row(rows[0]) if rows else None
+
+        self._file = open(self.csv_file_path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+
+    def write(self, timestamp, price):
+        """Buffers a single tick and flushes the buffer when it is full or old enough."""
+        with self._lock:
+            self.buffer.append((timestamp, price))
+
+            if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def write_many(self, ticks):
+        """Writes a batch of (datetime, price) or (datetime, price, size) ticks and flushes them to the file."""
+        with self._lock:
+            self.buffer.extend(ticks)
+            self.flush()
+
+    def process_tick(self, tickType, price):
+        """Journals LAST price ticks, ignoring all other tick types."""
+        if TickTypeEnum.to_str(tickType) == "LAST":
+            self.write(datetime.now(), price)
+
+    def flush(self):
+        """Writes all buffered ticks to the file."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.last_flush = time.monotonic()
+            if self.buffer and self._file is not None:
+                self._write_buffer()
+
+    def _write_buffer(self):
+        # Uusi päivä -> aloitetaan tyhjästä tiedostosta
+        first_date = self.buffer[0][0].date()
+        if self.date is not None and first_date > self.date:
+            self._rewrite(keep_recent=False)
+            print(f"CSV file '{self.csv_file_path}' rolled over for {first_date}.")
+
+        timestamps = [tick[0] for tick in self.buffer]
+        prices = [tick[1] for tick in self.buffer]
+        rows = [[timestamp.strftime(self.timestamp_format), price] for timestamp, price in zip(timestamps, prices)]
+        self.buffer.clear()
+
+        self.recent_ticks.extend(np.array(timestamps, dtype='M8[us]').astype('M8[ns]').astype('i8'), prices)
+
+        if self.row_count + len(rows) > self.max_rows:
+            self._rewrite(keep_recent=True)
+            return
+
+        self._writer.writerows(rows)
+        self._file.flush()
+
+        if self.date is None:
+            self.date = first_date
+        self.row_count += len(rows)
+
+    def close(self):
+        """Flushes the remaining ticks and closes the file."""
+        with self._lock:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS
+
+
+_arrival_to_disk = METRICS.histogram('tick_arrival_to_disk_seconds', 'Time from put_tick to the end of the write of its batch')
+
+
+class DataWriter:
+    """Bounded producer/consumer pipeline between the EWrapper callbacks and the disk.
+
+    Callbacks push lightweight tick and bar records with put_tick and put_bars, and a
+    dedicated writer thread drains the queue in batches and hands them to the
+    handlers. Handlers are given per record kind, e.g. {'tick': f, 'bars': g}, and
+    are called with a list of payloads in arrival order.
+
+    When the queue is full, tick records are handled according to `policy`:
+        'block'        the callback waits until the writer has made room
+        'drop_oldest'  the oldest queued tick is dropped
+        'coalesce'     the queued tick with the same key is overwritten with the new
+                       one; if there is none, the oldest queued tick is dropped
+    Bar records are never dropped, put_bars always waits for room.
+    """
+
+    policies = ('block', 'drop_oldest', 'coalesce')
+
+    def __init__(self, handlers, maxsize=10000, policy='drop_oldest', batch_size=1000):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown overflow policy '{policy}', expected one of {self.policies}")
+
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+
+        self._queue = deque()  # Entries are [kind, key, payload, enqueue_time]
+        self._pending = {}  # Tick key -> queued entry, used by the coalesce policy
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.last_write_latency = 0.0  # Seconds spent in the handlers for the last batch
+        self.max_write_latency = 0.0
+        self.total_write_latency = 0.0
+        self.last_queue_latency = 0.0  # Seconds the oldest record of the last batch waited in the queue
+        self.max_queue_latency = 0.0
+        self.errors = 0
+
+    def start(self):
+        """Starts the writer thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='DataWriter', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the writer thread after the queued records have been written."""
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def put_tick(self, key, payload):
+        """Queues a tick record. `key` identifies the series, e.g. (reqId, tickType)."""
+        with self._lock:
+            if len(self._queue) >= self.maxsize:
+                if self.policy == 'coalesce' and key in self._pending:
+                    entry = self._pending[key]
+                    entry[2] = payload
+                    self.coalesced += 1
+                    return
+                if self.policy == 'block':
+                    while len(self._queue) >= self.maxsize and self._running:
+                        self._not_full.wait()
+                elif not self._drop_oldest_tick():
+                    # Only bars are queued, wait for the writer instead of dropping them
+                    while len(self._queue) >= self.maxsize and self._running:
+                        self._not_full.wait()
+
+            entry = ['tick', key, payload, time.monotonic()]
+            self._queue.append(entry)
+            if self.policy == 'coalesce':
+                self._pending[key] = entry
+            self._after_put()
+
+    def put_bars(self, key, bars):
+        """Queues a list of bars for the series `key`. Bars are never dropped."""
+        self.put('bars', key, bars)
+
+    def put(self, kind, key, payload):
+        """Queues a record of any kind with a handler, e.g. a task that has to run on the writer thread. Never dropped."""
+        with self._lock:
+            while len(self._queue) >= self.maxsize and self._running:
+                self._not_full.wait()
+            self._queue.append([kind, key, payload, time.monotonic()])
+            self._after_put()
+
+    def _after_put(self):
+        self.enqueued += 1
+        depth = len(self._queue)
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        self._not_empty.notify()
+
+    def _drop_oldest_tick(self):
+        """Removes the oldest queued tick, returns False if there was none."""
+        for index, entry in enumerate(self._queue):
+            if entry[0] == 'tick':
+                del self._queue[index]
+                if self._pending.get(entry[1]) is entry:
+                    del self._pending[entry[1]]
+                self.dropped += 1
+                return True
+        return False
+
+    def _take_batch(self):
+        """Waits for records and removes up to `batch_size` of them from the queue."""
+        with self._lock:
+            while not self._queue and self._running:
+                self._not_empty.wait()
+
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                entry = self._queue.popleft()
+                if entry[0] == 'tick' and self._pending.get(entry[1]) is entry:
+                    del self._pending[entry[1]]
+                batch.append(entry)
+
+            self._not_full.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if not self._running:
+                    break
+                continue
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        started = time.monotonic()
+        queue_latency = started - batch[0][3]
+
+        # Group consecutive records of the same kind so the handlers get whole batches
+        group_kind = None
+        group = []
+        for kind, _, payload, _ in batch:
+            if kind != group_kind and group:
+                self._call_handler(group_kind, group)
+                group = []
+            group_kind = kind
+            group.append(payload)
+        if group:
+            self._call_handler(group_kind, group)
+
+        finished = time.monotonic()
+        write_latency = finished - started
+        if METRICS.enabled:
+            for kind, _, _, enqueue_time in batch:
+                if kind == 'tick':
+                    _arrival_to_disk.observe(finished - enqueue_time)
+        self.written += len(batch)
+        self.batches += 1
+        self.last_write_latency = write_latency
+        self.max_write_latency = max(self.max_write_latency, write_latency)
+        self.total_write_latency += write_latency
+        self.last_queue_latency = queue_latency
+        self.max_queue_latency = max(self.max_queue_latency, queue_latency)
+
+    def _call_handler(self, kind, payloads):
+        try:
+            self.handlers[kind](payloads)
+        except Exception as e:
+            self.errors += 1
+            print(f"Error writing {len(payloads)} '{kind}' record(s): {e}")
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        """Returns the pipeline counters as a dictionary."""
+        return {
+            'queue_depth': len(self._queue),
+            'max_queue_depth': self.max_queue_depth,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'errors': self.errors,
+            'last_write_latency': self.last_write_latency,
+            'max_write_latency': self.max_write_latency,
+            'avg_write_latency': self.total_write_latency / self.batches if self.batches else 0.0,
+            'last_queue_latency': self.last_queue_latency,
+            'max_queue_latency': self.max_queue_latency,
+        }
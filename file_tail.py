@@ -0,0 +1,102 @@
+import csv
+import os
+
+
+class CsvTail:
+    """Reads the rows appended to a CSV file since the previous read.
+
+    The byte offset of the first unread row is remembered, so every read only
+    parses the new part of the file. The file is polled with os.stat and nothing
+    is read while its size and modification time stay the same. A partially
+    written last line is left for the next read.
+
+    If the file is replaced or truncated (rollover), reading starts again from the
+    beginning. With `reread_rows` the last complete rows are returned again on
+    every change, which picks up bars that have been rewritten in place (see
+    HistoricalBarStore). The rows must not be rewritten further back than that.
+    """
+
+    def __init__(self, csv_file_path, reread_rows=0):
+        self.csv_file_path = csv_file_path
+        self.reread_rows = reread_rows
+        self.header = None
+        self.offset = 0
+        self.resets = 0  # How many times the file was replaced or truncated
+        self._stat_key = None
+        self._inode = None
+
+    def has_changed(self):
+        """Returns True if the file has changed since the previous read."""
+        try:
+            stat = os.stat(self.csv_file_path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns) != self._stat_key
+
+    def state(self):
+        """Returns the read position as a JSON-friendly dict, see restore."""
+        return {'offset': self.offset, 'inode': self._inode, 'header': self.header}
+
+    def restore(self, state):
+        """Continues reading from a position saved by an earlier process.
+
+        The position is only used if the file is still the same one and a row ends
+        right before it, otherwise the next read starts from the beginning.
+        """
+        try:
+            with open(self.csv_file_path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_ino != state['inode'] or stat.st_size < state['offset'] or not state['offset']:
+                    return False
+                file.seek(state['offset'] - 1)
+                if file.read(1) != b'\n':
+                    return False
+        except FileNotFoundError:
+            return False
+        self.offset = state['offset']
+        self._inode = state['inode']
+        self.header = state['header']
+        return True
+
+    def read_new_rows(self):
+        """Returns the rows added since the previous call as lists of strings."""
+        try:
+            file = open(self.csv_file_path, 'rb')
+        except FileNotFoundError:
+            return []
+
+        with file:
+            stat = os.fstat(file.fileno())
+            stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if stat_key == self._stat_key:
+                return []
+
+            if stat.st_ino != self._inode or stat.st_size < self.offset:
+                # Tiedosto vaihtui tai lyheni -> luetaan alusta
+                if self._inode is not None:
+                    self.resets += 1
+                self._inode = stat.st_ino
+                self.offset = 0
+                self.header = None
+
+            file.seek(self.offset)
+            data = file.read()
+
+        self._stat_key = stat_key
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return []
+
+        lines = data[:end].splitlines(keepends=True)
+        if self.header is None:
+            header_line = lines.pop(0)
+            self.header = next(csv.reader([header_line.decode()]), [])
+            self.offset += len(header_line)
+            end -= len(header_line)
+
+        if self.reread_rows and lines:
+            self.offset += end - sum(len(line) for line in lines[-self.reread_rows:])
+        else:
+            self.offset += end
+
+        return [row for row in csv.reader(line.decode() for line in lines) if row]
@@ -0,0 +1,234 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Bucket upper bounds in seconds, from 10 us to 10 s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    """Gauge that is either set or read from `function` when the metrics are collected."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, function=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.labels, self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    """Cumulative bucket histogram, observe costs one bisect."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimates the `q` quantile by interpolating inside the bucket, like histogram_quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield self.name + '_bucket', dict(self.labels, le=bound), cumulative
+        yield self.name + '_sum', self.labels, self.sum
+        yield self.name + '_count', self.labels, self.count
+
+
+class Metrics:
+    """Registry of the counters, gauges and histograms of one process.
+
+    Instrumented code checks `enabled` before measuring anything, so a disabled
+    registry costs one attribute lookup per call site. enable() turns the
+    measurements on and optionally serves them in the Prometheus text format on
+    http://host:port/metrics and prints a summary line every `log_interval` seconds.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}  # (name, labels) -> metric
+        self._lock = threading.Lock()
+        self.server = None
+        self._last_log = None  # (monotonic time, counter values) of the previous log line
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, help, labels, **kwargs)
+        return metric
+
+    def counter(self, name, help='', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', function=None, **labels):
+        gauge = self._get(Gauge, name, help, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def timed(self, name, help='', **labels):
+        """Decorator that observes the duration of every call in the histogram `name`."""
+        histogram = self.histogram(name, help, **labels)
+
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        described = set()
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Returns a one-line summary: counter rates since the previous call and histogram percentiles."""
+        now = time.monotonic()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        counters = {(metric.name, format_labels(metric.labels)): metric.value for metric in metrics if metric.kind == 'counter'}
+
+        parts = []
+        previous_time, previous = self._last_log or (None, {})
+        for (name, labels), value in sorted(counters.items()):
+            part = f'{name}{labels}={value}'
+            if previous_time is not None and now > previous_time:
+                part += f' ({(value - previous.get((name, labels), 0)) / (now - previous_time):.1f}/s)'
+            parts.append(part)
+        self._last_log = (now, counters)
+
+        for metric in sorted(metrics, key=lambda metric: metric.name):
+            if metric.kind == 'histogram' and metric.count:
+                parts.append(f'{metric.name}{format_labels(metric.labels)} p50={metric.quantile(0.5) * 1000:.2f}ms '
+                             f'p99={metric.quantile(0.99) * 1000:.2f}ms n={metric.count}')
+            elif metric.kind == 'gauge':
+                for name, labels, value in metric.samples():
+                    parts.append(f'{name}{format_labels(labels)}={value}')
+        return 'metrics: ' + ', '.join(parts)
+
+    def enable(self, port=None, host='127.0.0.1', log_interval=None):
+        """Starts measuring, and serving/logging the metrics if `port`/`log_interval` are given."""
+        self.enabled = True
+        if port is not None and self.server is None:
+            self.server = ThreadingHTTPServer((host, port), self._handler())
+            threading.Thread(target=self.server.serve_forever, name='Metrics', daemon=True).start()
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+        if log_interval:
+            threading.Thread(target=self._log_loop, args=(log_interval,), name='MetricsLog', daemon=True).start()
+
+    def disable(self):
+        self.enabled = False
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _log_loop(self, interval):
+        while self.enabled:
+            time.sleep(interval)
+            print(self.summary())
+
+    def _handler(self):
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # No line per scrape
+
+        return Handler
+
+
+# Registry shared by the modules of one process
+METRICS = Metrics()
@@ -0,0 +1,494 @@
+import argparse
+import bisect
+import csv
+import heapq
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from ibapi.comm import make_field, make_msg, read_fields, read_msg
+from ibapi.common import BarData, TickAttrib
+from ibapi.ticktype import TickTypeEnum
+
+from bar_aggregator import Bar, BarAggregator
+from csv_operations import bar_key
+from storage import MappedRing, TICK_DTYPE, BAR_DTYPE
+
+
+DATE_FORMAT = '%Y%m%d %H:%M:%S'
+
+# Seconds per unit of a reqHistoricalData duration string
+DURATION_UNITS = {'S': 1, 'D': 86400, 'W': 7 * 86400, 'M': 30 * 86400, 'Y': 365 * 86400}
+
+
+def parse_duration(duration):
+    """Converts a duration string like '120 S' or '1 D' to seconds."""
+    count, unit = duration.split()
+    return int(count) * DURATION_UNITS[unit.upper()]
+
+
+def ns_to_datetimes(times_ns):
+    """Converts int64 nanoseconds to a list of naive datetimes."""
+    return np.asarray(times_ns, dtype='i8').astype('M8[ns]').astype('M8[us]').astype(object).tolist()
+
+
+def load_ticks(path):
+    """Reads recorded ticks as a sorted list of (datetime, price, size).
+
+    Accepts a tick CSV ('time', 'price' and an optional 'size' column), a tick ring
+    file written by NumpyStorage or a Parquet archive of one.
+    """
+    if path.endswith('.ring'):
+        ring = MappedRing(path, TICK_DTYPE, writable=False)
+        records = np.array(ring.last())
+        ring.close()
+        ticks = list(zip(ns_to_datetimes(records['time']), records['price'].tolist(), records['size'].tolist()))
+    elif path.endswith('.parquet'):
+        import pandas as pd
+
+        df = pd.read_parquet(path)
+        sizes = df['size'].tolist() if 'size' in df else [0.0] * len(df)
+        ticks = list(zip(df['time'].dt.to_pydatetime().tolist(), df['price'].tolist(), sizes))
+    else:
+        with open(path, 'r', newline='') as file:
+            ticks = [(datetime.fromisoformat(row['time']), float(row['price']), float(row.get('size') or 0.0))
+                     for row in csv.DictReader(file)]
+
+    ticks.sort(key=lambda tick: tick[0])
+    return ticks
+
+
+def load_bars(path):
+    """Reads recorded one-minute bars as a sorted list of Bar objects.
+
+    Accepts a historical data CSV, a bar ring file written by NumpyStorage or a
+    Parquet archive of one. Volumes are in shares, like in the files.
+    """
+    if path.endswith('.ring') or path.endswith('.parquet'):
+        if path.endswith('.ring'):
+            ring = MappedRing(path, BAR_DTYPE, writable=False)
+            records = np.array(ring.last())
+            ring.close()
+            times = ns_to_datetimes(records['time'])
+        else:
+            import pandas as pd
+
+            records = pd.read_parquet(path)
+            times = records['time'].dt.to_pydatetime().tolist()
+        bars = [Bar(*values) for values in zip(times, *(records[field].tolist() for field in ('open', 'high', 'low', 'close', 'volume')))]
+    else:
+        bars = []
+        with open(path, 'r', newline='') as file:
+            for row in csv.DictReader(file):
+                try:
+                    bar_time = datetime.strptime(bar_key(row['date']), DATE_FORMAT)
+                except ValueError:
+                    continue
+                bars.append(Bar(bar_time, float(row['open']), float(row['high']), float(row['low']),
+                                float(row['close']), float(row['volume'])))
+
+    # Keep the last version of each bar
+    by_time = {bar.time: bar for bar in bars}
+    return [by_time[bar_time] for bar_time in sorted(by_time)]
+
+
+def bars_from_ticks(ticks, interval_seconds=60):
+    """Builds bars from (datetime, price, size) ticks when no bar file was recorded."""
+    aggregator = BarAggregator(interval_seconds, history=1)
+    bars = []
+    aggregator.on_bar_close = bars.append
+    for timestamp, price, size in ticks:
+        bar = aggregator.on_price(timestamp, price)
+        if bar is not None:
+            bar.volume += size
+    if aggregator.bar is not None:
+        bars.append(aggregator.bar)
+    return bars
+
+
+class ReplaySession:
+    """Recorded ticks and one-minute bars of one symbol."""
+
+    def __init__(self, ticks, bars=None, bar_size_seconds=60):
+        self.ticks = ticks
+        self.bars = bars if bars is not None else bars_from_ticks(ticks, bar_size_seconds)
+        self.bar_times = [bar.time for bar in self.bars]
+        self.bar_size = timedelta(seconds=bar_size_seconds)
+
+    @classmethod
+    def from_files(cls, ticks_path, bars_path=None):
+        ticks = load_ticks(ticks_path)
+        return cls(ticks, load_bars(bars_path) if bars_path else None)
+
+    @classmethod
+    def from_archive(cls, symbol, day, root='archive'):
+        """Loads the archived ticks and bars of `symbol` for one day (a date or 'YYYY-MM-DD')."""
+        from archive import Archive
+
+        archive = Archive(root)
+        start = np.datetime64(day, 'D')
+        end = start + np.timedelta64(1, 'D')
+        ticks_df = archive.load(symbol, start, end, kind='ticks')
+        bars_df = archive.load(symbol, start, end, kind='bars')
+        if ticks_df.empty:
+            raise ValueError(f"No archived ticks of {symbol} for {day} in '{root}'")
+        ticks = list(zip(ticks_df['time'].dt.to_pydatetime().tolist(), ticks_df['price'].tolist(), ticks_df['size'].tolist()))
+        bars = [Bar(*values) for values in zip(bars_df['time'].dt.to_pydatetime().tolist(),
+                                               *(bars_df[field].tolist() for field in ('open', 'high', 'low', 'close', 'volume')))]
+        return cls(ticks, bars or None)
+
+    def shifted(self, delta):
+        """Returns a copy with every timestamp moved by `delta`."""
+        bars = [Bar(bar.time + delta, bar.open, bar.high, bar.low, bar.close, bar.volume) for bar in self.bars]
+        ticks = [(timestamp + delta, price, size) for timestamp, price, size in self.ticks]
+        return ReplaySession(ticks, bars, int(self.bar_size.total_seconds()))
+
+    def completed_bars(self, end, duration_seconds):
+        """Returns the bars that had closed by `end` and started within the duration before it."""
+        stop = bisect.bisect_right(self.bar_times, end - self.bar_size)
+        start = bisect.bisect_left(self.bar_times, end - timedelta(seconds=duration_seconds))
+        return self.bars[start:stop]
+
+
+class ReplayEngine:
+    """Feeds recorded sessions into EWrapper callbacks as if they came from TWS.
+
+    Market data subscriptions get a LAST tickPrice and a LAST_SIZE tickSize for every
+    recorded tick, plus a cumulative VOLUME tickSize when the recording has trade
+    sizes. Historical requests are answered with historicalData/historicalDataEnd from the recorded
+    bars that had closed by the current replay time, regardless of the requested
+    end time. `speed` is the multiple of real time; None or 0 replays as fast as
+    possible.
+
+    The wrapper can be a TestApp (see attach) or a GatewayConnection that encodes
+    the callbacks into API messages.
+    """
+
+    def __init__(self, sessions, speed=1.0, volume_multiplier=100):
+        self.sessions = sessions  # symbol -> ReplaySession
+        self.speed = speed
+        self.volume_multiplier = volume_multiplier  # IB reports volume in lots of 100
+        starts = [session.ticks[0][0] for session in sessions.values() if session.ticks]
+        self.now = min(starts) if starts else None  # Replay clock
+        self.ticks_sent = 0
+
+        self.lock = threading.Lock()
+        self.subscriptions = {}  # reqId -> symbol
+        self.pending_bars = []  # (reqId, symbol, duration in seconds)
+        self.subscribed = threading.Event()
+        self.stopped = threading.Event()
+
+    def subscribe(self, reqId, symbol):
+        """Starts market data for `symbol`. Returns False for an unknown symbol."""
+        if symbol not in self.sessions:
+            return False
+        with self.lock:
+            self.subscriptions[reqId] = symbol
+        self.subscribed.set()
+        return True
+
+    def unsubscribe(self, reqId):
+        with self.lock:
+            self.subscriptions.pop(reqId, None)
+
+    def request_bars(self, reqId, symbol, duration):
+        """Queues a historical request, it is answered before the next tick. Returns False for an unknown symbol."""
+        if symbol not in self.sessions:
+            return False
+        with self.lock:
+            self.pending_bars.append((reqId, symbol, parse_duration(duration)))
+        return True
+
+    def cancel_bars(self, reqId):
+        with self.lock:
+            self.pending_bars = [request for request in self.pending_bars if request[0] != reqId]
+
+    def stop(self):
+        self.stopped.set()
+        self.subscribed.set()
+
+    def attach(self, app):
+        """Routes the requests of a TestApp to the engine and makes the app follow the replay clock."""
+        def reqMktData(reqId, contract, *args):
+            if not self.subscribe(reqId, contract.symbol):
+                app.error(reqId, 200, "No security definition has been found for the request")
+
+        def reqHistoricalData(reqId, contract, endDateTime, durationStr, *args):
+            if not self.request_bars(reqId, contract.symbol, durationStr):
+                app.error(reqId, 200, "No security definition has been found for the request")
+
+        app.reqMktData = reqMktData
+        app.cancelMktData = self.unsubscribe
+        app.reqHistoricalData = reqHistoricalData
+        app.cancelHistoricalData = self.cancel_bars
+        app.reqMarketDataType = lambda *args: None
+        app.clock = lambda: self.now
+        app.volume_multiplier = self.volume_multiplier
+        if app.orderId is None:
+            app.nextValidId(0)
+
+    def _send_bars(self, wrapper):
+        with self.lock:
+            requests, self.pending_bars = self.pending_bars, []
+
+        for reqId, symbol, duration in requests:
+            start = self.now - timedelta(seconds=duration)
+            for recorded in self.sessions[symbol].completed_bars(self.now, duration):
+                bar = BarData()
+                bar.date = recorded.time.strftime(DATE_FORMAT)
+                bar.open = recorded.open
+                bar.high = recorded.high
+                bar.low = recorded.low
+                bar.close = recorded.close
+                bar.volume = int(round(recorded.volume / self.volume_multiplier))
+                bar.average = recorded.close
+                wrapper.historicalData(reqId, bar)
+            wrapper.historicalDataEnd(reqId, start.strftime(DATE_FORMAT), self.now.strftime(DATE_FORMAT))
+
+    def run(self, wrapper, on_time=None):
+        """Replays every tick of every session in time order. Blocks until done or stopped.
+
+        The replay waits for the first market data subscription. `on_time` is called
+        with the replay time before every tick.
+        """
+        self.subscribed.wait()
+        ticks = heapq.merge(*[[(timestamp, symbol, price, size) for timestamp, price, size in session.ticks]
+                              for symbol, session in self.sessions.items()])
+        total_volume = dict.fromkeys(self.sessions, 0.0)
+        attrib = TickAttrib()
+
+        wall_start = time.monotonic()
+        replay_start = self.now
+        for timestamp, symbol, price, size in ticks:
+            if self.speed:
+                delay = (timestamp - replay_start).total_seconds() / self.speed - (time.monotonic() - wall_start)
+                if delay > 0 and self.stopped.wait(delay):
+                    break
+            if self.stopped.is_set():
+                break
+
+            self.now = timestamp
+            if on_time is not None:
+                on_time(timestamp)
+            self._send_bars(wrapper)
+
+            total_volume[symbol] += size
+            with self.lock:
+                req_ids = [reqId for reqId, subscribed in self.subscriptions.items() if subscribed == symbol]
+            for reqId in req_ids:
+                wrapper.tickPrice(reqId, TickTypeEnum.LAST, price, attrib)
+                wrapper.tickSize(reqId, TickTypeEnum.LAST_SIZE, int(round(size / self.volume_multiplier)))
+                if size:
+                    wrapper.tickSize(reqId, TickTypeEnum.VOLUME, int(round(total_volume[symbol] / self.volume_multiplier)))
+            self.ticks_sent += 1
+
+        # Answer the requests sent after the last tick
+        self._send_bars(wrapper)
+
+
+def replay_into_app(app, engine):
+    """Replays into a TestApp in this thread, polling historical data on the replay clock."""
+    engine.attach(app)
+    app.start_market_data()
+
+    def poll_historical_data(now):
+        if app.keep_up_to_date:
+            return
+        if any(stream.next_request_time is None for stream in app.streams.values()):
+            app.schedule_historical_requests(now.timestamp())
+        app.request_due_historical_data(now.timestamp(), now)
+
+    started = time.perf_counter()
+    engine.run(app, on_time=poll_historical_data)
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {engine.ticks_sent} ticks in {elapsed:.1f} s ({engine.ticks_sent / max(elapsed, 1e-9):.0f} ticks/s).")
+
+
+class GatewayConnection:
+    """One API client connected to the ReplayGateway.
+
+    Implements the EWrapper callbacks that ReplayEngine calls by encoding them into
+    the messages TWS would send.
+    """
+
+    server_version = 151  # Message layouts below follow this version
+    min_client_version = 124  # Historical data without the version field
+
+    def __init__(self, sock, engine):
+        self.sock = sock
+        self.engine = engine
+        self.send_lock = threading.Lock()
+        self.bars = {}  # reqId -> encoded bars of a response being built
+        self.pending_price = None  # (reqId, tickType, price) waiting for the size of the trade
+
+    def send(self, *fields):
+        msg = make_msg(''.join(make_field(field) for field in fields))
+        with self.send_lock:
+            try:
+                self.sock.sendall(msg)
+            except OSError:
+                self.engine.stop()  # The client went away
+
+    def tickPrice(self, reqId, tickType, price, attrib):
+        # TWS sends the size of a trade in the same message, it is added by the LAST_SIZE tickSize that follows
+        self._send_pending_price()
+        self.pending_price = (reqId, tickType, price)
+
+    def tickSize(self, reqId, tickType, size):
+        pending = self.pending_price
+        if tickType == TickTypeEnum.LAST_SIZE and pending is not None and pending[0] == reqId:
+            self.pending_price = None
+            self.send(1, 6, reqId, pending[1], pending[2], size, 0)  # The decoder calls tickSize with LAST_SIZE
+            return
+        self._send_pending_price()
+        self.send(2, 6, reqId, tickType, size)
+
+    def _send_pending_price(self):
+        if self.pending_price is not None:
+            reqId, tickType, price = self.pending_price
+            self.pending_price = None
+            self.send(1, 6, reqId, tickType, price, 0, 0)
+
+    def error(self, reqId, errorCode, errorString):
+        self.send(4, 2, reqId, errorCode, errorString)
+
+    def historicalData(self, reqId, bar):
+        self.bars.setdefault(reqId, []).extend([bar.date, bar.open, bar.high, bar.low, bar.close, bar.volume, bar.average, 1])
+
+    def historicalDataEnd(self, reqId, start, end):
+        fields = self.bars.pop(reqId, [])
+        self.send(17, reqId, start, end, len(fields) // 8, *fields)
+
+    def handshake(self, buffer):
+        """Answers the version negotiation. Returns the bytes read past it, or None to refuse."""
+        while True:
+            if buffer.startswith(b'API\0'):
+                size, text, rest = read_msg(buffer[4:])
+                if text:
+                    break
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                return None
+            buffer += chunk
+
+        versions = text.decode().split()[0].lstrip('v')
+        low, _, high = versions.partition('..')
+        if int(high or low) < self.min_client_version or int(low) > self.server_version:
+            print(f"Refusing client versions {versions}, the gateway speaks {self.server_version}.")
+            return None
+
+        self.sock.sendall(make_msg(make_field(min(int(high or low), self.server_version))
+                                   + make_field(datetime.now().strftime('%Y%m%d %H:%M:%S'))))
+        return rest
+
+    def handle(self, fields):
+        msg_id = int(fields[0])
+        if msg_id == 71:  # START_API
+            self.send(9, 1, 1)  # NEXT_VALID_ID
+            self.send(15, 1, 'DU0000000')  # MANAGED_ACCTS
+            threading.Thread(target=self.engine.run, args=(self,), daemon=True).start()
+        elif msg_id == 1:  # REQ_MKT_DATA: id, version, reqId, conId, symbol, ...
+            req_id = int(fields[2])
+            if not self.engine.subscribe(req_id, fields[4].decode()):
+                self.error(req_id, 200, "No security definition has been found for the request")
+        elif msg_id == 2:  # CANCEL_MKT_DATA
+            self.engine.unsubscribe(int(fields[2]))
+        elif msg_id == 20:  # REQ_HISTORICAL_DATA: id, reqId, conId, symbol, ..., duration at 17
+            req_id = int(fields[1])
+            if not self.engine.request_bars(req_id, fields[3].decode(), fields[17].decode()):
+                self.error(req_id, 200, "No security definition has been found for the request")
+        elif msg_id == 25:  # CANCEL_HISTORICAL_DATA
+            self.engine.cancel_bars(int(fields[2]))
+        elif msg_id == 49:  # REQ_CURRENT_TIME
+            self.send(49, 1, int((self.engine.now or datetime.now()).timestamp()))
+        # Everything else (reqMarketDataType, ...) is accepted silently
+
+    def serve(self):
+        try:
+            buffer = self.handshake(b'')
+            while buffer is not None:
+                size, text, buffer = read_msg(buffer)
+                if text:
+                    self.handle(read_fields(text))
+                    continue
+                chunk = self.sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+        except OSError as e:
+            print(f"Gateway connection error: {e}")
+        finally:
+            self.engine.stop()
+            self.sock.close()
+
+
+class ReplayGateway:
+    """Local socket server that speaks enough of the TWS API for EClient.connect.
+
+    Every connection gets its own ReplayEngine over the same sessions, so
+    LiveDataStreamer can run against a recording without any changes. Ticks are
+    timestamped by the client's own clock, so use speed 1 and shift the sessions to
+    the present (--rebase) when the timestamps matter. keepUpToDate requests only
+    get the initial bars.
+    """
+
+    def __init__(self, sessions, speed=1.0, host='127.0.0.1', port=7497):
+        self.sessions = sessions
+        self.speed = speed
+        self.host = host
+        self.port = port
+
+    def serve_forever(self):
+        with socket.create_server((self.host, self.port)) as server:
+            print(f"Replay gateway listening on {self.host}:{self.port}")
+            while True:
+                sock, address = server.accept()
+                print(f"Client connected from {address[0]}:{address[1]}")
+                connection = GatewayConnection(sock, ReplayEngine(self.sessions, self.speed))
+                threading.Thread(target=connection.serve, daemon=True).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded market data into LiveDataStreamer.")
+    parser.add_argument('symbol')
+    parser.add_argument('--ticks', help="Tick CSV, .ring or .parquet file")
+    parser.add_argument('--bars', help="Bar CSV, .ring or .parquet file, built from the ticks if not given")
+    parser.add_argument('--date', help="Replay the archived session of this day (YYYY-MM-DD) instead of files")
+    parser.add_argument('--archive-dir', default='archive')
+    parser.add_argument('--speed', type=float, default=1.0, help="Multiple of real time, 0 = as fast as possible")
+    parser.add_argument('--gateway', action='store_true', help="Serve the replay on a local port instead of running the streamer in-process")
+    parser.add_argument('--port', type=int, default=7497)
+    parser.add_argument('--rebase', action='store_true', help="Shift the recording so that it starts now")
+    parser.add_argument('--storage', default='csv', help="Storage backend of the in-process streamer")
+    parser.add_argument('--output-dir', default='replay', help="Directory the in-process streamer writes to")
+    args = parser.parse_args()
+
+    if args.date:
+        session = ReplaySession.from_archive(args.symbol, args.date, args.archive_dir)
+    elif args.ticks:
+        session = ReplaySession.from_files(args.ticks, args.bars)
+    else:
+        parser.error("either --ticks or --date is required")
+    if args.rebase and session.ticks:
+        session = session.shifted(datetime.now().replace(second=0, microsecond=0) - session.ticks[0][0].replace(second=0, microsecond=0))
+    sessions = {args.symbol: session}
+    print(f"Loaded {len(session.ticks)} ticks and {len(session.bars)} bars of {args.symbol}.")
+
+    if args.gateway:
+        ReplayGateway(sessions, args.speed, port=args.port).serve_forever()
+    else:
+        from LiveDataStreamer import TestApp
+
+        # The streamer writes its files into the working directory
+        os.makedirs(args.output_dir, exist_ok=True)
+        os.chdir(args.output_dir)
+
+        app = TestApp(writer_policy='block')
+        app.storage = args.storage
+        stream = app.add_symbol(args.symbol)
+        replay_into_app(app, ReplayEngine(sessions, args.speed))
+        app.stop_writer()
+        stream.storage.close()
@@ -0,0 +1,432 @@
+import copy
+import csv
+import os
+import threading
+from collections import deque, namedtuple
+from datetime import datetime
+
+from vwap import VwapEngine, SESSION_START
+
+
+Alert = namedtuple('Alert', 'time symbol rule message price')
+Entry = namedtuple('Entry', 'time side price size stop')  # side is 'long' or 'short', stop may be None
+
+
+def alerts_path(symbol):
+    return f'alerts_{symbol}.csv'
+
+
+def print_alert(alert):
+    print(f"RULE {alert.rule} [{alert.symbol}] {alert.time}: {alert.message}")
+
+
+class AlertLog:
+    """Appends alerts to alerts_{symbol}.csv, DataPlotter draws them as chart markers."""
+
+    headers = ['time', 'rule', 'message', 'price']
+
+    def __init__(self):
+        self._files = {}  # symbol -> (file, writer)
+
+    def __call__(self, alert):
+        entry = self._files.get(alert.symbol)
+        if entry is None:
+            path = alerts_path(alert.symbol)
+            new_file = not os.path.exists(path)
+            file = open(path, 'a', newline='')
+            writer = csv.writer(file)
+            if new_file:
+                writer.writerow(self.headers)
+            entry = self._files[alert.symbol] = (file, writer)
+
+        file, writer = entry
+        writer.writerow([alert.time, alert.rule, alert.message, alert.price])
+        file.flush()
+
+    def close(self):
+        for file, _ in self._files.values():
+            file.close()
+        self._files.clear()
+
+
+class Atr:
+    """Average true range with Wilder's smoothing, updated one bar at a time."""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.value = None
+        self.previous_close = None
+        self._count = 0
+        self._sum = 0.0
+
+    def update(self, high, low, close):
+        if self.previous_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self.previous_close), abs(low - self.previous_close))
+        self.previous_close = close
+
+        if self._count < self.period:
+            self._count += 1
+            self._sum += true_range
+            if self._count == self.period:
+                self.value = self._sum / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+        return self.value
+
+    def state(self):
+        return {'value': self.value, 'previous_close': self.previous_close, 'count': self._count, 'sum': self._sum}
+
+    def load_state(self, state):
+        self.value = state['value']
+        self.previous_close = state['previous_close']
+        self._count = state['count']
+        self._sum = state['sum']
+
+
+class SymbolState:
+    """Indicators and position of one symbol, shared by all of its rules."""
+
+    def __init__(self, symbol, atr_period=14):
+        self.symbol = symbol
+        self.time = None  # Time of the latest tick or bar
+        self.price = None  # Latest trade price
+        self.vwap_engine = VwapEngine(session_start=SESSION_START)
+        self.vwap_point = None  # Latest VWAP point, see VwapEngine.point
+        self.atr = Atr(atr_period)
+        self.last_bar_time = None
+        self.position = 0.0  # Shares, negative when short
+        self.entry_price = None  # Price of the latest entry of the open position
+
+    @property
+    def vwap(self):
+        return self.vwap_point['VWAP'] if self.vwap_point is not None else None
+
+    def snapshot(self):
+        """Returns the indicators and position as a JSON-friendly dict, see restore."""
+        return {
+            'vwap': self.vwap_engine.state(),
+            'atr': self.atr.state(),
+            'last_bar_time': self.last_bar_time.isoformat() if self.last_bar_time is not None else None,
+            'position': self.position,
+            'entry_price': self.entry_price,
+        }
+
+    def restore(self, snapshot):
+        self.vwap_engine.load_state(snapshot['vwap'])
+        self.vwap_point = self.vwap_engine.point() if self.vwap_engine.bar_time is not None else None
+        self.atr.load_state(snapshot['atr'])
+        if snapshot['last_bar_time'] is not None:
+            self.last_bar_time = datetime.fromisoformat(snapshot['last_bar_time'])
+        self.position = snapshot['position']
+        self.entry_price = snapshot['entry_price']
+
+
+class Rule:
+    """Base class of the trading rules.
+
+    A rule keeps only a constant amount of state and is evaluated incrementally:
+    on_tick and on_bar return a message while the rule's condition is violated and
+    None otherwise, on_entry returns a message if the entry breaks the rule and
+    on_stop does the same for a new stop order. Subclasses override the ones they
+    need. reset() creates the state, every symbol gets its own copy of the rule.
+    """
+
+    def __init__(self, name=None):
+        self.name = name or type(self).__name__
+        self.reset()
+
+    def reset(self):
+        pass
+
+    def on_tick(self, state):
+        return None
+
+    def on_bar(self, state, bar):
+        return None
+
+    def on_entry(self, state, entry):
+        return None
+
+    def on_stop(self, state, stop):
+        return None
+
+
+class ConditionRule(Rule):
+    """User-defined rule: `condition(state)` returning True means the rule is violated."""
+
+    def __init__(self, name, condition, message=None):
+        self.condition = condition
+        self.message = message or name
+        super().__init__(name)
+
+    def on_tick(self, state):
+        return self.message if self.condition(state) else None
+
+
+class PriceLevel(Rule):
+    """Alerts when the price is at or above (`above=True`) or at or below a level."""
+
+    def __init__(self, level, above=True, name=None):
+        self.level = level
+        self.above = above
+        super().__init__(name or f"Price {'>=' if above else '<='} {level:g}")
+
+    def on_tick(self, state):
+        if (state.price >= self.level) if self.above else (state.price <= self.level):
+            return f"Price {state.price:g} reached {self.level:g}"
+        return None
+
+
+class NoEntryBelowVwap(Rule):
+    """No long entries while the price is below the VWAP.
+
+    With `warn` an alert is also raised when the price crosses below the VWAP.
+    """
+
+    def __init__(self, warn=True, name=None):
+        self.warn = warn
+        super().__init__(name)
+
+    def on_tick(self, state):
+        if self.warn and state.vwap is not None and state.price < state.vwap:
+            return f"Price {state.price:g} below VWAP {state.vwap:.2f}, no long entries"
+        return None
+
+    def on_entry(self, state, entry):
+        if entry.side == 'long' and state.vwap is not None and entry.price < state.vwap:
+            return f"Long entry at {entry.price:g} below VWAP {state.vwap:.2f}"
+        return None
+
+
+class MaxTradesPerHour(Rule):
+    """At most `max_trades` entries in any `window` seconds."""
+
+    def __init__(self, max_trades, window=3600, name=None):
+        self.max_trades = max_trades
+        self.window = window
+        super().__init__(name)
+
+    def reset(self):
+        self.entry_times = deque(maxlen=self.max_trades + 1)
+
+    def on_entry(self, state, entry):
+        self.entry_times.append(entry.time)
+        while (entry.time - self.entry_times[0]).total_seconds() >= self.window:
+            self.entry_times.popleft()
+        if len(self.entry_times) > self.max_trades:
+            return f"{len(self.entry_times)} entries within {self.window / 60:g} min, max {self.max_trades}"
+        return None
+
+
+class MaxStopDistanceAtr(Rule):
+    """The stop may be at most `multiple` ATRs away from the entry price."""
+
+    def __init__(self, multiple, name=None):
+        self.multiple = multiple
+        super().__init__(name)
+
+    def _check(self, state, price, stop):
+        if stop is None or price is None or state.atr.value is None:
+            return None
+        distance = abs(price - stop)
+        if distance > self.multiple * state.atr.value:
+            return f"Stop distance {distance:.2f} is {distance / state.atr.value:.1f} ATR, max {self.multiple:g}"
+        return None
+
+    def on_entry(self, state, entry):
+        return self._check(state, entry.price, entry.stop)
+
+    def on_stop(self, state, stop):
+        return self._check(state, state.entry_price if state.entry_price is not None else state.price, stop)
+
+
+def _overrides(rule, method):
+    return getattr(type(rule), method) is not getattr(Rule, method)
+
+
+class RuleEngine:
+    """Evaluates rules on every tick, closed bar, entry and stop order of the watched symbols.
+
+    `rules` apply to every symbol; add_rule can also bind a rule to some symbols.
+    Each symbol gets its own copies of its rules, and only the rules that handle
+    an event are called for it, so an event costs one call per interested rule
+    of that symbol no matter how long the session has been running.
+
+    Tick and bar rules alert when they become violated, and again only after they
+    have been satisfied in between and `cooldown` seconds have passed, so a price
+    hovering at a level does not flood the alerts. Entry and stop rules alert on
+    every violation. Alerts are passed to every callable in `alert_handlers`.
+
+    The events come from the EReader thread and snapshot is called from another
+    one, so every public method holds `lock`.
+    """
+
+    def __init__(self, rules=(), alert_handlers=(print_alert,), atr_period=14, cooldown=60.0):
+        self.rules = list(rules)
+        self.symbol_rules = {}  # symbol -> rules bound to it
+        self.alert_handlers = list(alert_handlers)
+        self.atr_period = atr_period
+        self.cooldown = cooldown
+        self.states = {}  # symbol -> SymbolState
+        self._handlers = {}  # symbol -> {method: [rule, ...]}
+        self._active = set()  # ids of the tick and bar rule copies currently violated
+        self._last_alert = {}  # id of a rule copy -> time of its latest edge alert
+        self.alerts = 0
+        self.lock = threading.RLock()
+
+    def snapshot(self):
+        """Returns the indicator state of every symbol, rules keep only their own short-lived state and start over."""
+        with self.lock:
+            return {symbol: state.snapshot() for symbol, state in list(self.states.items())}
+
+    def restore(self, snapshot):
+        """Continues from snapshot(), e.g. after a restart, so the warm-up does not need a full day of bars."""
+        with self.lock:
+            for symbol, symbol_snapshot in snapshot.items():
+                state, _ = self._state(symbol)
+                state.restore(symbol_snapshot)
+
+    def add_rule(self, rule, symbols=None):
+        """Adds a rule for `symbols`, or for every symbol if None."""
+        with self.lock:
+            if symbols is None:
+                self.rules.append(rule)
+            else:
+                for symbol in symbols:
+                    self.symbol_rules.setdefault(symbol, []).append(rule)
+            # Copies are made again on the next event of each symbol
+            self._handlers.clear()
+
+    def _setup(self, symbol):
+        state = self.states.get(symbol)
+        if state is None:
+            state = self.states[symbol] = SymbolState(symbol, self.atr_period)
+
+        rules = []
+        for template in self.rules + self.symbol_rules.get(symbol, []):
+            rule = copy.copy(template)
+            rule.reset()
+            rules.append(rule)
+        handlers = self._handlers[symbol] = {
+            method: [rule for rule in rules if _overrides(rule, method)]
+            for method in ('on_tick', 'on_bar', 'on_entry', 'on_stop')
+        }
+        return state, handlers
+
+    def _state(self, symbol):
+        handlers = self._handlers.get(symbol)
+        if handlers is None:
+            return self._setup(symbol)
+        return self.states[symbol], handlers
+
+    def _alert(self, state, rule, message):
+        alert = Alert(state.time, state.symbol, rule.name, message, state.price)
+        self.alerts += 1
+        for handler in self.alert_handlers:
+            try:
+                handler(alert)
+            except Exception as e:
+                print(f"Error handling alert of {rule.name}: {e}")
+
+    def _edge(self, state, rule, message):
+        if message is None:
+            self._active.discard(id(rule))
+        elif id(rule) not in self._active:
+            self._active.add(id(rule))
+            last = self._last_alert.get(id(rule))
+            if last is None or (state.time - last).total_seconds() >= self.cooldown:
+                self._last_alert[id(rule)] = state.time
+                self._alert(state, rule, message)
+
+    def on_tick(self, symbol, time, price, bar_time):
+        """Updates the state with a trade and evaluates the tick rules of the symbol.
+
+        `bar_time` is the start of the live bar the trade belongs to, the VWAP
+        treats the trade as part of that bar.
+        """
+        with self.lock:
+            state, handlers = self._state(symbol)
+            state.time = time
+            state.price = price
+            state.vwap_point = state.vwap_engine.update_tick(bar_time, price) or state.vwap_point
+            for rule in handlers['on_tick']:
+                self._edge(state, rule, rule.on_tick(state))
+
+    def on_bar(self, symbol, bar):
+        """Updates the indicators with a closed bar (see bar_aggregator.Bar) and evaluates the bar rules.
+
+        Bars that are not newer than the previous one are ignored, so overlapping
+        historical and live bars can both be passed in.
+        """
+        with self.lock:
+            state, handlers = self._state(symbol)
+            if state.last_bar_time is not None and bar.time <= state.last_bar_time:
+                return
+            state.last_bar_time = bar.time
+            state.atr.update(bar.high, bar.low, bar.close)
+            state.vwap_point = state.vwap_engine.update_bar(bar.time, bar.high, bar.low, bar.close, bar.volume) or state.vwap_point
+            if state.price is None:
+                state.time, state.price = bar.time, bar.close
+
+            for rule in handlers['on_bar']:
+                self._edge(state, rule, rule.on_bar(state, bar))
+
+    def warm_up(self, symbol, bars):
+        """Updates the indicators with closed historical bars, oldest first, without evaluating the bar rules.
+
+        Unlike on_bar, bars older than the forming VWAP bar of the live ticks are
+        still counted. Bars that are not newer than the previous one are ignored.
+        """
+        with self.lock:
+            state, _ = self._state(symbol)
+            for bar in bars:
+                if state.last_bar_time is not None and bar.time <= state.last_bar_time:
+                    continue
+                state.last_bar_time = bar.time
+                state.atr.update(bar.high, bar.low, bar.close)
+                state.vwap_point = state.vwap_engine.add_closed_bar(bar.time, bar.high, bar.low, bar.close, bar.volume) or state.vwap_point
+                if state.price is None:
+                    state.time, state.price = bar.time, bar.close
+
+    def check_entry(self, symbol, side, price, stop=None, time=None):
+        """Returns the messages of the rules a planned entry would break, without recording it."""
+        with self.lock:
+            state, handlers = self._state(symbol)
+            entry = Entry(time or state.time, side, price, 0, stop)
+            messages = []
+            for rule in handlers['on_entry']:
+                if isinstance(rule, MaxTradesPerHour):
+                    continue  # Would record the entry
+                message = rule.on_entry(state, entry)
+                if message is not None:
+                    messages.append(f"{rule.name}: {message}")
+            return messages
+
+    def on_execution(self, symbol, time, side, price, size):
+        """Tracks the position from an execution ('BOT' or 'SLD') and evaluates the entry rules for entries."""
+        with self.lock:
+            state, handlers = self._state(symbol)
+            state.time = time
+            signed = size if side == 'BOT' else -size
+            previous, state.position = state.position, state.position + signed
+            if abs(state.position) <= abs(previous) and previous * state.position >= 0:
+                return  # Reduces or closes the position
+
+            state.entry_price = price
+            entry = Entry(time, 'long' if signed > 0 else 'short', price, size, None)
+            for rule in handlers['on_entry']:
+                message = rule.on_entry(state, entry)
+                if message is not None:
+                    self._alert(state, rule, message)
+
+    def on_stop_order(self, symbol, time, stop):
+        """Evaluates the stop rules for a new or modified stop order."""
+        with self.lock:
+            state, handlers = self._state(symbol)
+            state.time = time
+            for rule in handlers['on_stop']:
+                message = rule.on_stop(state, stop)
+                if message is not None:
+                    self._alert(state, rule, message)
@@ -0,0 +1,44 @@
+import json
+import os
+import time
+
+import numpy as np
+
+
+SNAPSHOT_DIR = 'snapshots'
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, f'{name}.npz')
+
+
+def save_snapshot(path, state, **arrays):
+    """Writes a warm-start snapshot: `state` as JSON and any NumPy arrays, in one .npz file.
+
+    The file is written next to the old one and renamed over it, so a crash while
+    saving leaves the previous snapshot.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    state = dict(state, saved_at=time.time())
+    temp_path = path + '.tmp.npz'
+    np.savez(temp_path, state=np.array(json.dumps(state)), **arrays)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path, max_age=None):
+    """Returns (state, arrays) of a snapshot, or (None, {}) if it is missing, unreadable or older than `max_age` seconds."""
+    try:
+        with np.load(path) as data:
+            state = json.loads(str(data['state']))
+            arrays = {name: data[name] for name in data.files if name != 'state'}
+    except FileNotFoundError:
+        return None, {}
+    except Exception as e:
+        print(f"Ignoring snapshot '{path}': {e}")
+        return None, {}
+
+    age = time.time() - state['saved_at']
+    if max_age is not None and age > max_age:
+        print(f"Ignoring snapshot '{path}' from {age / 3600:.1f} hours ago.")
+        return None, {}
+    return state, arrays
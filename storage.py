@@ -0,0 +1,484 @@
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from archive import Archive, SessionArchiver, archive_csv_files
+from csv_operations import TickJournal, HistoricalBarStore, BAR_REWRITE_WINDOW, historical_data_path, market_data_path, bar_key
+
+
+TICK_DTYPE = np.dtype([('time', 'i8'), ('price', 'f8'), ('size', 'f8')])
+BAR_DTYPE = np.dtype([('time', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'f8')])
+
+# Times are stored as int64 nanoseconds of the naive wall clock time, the same time
+# that is written into the CSV files
+
+
+def tick_ring_path(symbol):
+    return f'ticks_{symbol}.ring'
+
+
+def bar_ring_path(symbol):
+    return f'bars_{symbol}.ring'
+
+
+def tick_shm_name(symbol):
+    return f'dtr_ticks_{symbol}'
+
+
+def bar_shm_name(symbol):
+    return f'dtr_bars_{symbol}'
+
+
+def to_ns(timestamp):
+    """Converts a naive datetime to int64 nanoseconds."""
+    return int(np.datetime64(timestamp, 'ns').astype('i8'))
+
+
+def bar_time_ns(date_str):
+    """Converts an IB bar timestamp string to int64 nanoseconds."""
+    return to_ns(datetime.strptime(bar_key(date_str), '%Y%m%d %H:%M:%S'))
+
+
+def _process_alive(pid):
+    """Returns True if a process with `pid` is running."""
+    if pid <= 0:
+        return False
+    if os.name == 'nt':
+        return True  # os.kill would terminate it; a named block only outlives its last handle on POSIX
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Running under another user
+    return True
+
+
+class MappedRing:
+    """Fixed-capacity ring of fixed-width records in a memory-mapped file.
+
+    The file starts with a 64-byte header (magic, capacity, record size, count,
+    version) followed by `capacity` records of `dtype`. `count` is the number of
+    records ever appended, so record n lives in slot n % capacity. `version` is a
+    sequence counter: it is odd while a write is in progress and even otherwise, so
+    readers can notice an in-place update of the last record and retry a read that
+    overlapped a write. There is one writer; any number of processes can map the
+    file read-only.
+    """
+
+    magic = 0x474E4952545244  # "DTRRING"
+    header_size = 64
+
+    def __init__(self, path, dtype, capacity=1_000_000, writable=True):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.writable = writable
+
+        if writable and not os.path.exists(path):
+            with open(path, 'wb') as file:
+                header = np.array([self.magic, capacity, self.dtype.itemsize, 0, 0], dtype='i8')
+                file.write(header.tobytes().ljust(self.header_size, b'\0'))
+                file.truncate(self.header_size + capacity * self.dtype.itemsize)
+
+        self._bind(np.memmap(path, dtype='u1', mode='r+' if writable else 'r'))
+        if writable and self._header[4] & 1:
+            # The previous writer died in the middle of a write, readers would wait for it forever
+            self._header[4] += 1
+
+    def _bind(self, buffer):
+        """Sets up the header and record views over a byte array."""
+        self._map = buffer
+        self._header = self._map[:self.header_size].view('i8')
+        if self._header[0] != self.magic or self._header[2] != self.dtype.itemsize:
+            raise ValueError(f"'{self.path}' is not a ring of {self.dtype}")
+
+        self.capacity = int(self._header[1])
+        self.records = self._map[self.header_size:self.header_size + self.capacity * self.dtype.itemsize].view(self.dtype)
+
+    @property
+    def count(self):
+        return int(self._header[3])
+
+    @property
+    def version(self):
+        return int(self._header[4])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, records):
+        """Appends a structured array (or a list of tuples) of records."""
+        records = np.asarray(records, dtype=self.dtype)
+        appended = len(records)
+        if len(records) > self.capacity:
+            records = records[-self.capacity:]
+
+        start = (self.count + appended - len(records)) % self.capacity
+        first = min(len(records), self.capacity - start)
+        self._header[4] += 1  # Odd: write in progress
+        self.records[start:start + first] = records[:first]
+        self.records[:len(records) - first] = records[first:]
+
+        # Publish the records only after they have been written
+        self._header[3] += appended
+        self._header[4] += 1
+
+    def replace(self, position, record):
+        """Overwrites the record appended at `position` (a previous count) in place."""
+        self._header[4] += 1
+        self.records[position % self.capacity] = record
+        self._header[4] += 1
+
+    def replace_last(self, record):
+        """Overwrites the newest record in place."""
+        self.replace(self.count - 1, record)
+
+    def last_record(self):
+        return self.records[(self.count - 1) % self.capacity] if self.count else None
+
+    def since(self, position):
+        """Returns the records appended at or after `position` (a previous count).
+
+        The result is a view into the map unless it wraps around the end of the ring.
+        Records that have already been overwritten are skipped.
+        """
+        count = self.count
+        position = max(position, count - self.capacity, 0)
+        if position >= count:
+            return self.records[:0]
+
+        start = position % self.capacity
+        end = start + count - position
+        if end <= self.capacity:
+            return self.records[start:end]
+        return np.concatenate([self.records[start:], self.records[:end - self.capacity]])
+
+    def last(self, n=None):
+        """Returns the newest `n` records, all stored records by default."""
+        n = len(self) if n is None else min(n, len(self))
+        return self.since(self.count - n)
+
+    def reset(self):
+        """Forgets every record."""
+        self._header[4] += 1
+        self._header[3] = 0
+        self._header[4] += 1
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        if self.writable:
+            self._map.flush()
+        self._map = self._header = self.records = None
+
+
+class SharedRing(MappedRing):
+    """MappedRing in a named multiprocessing.shared_memory block instead of a file.
+
+    Nothing touches the disk. The writer creates the block and readers attach to it
+    by name. Every block gets a random instance id and the pid of its writer in the
+    header, so readers can notice that the writer has restarted with a new block
+    (is_current) and attach again. A block left behind by a writer that is no
+    longer running is replaced; if its writer is still running, opening the ring
+    for writing raises RuntimeError. The block is removed when the writer closes the
+    ring, unless another writer has replaced it by then.
+    """
+
+    def __init__(self, name, dtype, capacity=500_000, writable=True):
+        from multiprocessing import shared_memory
+
+        self.path = self.name = name
+        self.dtype = np.dtype(dtype)
+        self.writable = writable
+        size = self.header_size + capacity * self.dtype.itemsize
+
+        if writable:
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                self._replace_stale(name)
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            header = np.array([self.magic, capacity, self.dtype.itemsize, 0, 0,
+                               int.from_bytes(os.urandom(7), 'little'), os.getpid()], dtype='i8')
+            self._shm.buf[:header.nbytes] = header.tobytes()
+        else:
+            self._shm = self._attach(name)
+
+        self._bind(np.ndarray((self._shm.size,), dtype='u1', buffer=self._shm.buf))
+
+    @staticmethod
+    def _replace_stale(name):
+        """Removes the block `name` if its writer is no longer running, raises RuntimeError if it is.
+
+        Readers still mapping the old block keep their copy and notice the new
+        instance id through is_current.
+        """
+        from multiprocessing import resource_tracker, shared_memory
+
+        stale = shared_memory.SharedMemory(name)
+        pid = int(np.ndarray((7,), dtype='i8', buffer=stale.buf)[6]) if stale.size >= 56 else 0
+        if _process_alive(pid):
+            resource_tracker.unregister(stale._name, 'shared_memory')
+            stale.close()
+            raise RuntimeError(f"Shared memory block '{name}' is in use by the streamer process {pid}")
+        stale.unlink()
+        stale.close()
+
+    @staticmethod
+    def _attach(name):
+        """Attaches to an existing block without letting this process remove it at exit."""
+        from multiprocessing import resource_tracker, shared_memory
+
+        shm = shared_memory.SharedMemory(name)
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+    @property
+    def instance(self):
+        return int(self._header[5])
+
+    def is_current(self):
+        """Returns False if the block has been removed or replaced by a new writer."""
+        try:
+            shm = self._attach(self.name)
+        except FileNotFoundError:
+            return False
+        try:
+            return int(np.ndarray((6,), dtype='i8', buffer=shm.buf)[5]) == self.instance
+        finally:
+            shm.close()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.writable:
+            from multiprocessing import resource_tracker
+
+            if self.is_current():
+                self._shm.unlink()
+            else:
+                # Replaced by another writer, the name is not ours to remove
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._map = self._header = self.records = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # Views of the block are still alive, it is unmapped when they are gone
+
+
+class RingReader:
+    """Returns copies of the records added to a MappedRing since the previous read.
+
+    With `reread` the newest `reread` records are returned again whenever the ring
+    has changed, which picks up bars that were updated in place. A read that
+    overlaps a write is retried, see the version counter of MappedRing.
+    """
+
+    max_retries = 500  # Reads that overlap a write before giving up until the next call
+
+    def __init__(self, ring, reread=0):
+        self.ring = ring
+        self.reread = reread
+        self.position = 0
+        self.version = None
+
+    def read_new(self):
+        for _ in range(self.max_retries):
+            version = self.ring.version
+            if version == self.version:
+                return self.ring.records[:0]
+            if version & 1:
+                time.sleep(0)  # The writer is in the middle of a write
+                continue
+
+            count = self.ring.count
+            position = 0 if count < self.position else self.position  # The ring may have been reset
+            records = np.array(self.ring.since(max(position - self.reread, 0)))
+            if self.ring.version == version:
+                break
+        else:
+            return self.ring.records[:0]  # The writer is stuck or has died mid-write, try again later
+
+        self.version = version
+        self.position = count
+        return records
+
+
+def tick_records(ticks):
+    """Converts (datetime, price, size) ticks to TICK_DTYPE records."""
+    return np.array([(to_ns(timestamp), price, size) for timestamp, price, size in ticks], dtype=TICK_DTYPE)
+
+
+def bar_record(row):
+    """Converts a bar row [date, open, high, low, close, volume] to a BAR_DTYPE tuple."""
+    return (bar_time_ns(row[0]), row[1], row[2], row[3], row[4], row[5])
+
+
+class CsvStorage:
+    """Default storage backend, the CSV files read by DataPlotter.
+
+    The CSV files only hold the current day and the newest ticks, so the whole
+    session is also collected in memory and archived under `archive_dir` (if set)
+    when the day changes and on close. Data of an earlier day still in the CSV
+    files is archived before the files are cleared.
+    """
+
+    def __init__(self, symbol, archive_dir='archive'):
+        self.archiver = None
+        if archive_dir:
+            archive = Archive(archive_dir)
+            archive_csv_files(symbol, archive, historical_data_path(symbol), market_data_path(symbol))
+            self.archiver = SessionArchiver(symbol, archive, TICK_DTYPE, BAR_DTYPE)
+        self.tick_journal = TickJournal(market_data_path(symbol))
+        self.bar_store = HistoricalBarStore(historical_data_path(symbol))
+
+    def write_ticks(self, ticks):
+        """Writes a batch of (datetime, price, size) ticks."""
+        self.tick_journal.write_many(ticks)
+        if self.archiver is not None:
+            self.archiver.add_ticks(tick_records(ticks))
+
+    def write_bars(self, rows):
+        """Writes bar rows [date, open, high, low, close, volume] with upsert semantics."""
+        self.bar_store.upsert(rows)
+        if self.archiver is not None:
+            for row in rows:
+                self.archiver.add_bar(bar_record(row))
+
+    def last_bar_key(self):
+        """Returns the bar_key of the newest stored bar, or None."""
+        return self.bar_store.last_key
+
+    def archive_session(self):
+        """Archives the ticks and bars collected so far, e.g. at the end of the trading session."""
+        if self.archiver is not None:
+            self.archiver.flush()
+
+    def close(self):
+        self.tick_journal.close()
+        self.bar_store.close()
+        self.archive_session()
+
+
+class NumpyStorage:
+    """Columnar storage backend: memory-mapped fixed-width rings of ticks and bars.
+
+    Readers map the same files and get the records without any parsing. When the
+    first tick or bar of a new day arrives, the previous day is moved to the archive
+    under `archive_dir` (if set) and the ring starts over. On close the current day
+    is archived as well.
+    """
+
+    def __init__(self, symbol, tick_capacity=2_000_000, bar_capacity=100_000, archive_dir='archive'):
+        self.symbol = symbol
+        self.archive = Archive(archive_dir) if archive_dir else None
+        self.ticks, self.bars = self.open_rings(symbol, tick_capacity, bar_capacity)
+
+    def open_rings(self, symbol, tick_capacity, bar_capacity):
+        return (MappedRing(tick_ring_path(symbol), TICK_DTYPE, tick_capacity),
+                MappedRing(bar_ring_path(symbol), BAR_DTYPE, bar_capacity))
+
+    def _roll_day(self, ring, kind, first_time_ns):
+        """Archives and resets `ring` if its data is from an earlier day than `first_time_ns`."""
+        last = ring.last_record()
+        if last is None:
+            return
+
+        last_day = np.datetime64(int(last['time']), 'ns').astype('datetime64[D]')
+        new_day = np.datetime64(first_time_ns, 'ns').astype('datetime64[D]')
+        if new_day <= last_day:
+            return
+
+        self._archive(ring, kind)
+        ring.reset()
+
+    def _archive(self, ring, kind):
+        if self.archive is None or not len(ring):
+            return
+        try:
+            self.archive.write(self.symbol, kind, ring.last())
+        except Exception as e:
+            print(f"Error archiving {kind} of {self.symbol}: {e}")
+
+    def write_ticks(self, ticks):
+        """Writes a batch of (datetime, price, size) ticks."""
+        records = tick_records(ticks)
+        self._roll_day(self.ticks, 'ticks', int(records['time'][0]))
+        self.ticks.append(records)
+
+    def write_bars(self, rows):
+        """Writes bar rows [date, open, high, low, close, volume] with upsert semantics."""
+        for row in rows:
+            record = bar_record(row)
+            last = self.bars.last_record()
+
+            if last is not None and record[0] < last['time']:
+                self._replace_bar(record)
+                continue
+            if last is not None and record[0] == last['time']:
+                self.bars.replace_last(record)
+                continue
+
+            self._roll_day(self.bars, 'bars', record[0])
+            self.bars.append([record])
+
+    def _replace_bar(self, record):
+        """Updates an older bar in place if it is one of the newest BAR_REWRITE_WINDOW bars, e.g. with the final values from IB."""
+        recent = self.bars.last(BAR_REWRITE_WINDOW)
+        index = int(np.searchsorted(recent['time'], record[0]))
+        if index < len(recent) and recent['time'][index] == record[0] and recent[index].item() != record:
+            self.bars.replace(self.bars.count - len(recent) + index, record)
+
+    def last_bar_key(self):
+        """Returns the bar_key of the newest stored bar, or None."""
+        last = self.bars.last_record()
+        if last is None:
+            return None
+        return str(np.datetime64(int(last['time']), 'ns').astype('M8[s]').astype(object).strftime('%Y%m%d %H:%M:%S'))
+
+    def archive_session(self):
+        """Archives the current day of both rings. The rings are kept, archiving them again only rewrites the day."""
+        self._archive(self.ticks, 'ticks')
+        self._archive(self.bars, 'bars')
+
+    def close(self):
+        self.archive_session()
+        self.ticks.close()
+        self.bars.close()
+
+
+class SharedMemoryStorage(NumpyStorage):
+    """NumpyStorage in shared memory: a live feed for any number of reader processes, no disk traffic.
+
+    Only the archives are written to disk.
+    """
+
+    def __init__(self, symbol, tick_capacity=500_000, bar_capacity=20_000, archive_dir='archive'):
+        super().__init__(symbol, tick_capacity, bar_capacity, archive_dir)
+
+    def open_rings(self, symbol, tick_capacity, bar_capacity):
+        return (SharedRing(tick_shm_name(symbol), TICK_DTYPE, tick_capacity),
+                SharedRing(bar_shm_name(symbol), BAR_DTYPE, bar_capacity))
+
+
+STORAGE_BACKENDS = {
+    'csv': CsvStorage,
+    'numpy': NumpyStorage,
+    'shm': SharedMemoryStorage,
+}
+
+
+def create_storage(kind, symbol):
+    """Creates the storage backend `kind` ('csv', 'numpy' or 'shm') for a symbol."""
+    try:
+        backend = STORAGE_BACKENDS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{kind}', expected one of {list(STORAGE_BACKENDS)}")
+    return backend(symbol)
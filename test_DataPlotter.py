@@ -0,0 +1,49 @@
+import pandas as pd
+
+from DataPlotter import RenderScheduler
+from vwap import VwapEngine
+
+
+def bars(*rows):
+    return pd.DataFrame(rows, columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+
+
+def ticks(*rows):
+    return pd.DataFrame(rows, columns=['time', 'price', 'size'])
+
+
+def scheduler(df):
+    renderer = RenderScheduler(chart=None, vwap_engine=VwapEngine(), vwap_lines={})
+    renderer.add_bars(df)
+    renderer.load(df)
+    return renderer
+
+
+def test_ticks_of_the_newest_bar_are_merged_without_their_size():
+    minute = pd.Timestamp('2026-10-16 10:00')
+    renderer = scheduler(bars((minute, 10.0, 10.5, 9.5, 10.0, 500.0)))
+
+    renderer.add_ticks(ticks((minute + pd.Timedelta(seconds=30), 11.0, 100.0)), sizes_from=minute + pd.Timedelta(minutes=1))
+
+    assert renderer.candle == {'time': minute, 'open': 10.0, 'high': 11.0, 'low': 9.5, 'close': 11.0, 'volume': 500.0}
+
+
+def test_ticks_after_the_newest_bar_start_a_candle():
+    minute = pd.Timestamp('2026-10-16 10:00')
+    renderer = scheduler(bars((minute, 10.0, 10.5, 9.5, 10.0, 500.0)))
+
+    renderer.add_ticks(ticks((minute + pd.Timedelta(seconds=61), 10.2, 100.0),
+                             (minute + pd.Timedelta(seconds=62), 10.1, 200.0)), sizes_from=minute + pd.Timedelta(minutes=1))
+
+    next_minute = minute + pd.Timedelta(minutes=1)
+    assert renderer.candle == {'time': next_minute, 'open': 10.2, 'high': 10.2, 'low': 10.1, 'close': 10.1, 'volume': 300.0}
+    assert set(renderer.pending) == {minute, next_minute}
+
+
+def test_ticks_of_older_candles_are_skipped():
+    minute = pd.Timestamp('2026-10-16 10:00')
+    renderer = scheduler(bars((minute, 10.0, 10.5, 9.5, 10.0, 500.0)))
+
+    renderer.add_ticks(ticks((minute - pd.Timedelta(seconds=1), 20.0, 100.0)))
+
+    assert renderer.candle['high'] == 10.5
@@ -0,0 +1,41 @@
+import pytest
+
+from LiveDataStreamer import is_warning
+
+
+@pytest.mark.parametrize('code', [2104, 2106, 2158, 2176, 10167])
+def test_notices_are_warnings(code):
+    assert is_warning(code)
+
+
+@pytest.mark.parametrize('code', [162, 200, 321, 366, 2200, 10089, 10197, 10314])
+def test_request_failures_are_not_warnings(code):
+    assert not is_warning(code)
+
+
+class StopRules:
+    def __init__(self):
+        self.stops = []
+
+    def on_stop_order(self, symbol, time, stop):
+        self.stops.append(stop)
+
+
+def test_stop_order_is_checked_once_per_stop_price():
+    from ibapi.contract import Contract
+    from ibapi.order import Order
+    from LiveDataStreamer import TestApp
+
+    app = TestApp()
+    app.rules = StopRules()
+    contract = Contract()
+    contract.symbol = 'NVDA'
+    order = Order()
+    order.orderType = 'STP'
+    try:
+        for stop in (100.0, 100.0, 101.0, 101.0):
+            order.auxPrice = stop
+            app.openOrder(7, contract, order, None)
+    finally:
+        app.stop_writer()
+    assert app.rules.stops == [100.0, 101.0]
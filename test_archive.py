@@ -0,0 +1,49 @@
+import numpy as np
+
+from archive import Archive, SessionArchiver
+from storage import BAR_DTYPE, TICK_DTYPE
+
+MINUTE = 60_000_000_000
+
+
+def day_ns(day):
+    return int(np.datetime64(day, 'ns').astype('i8'))
+
+
+def bar_records(first_ns, count, close=1.0):
+    return np.array([(first_ns + n * MINUTE, 1.0, 2.0, 0.5, close, 10.0) for n in range(count)], dtype=BAR_DTYPE)
+
+
+def test_write_partitions_by_day_and_load_reads_the_range(tmp_path):
+    archive = Archive(str(tmp_path))
+    first = day_ns('2026-10-15T15:58')
+    archive.write('NVDA', 'bars', np.concatenate([bar_records(first, 2), bar_records(day_ns('2026-10-16T09:30'), 3)]))
+
+    assert [row['date'] for row in archive.partitions('NVDA')] == ['2026-10-15', '2026-10-16']
+    df = archive.load('NVDA', start='2026-10-16T09:31', end='2026-10-16T09:33', fields=['close'])
+    assert list(df.columns) == ['time', 'close']
+    assert len(df) == 2
+
+
+def test_archiving_a_session_again_replaces_its_rows(tmp_path):
+    archive = Archive(str(tmp_path))
+    first = day_ns('2026-10-16T09:30')
+    archive.write('NVDA', 'bars', bar_records(first, 3))
+    archive.write('NVDA', 'bars', bar_records(first + MINUTE, 3, close=5.0))
+
+    df = archive.load('NVDA')
+    assert df['close'].tolist() == [1.0, 5.0, 5.0, 5.0]
+
+
+def test_session_archiver_replaces_rewritten_bars_and_flushes_each_day(tmp_path):
+    archive = Archive(str(tmp_path))
+    archiver = SessionArchiver('NVDA', archive, TICK_DTYPE, BAR_DTYPE)
+    first = day_ns('2026-10-15T15:58')
+    for record in bar_records(first, 2):
+        archiver.add_bar(record.item())
+    archiver.add_bar((first + MINUTE, 1.0, 3.0, 0.5, 2.5, 20.0))  # Final values of the last bar
+    archiver.add_bar((day_ns('2026-10-16T09:30'), 1.0, 2.0, 0.5, 1.0, 10.0))  # Next day archives the previous one
+
+    assert archive.load('NVDA', end='2026-10-16')['close'].tolist() == [1.0, 2.5]
+    archiver.flush()
+    assert len(archive.load('NVDA', start='2026-10-16')) == 1
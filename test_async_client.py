@@ -0,0 +1,45 @@
+import asyncio
+
+from async_client import PacingLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_requests_of_one_contract_are_limited_per_key_period():
+    clock = Clock()
+    limiter = PacingLimiter(max_per_key=2, key_period=2.0, clock=clock)
+    limiter.record('NVDA')
+    clock.now = 0.5
+    limiter.record('NVDA')
+
+    assert limiter.delay('NVDA') == 1.5
+    assert limiter.delay('AAPL') == 0.0
+    clock.now = 2.0
+    assert limiter.delay('NVDA') == 0.0
+
+
+def test_overall_limit_for_small_bars():
+    clock = Clock()
+    limiter = PacingLimiter.for_bar_size(5, clock=clock)
+    for n in range(60):
+        limiter.record(n)
+
+    assert limiter.delay('next') == 600.0
+    assert PacingLimiter.for_bar_size(60).max_requests is None
+
+
+def test_acquire_waits_for_the_limit():
+    limiter = PacingLimiter(max_per_key=1, key_period=0.05)
+
+    async def requests():
+        await limiter.acquire('NVDA')
+        await limiter.acquire('NVDA')
+
+    asyncio.run(requests())
+    assert limiter.waits == 1
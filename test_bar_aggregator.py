@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from bar_aggregator import BarAggregator
+
+
+START = datetime(2026, 10, 16, 10, 0)
+
+
+def test_ticks_build_bars_and_close_them_on_the_next_bar():
+    closed = []
+    aggregator = BarAggregator(60, on_bar_close=closed.append)
+    for seconds, price in [(1, 10.0), (20, 10.5), (40, 9.8), (59, 10.1), (61, 10.2)]:
+        aggregator.on_price(START + timedelta(seconds=seconds), price)
+
+    assert len(closed) == 1
+    bar = closed[0]
+    assert (bar.time, bar.open, bar.high, bar.low, bar.close) == (START, 10.0, 10.5, 9.8, 10.1)
+    assert aggregator.bar.time == START + timedelta(minutes=1)
+
+
+def test_volume_is_the_difference_of_the_cumulative_volume():
+    aggregator = BarAggregator(60)
+    aggregator.on_price(START, 10.0)
+    aggregator.on_total_volume(START, 1000)  # First value of the day only sets the baseline
+    aggregator.on_total_volume(START + timedelta(seconds=5), 1300)
+    aggregator.on_total_volume(START + timedelta(seconds=9), 1500)
+
+    assert aggregator.bar.volume == 500
+
+
+def test_reconcile_replaces_a_closed_bar_and_ignores_older_ones():
+    aggregator = BarAggregator(60, history=2)
+    for minute in range(4):
+        aggregator.on_price(START + timedelta(minutes=minute), 10.0)
+
+    bar = aggregator.reconcile(START + timedelta(minutes=2), 9.0, 11.0, 8.0, 10.5, 700)
+    assert (bar.open, bar.high, bar.low, bar.close, bar.volume) == (9.0, 11.0, 8.0, 10.5, 700)
+    assert aggregator.reconcile(START, 9.0, 11.0, 8.0, 10.5, 700) is None
+
+
+def test_interval_must_divide_a_day():
+    with pytest.raises(ValueError):
+        BarAggregator(7)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from bar_history import BarHistory
+
+
+def bars(start, count, close=1.0):
+    dates = pd.date_range(start, periods=count, freq='min')
+    return pd.DataFrame({'date': dates, 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': close, 'volume': 10.0})
+
+
+def test_upsert_appends_and_replaces_bars():
+    history = BarHistory(chunk_size=4)
+    assert history.upsert(bars('2026-10-16 10:00', 3)) == 3
+    assert history.upsert(bars('2026-10-16 10:02', 3, close=5.0)) == 2
+
+    frame = history.frame()
+    assert len(history) == 5
+    assert frame['close'].tolist() == [1.0, 1.0, 5.0, 5.0, 5.0]
+    assert history.last_time == pd.Timestamp('2026-10-16 10:04')
+
+
+def test_columns_grow_past_the_chunk_size():
+    history = BarHistory(chunk_size=4)
+    for minute in range(10):
+        history.upsert(bars(pd.Timestamp('2026-10-16 10:00') + pd.Timedelta(minutes=minute), 1))
+
+    times, _ = history.arrays()
+    assert len(history) == 10
+    assert (np.diff(times) == 60_000_000_000).all()
+
+
+def test_retention_drops_old_bars():
+    history = BarHistory(chunk_size=4, retention=pd.Timedelta(minutes=2))
+    history.upsert(bars('2026-10-16 10:00', 6))
+
+    assert history.frame()['date'].tolist() == list(pd.date_range('2026-10-16 10:03', periods=3, freq='min'))
+
+
+def test_bars_without_a_date_are_skipped():
+    history = BarHistory()
+    df = bars('2026-10-16 10:00', 2)
+    df.loc[0, 'date'] = pd.NaT
+    assert history.upsert(df) == 1
@@ -0,0 +1,114 @@
+import csv
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from csv_operations import TickJournal, HistoricalBarStore
+
+
+def read_rows(path):
+    with open(path, newline='') as file:
+        return list(csv.reader(file))[1:]
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'ticks.csv')
+
+
+def test_journal_flushes_buffered_ticks_without_new_ticks(journal_path):
+    journal = TickJournal(journal_path, batch_size=10, flush_interval=0.05)
+    journal.write(datetime.now(), 10.0)
+    assert read_rows(journal_path) == []
+
+    time.sleep(0.2)
+    assert [row[1] for row in read_rows(journal_path)] == ['10.0']
+    journal.close()
+
+
+def test_journal_flushes_full_batch_and_on_close(journal_path):
+    journal = TickJournal(journal_path, batch_size=2, flush_interval=60)
+    now = datetime.now()
+    journal.write(now, 1.0)
+    journal.write(now, 2.0)
+    journal.write(now, 3.0)
+    assert len(read_rows(journal_path)) == 2
+
+    journal.close()
+    assert [row[1] for row in read_rows(journal_path)] == ['1.0', '2.0', '3.0']
+
+
+def test_journal_rolls_over_by_size_keeping_recent_ticks(journal_path):
+    journal = TickJournal(journal_path, max_rows=5, rows_to_keep=3)
+    now = datetime.now()
+    journal.write_many([(now + timedelta(seconds=n), float(n), 100.0) for n in range(4)])
+    journal.write_many([(now + timedelta(seconds=n), float(n)) for n in range(4, 6)])
+
+    rows = read_rows(journal_path)
+    assert [float(row[1]) for row in rows] == [3.0, 4.0, 5.0]
+    assert journal.row_count == 3
+    journal.close()
+
+
+def test_journal_rolls_over_on_new_day(journal_path):
+    journal = TickJournal(journal_path)
+    today = datetime.now()
+    journal.write_many([(today - timedelta(days=1), 1.0)])
+    journal.write_many([(today, 2.0)])
+
+    assert [row[1] for row in read_rows(journal_path)] == ['2.0']
+    assert journal.date == today.date()
+    journal.close()
+
+
+@pytest.fixture
+def bar_path(tmp_path):
+    return str(tmp_path / 'bars.csv')
+
+
+def day(offset=0):
+    return (datetime.now() + timedelta(days=offset)).strftime('%Y%m%d')
+
+
+def test_bar_store_appends_new_bars_and_rewrites_changed_ones(bar_path):
+    store = HistoricalBarStore(bar_path, rewrite_window=3)
+    assert store.upsert([[f'{day()} 10:00:00', 1, 2, 0.5, 1.5, 100], [f'{day()} 10:01:00', 1.5, 2, 1, 1.8, 200]]) == 2
+
+    # Final values of 10:01 and a new bar
+    assert store.upsert([[f'{day()} 10:01:00', 1.5, 2.2, 1, 2.1, 250], [f'{day()} 10:02:00', 2.1, 2.1, 2, 2, 50]]) == 2
+    store.close()
+
+    rows = read_rows(bar_path)
+    assert [row[0] for row in rows] == [f'{day()} 10:00:00', f'{day()} 10:01:00', f'{day()} 10:02:00']
+    assert rows[1][4:] == ['2.1', '250.0']
+
+
+def test_bar_store_ignores_ib_date_format_of_an_unchanged_bar(bar_path):
+    store = HistoricalBarStore(bar_path)
+    store.upsert([[f'{day()} 10:00:00', 1.0, 2.0, 0.5, 1.5, 100.0]])
+
+    # IB separates the date and time with two spaces and adds the time zone
+    assert store.upsert([[f'{day()}  10:00:00 US/Eastern', 1.0, 2.0, 0.5, 1.5, 100]]) == 0
+    store.close()
+    assert read_rows(bar_path) == [[f'{day()} 10:00:00', '1.0', '2.0', '0.5', '1.5', '100.0']]
+
+
+def test_bar_store_starts_a_new_file_for_a_new_day(bar_path):
+    store = HistoricalBarStore(bar_path)
+    store.upsert([[f'{day(-1)} 15:59:00', 1, 1, 1, 1, 10]])
+    store.upsert([[f'{day()} 09:30:00', 2, 2, 2, 2, 20]])
+    store.close()
+
+    assert [row[0] for row in read_rows(bar_path)] == [f'{day()} 09:30:00']
+
+
+def test_bar_store_reopens_with_the_last_bars(bar_path):
+    store = HistoricalBarStore(bar_path)
+    store.upsert([[f'{day()} 10:00:00', 1, 1, 1, 1, 10]])
+    store.close()
+
+    store = HistoricalBarStore(bar_path)
+    assert store.last_key == f'{day()} 10:00:00'
+    assert store.upsert([[f'{day()} 10:00:00', 1, 1, 1, 1, 10]]) == 0
+    store.close()
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pytest
+
+from data_writer import DataWriter
+
+
+def test_block_policy_keeps_every_tick():
+    written = []
+
+    def slow_write(payloads):
+        time.sleep(0.001)
+        written.extend(payloads)
+
+    writer = DataWriter({'tick': slow_write}, maxsize=10, policy='block', batch_size=5)
+    writer.start()
+    for n in range(500):
+        writer.put_tick('t', n)
+    writer.stop()
+
+    assert written == list(range(500))
+    assert writer.stats()['dropped'] == 0
+
+
+def test_drop_oldest_policy_counts_dropped_ticks():
+    writer = DataWriter({'tick': lambda payloads: None}, maxsize=2, policy='drop_oldest')
+    for n in range(5):
+        writer.put_tick('t', n)
+
+    assert writer.dropped == 3
+    assert [entry[2] for entry in writer._queue] == [3, 4]
+
+
+def test_coalesce_policy_overwrites_tick_of_same_key():
+    writer = DataWriter({'tick': lambda payloads: None}, maxsize=2, policy='coalesce')
+    writer.put_tick('a', 1)
+    writer.put_tick('b', 1)
+    writer.put_tick('a', 2)
+
+    assert writer.coalesced == 1
+    assert [entry[2] for entry in writer._queue] == [2, 1]
+
+
+def test_bars_are_written_in_order_with_ticks():
+    written = []
+    done = threading.Event()
+    writer = DataWriter({'tick': lambda payloads: written.append(('tick', payloads)),
+                         'bars': lambda payloads: (written.append(('bars', payloads)), done.set())})
+    writer.put_tick('t', 1)
+    writer.put_bars('b', [[1]])
+    writer.start()
+    assert done.wait(5)
+    writer.stop()
+
+    assert written == [('tick', [1]), ('bars', [[[1]]])]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        DataWriter({}, policy='drop_newest')
@@ -0,0 +1,52 @@
+from file_tail import CsvTail
+
+
+def write(path, text, mode='a'):
+    with open(path, mode, newline='') as file:
+        file.write(text)
+
+
+def test_reads_only_new_complete_rows(tmp_path):
+    path = str(tmp_path / 'ticks.csv')
+    write(path, 'time,price\n1,10\n2,11\n3,1', mode='w')
+    tail = CsvTail(path)
+
+    assert tail.read_new_rows() == [['1', '10'], ['2', '11']]
+    assert tail.header == ['time', 'price']
+    assert tail.read_new_rows() == []
+
+    write(path, '2\n')
+    assert tail.read_new_rows() == [['3', '12']]
+
+
+def test_rereads_the_last_rows_for_bars_rewritten_in_place(tmp_path):
+    path = str(tmp_path / 'bars.csv')
+    write(path, 'date,close\nA,1\nB,2\n', mode='w')
+    tail = CsvTail(path, reread_rows=1)
+    tail.read_new_rows()
+
+    write(path, 'date,close\nA,1\nB,3\nC,4\n', mode='w')
+    assert tail.read_new_rows() == [['B', '3'], ['C', '4']]
+
+
+def test_starts_over_when_the_file_is_truncated(tmp_path):
+    path = str(tmp_path / 'ticks.csv')
+    write(path, 'time,price\n1,10\n2,11\n', mode='w')
+    tail = CsvTail(path)
+    tail.read_new_rows()
+
+    write(path, 'time,price\n5,9\n', mode='w')
+    assert tail.read_new_rows() == [['5', '9']]
+    assert tail.resets == 1
+
+
+def test_restore_continues_from_saved_position(tmp_path):
+    path = str(tmp_path / 'ticks.csv')
+    write(path, 'time,price\n1,10\n', mode='w')
+    tail = CsvTail(path)
+    tail.read_new_rows()
+    write(path, '2,11\n')
+
+    restored = CsvTail(path)
+    assert restored.restore(tail.state())
+    assert restored.read_new_rows() == [['2', '11']]
@@ -0,0 +1,46 @@
+import pytest
+
+from metrics import Metrics
+
+
+def test_render_uses_the_prometheus_text_format():
+    metrics = Metrics()
+    metrics.counter('ticks_total', 'Ticks', symbol='NVDA').inc(3)
+    metrics.gauge('queue_depth', 'Depth', function=lambda: 7)
+
+    text = metrics.render()
+    assert '# TYPE ticks_total counter\n' in text
+    assert 'ticks_total{symbol="NVDA"} 3\n' in text
+    assert 'queue_depth 7\n' in text
+
+
+def test_same_name_and_labels_return_the_same_metric():
+    metrics = Metrics()
+    assert metrics.counter('a', x='1') is metrics.counter('a', x='1')
+    assert metrics.counter('a', x='1') is not metrics.counter('a', x='2')
+
+
+def test_histogram_counts_and_quantiles():
+    metrics = Metrics()
+    histogram = metrics.histogram('latency', buckets=(0.001, 0.01, 0.1))
+    for value in (0.0005, 0.005, 0.005, 0.05):
+        histogram.observe(value)
+
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(0.0605)
+    assert 0.001 <= histogram.quantile(0.5) <= 0.01
+    assert 'latency_bucket{le="+Inf"} 4' in metrics.render()
+
+
+def test_timed_measures_only_when_enabled():
+    metrics = Metrics()
+
+    @metrics.timed('call_seconds')
+    def call():
+        return 1
+
+    assert call() == 1
+    assert metrics.histogram('call_seconds').count == 0
+    metrics.enabled = True
+    call()
+    assert metrics.histogram('call_seconds').count == 1
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from replay import ReplayEngine, ReplaySession, bars_from_ticks, load_ticks, replay_into_app
+
+START = datetime(2026, 10, 16, 10, 0)
+
+
+def recorded_ticks(count, step=timedelta(seconds=7)):
+    return [(START + n * step, 100.0 + n % 5, 100.0 * (1 + n % 3)) for n in range(count)]
+
+
+def test_load_ticks_sorts_csv_rows(tmp_path):
+    path = tmp_path / 'ticks.csv'
+    path.write_text('time,price,size\n2026-10-16T10:00:02,10.5,200\n2026-10-16T10:00:01,10.0,\n')
+
+    assert load_ticks(str(path)) == [(START + timedelta(seconds=1), 10.0, 0.0), (START + timedelta(seconds=2), 10.5, 200.0)]
+
+
+def test_bars_from_ticks_and_completed_bars():
+    session = ReplaySession(recorded_ticks(20))
+    bars = bars_from_ticks(session.ticks)
+    assert [bar.time for bar in bars] == [START + timedelta(minutes=minute) for minute in range(3)]
+    assert sum(bar.volume for bar in bars) == sum(size for _, _, size in session.ticks)
+
+    # Only the bars that had closed by 10:02:30
+    completed = session.completed_bars(START + timedelta(minutes=2, seconds=30), 3600)
+    assert [bar.time for bar in completed] == [START, START + timedelta(minutes=1)]
+
+
+def test_replay_into_streamer_stores_every_tick_with_its_size(tmp_path, monkeypatch):
+    from LiveDataStreamer import TestApp
+    from storage import MappedRing, TICK_DTYPE, tick_ring_path
+
+    monkeypatch.chdir(tmp_path)
+    ticks = recorded_ticks(2000, step=timedelta(milliseconds=50))
+    app = TestApp(writer_policy='block')
+    app.storage = 'numpy'
+    stream = app.add_symbol('TEST')
+    replay_into_app(app, ReplayEngine({'TEST': ReplaySession(ticks)}, speed=0))
+    assert app.stop_writer() == 0
+
+    ring = MappedRing(tick_ring_path('TEST'), TICK_DTYPE, writable=False)
+    records = np.array(ring.last())
+    ring.close()
+    stream.storage.close()
+    assert len(records) == len(ticks)
+    assert records['size'].tolist() == [size for _, _, size in ticks]
@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+from rules import RuleEngine, PriceLevel
+
+
+def engine(*rules):
+    alerts = []
+    return RuleEngine(rules, alert_handlers=(alerts.append,)), alerts
+
+
+def test_tick_vwap_uses_the_bar_time_of_the_aggregator():
+    rules, _ = engine()
+    # IB bar time zone differs from the local tick timestamps
+    rules.on_tick('NVDA', datetime(2026, 10, 16, 16, 30, 15), 10.0, bar_time=datetime(2026, 10, 16, 10, 30))
+    assert rules.states['NVDA'].vwap_point['time'] == datetime(2026, 10, 16, 10, 30)
+
+
+def test_price_level_alerts_once_until_satisfied_again():
+    rules, alerts = engine(PriceLevel(10.0))
+    start = datetime(2026, 10, 16, 10, 0)
+    for seconds, price in [(0, 9.0), (1, 10.0), (2, 10.5), (3, 9.5), (120, 10.1)]:
+        time = start + timedelta(seconds=seconds)
+        rules.on_tick('NVDA', time, price, bar_time=time.replace(second=0))
+    assert [alert.price for alert in alerts] == [10.0, 10.1]
+
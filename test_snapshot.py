@@ -0,0 +1,32 @@
+import os
+import time
+
+import numpy as np
+
+from snapshot import save_snapshot, load_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'snapshots' / 'plotter_NVDA.npz')
+    save_snapshot(path, {'storage': 'csv'}, times=np.arange(3))
+
+    state, arrays = load_snapshot(path)
+    assert state['storage'] == 'csv'
+    assert arrays['times'].tolist() == [0, 1, 2]
+    assert not os.path.exists(path + '.tmp.npz')
+
+
+def test_missing_or_old_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / 'plotter_NVDA.npz')
+    assert load_snapshot(path) == (None, {})
+
+    save_snapshot(path, {})
+    time.sleep(0.01)
+    assert load_snapshot(path, max_age=0.001) == (None, {})
+
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / 'plotter_NVDA.npz')
+    with open(path, 'wb') as file:
+        file.write(b'not a snapshot')
+    assert load_snapshot(path) == (None, {})
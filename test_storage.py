@@ -0,0 +1,146 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from storage import MappedRing, SharedRing, RingReader, BAR_DTYPE, TICK_DTYPE
+
+
+def tick(n):
+    return (n, float(n), 1.0)
+
+
+@pytest.fixture
+def ring_path(tmp_path):
+    return str(tmp_path / 'ticks.ring')
+
+
+def test_ring_wraps_around(ring_path):
+    ring = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    ring.append([tick(n) for n in range(3)])
+    ring.append([tick(n) for n in range(3, 6)])
+
+    assert ring.count == 6
+    assert len(ring) == 4
+    assert ring.last()['time'].tolist() == [2, 3, 4, 5]
+    # Records that have been overwritten are skipped
+    assert ring.since(0)['time'].tolist() == [2, 3, 4, 5]
+    assert ring.since(4)['time'].tolist() == [4, 5]
+
+
+def test_append_larger_than_capacity_keeps_newest(ring_path):
+    ring = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    ring.append([tick(n) for n in range(10)])
+    assert ring.count == 10
+    assert ring.last()['time'].tolist() == [6, 7, 8, 9]
+
+
+def test_reader_returns_only_new_records_across_wrap(ring_path):
+    writer = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    reader = RingReader(MappedRing(ring_path, TICK_DTYPE, writable=False))
+
+    writer.append([tick(n) for n in range(3)])
+    assert reader.read_new()['time'].tolist() == [0, 1, 2]
+    assert len(reader.read_new()) == 0
+
+    writer.append([tick(n) for n in range(3, 6)])
+    assert reader.read_new()['time'].tolist() == [3, 4, 5]
+
+
+def test_reader_rereads_window_and_sees_replaced_bar(ring_path):
+    writer = MappedRing(ring_path, BAR_DTYPE, capacity=8)
+    reader = RingReader(MappedRing(ring_path, BAR_DTYPE, writable=False), reread=2)
+
+    writer.append([(n, 1, 2, 0.5, 1.5, 10) for n in range(4)])
+    reader.read_new()
+    writer.replace(2, (2, 1, 3, 0.5, 1.5, 99))
+
+    records = reader.read_new()
+    assert records['time'].tolist() == [2, 3]
+    assert records['volume'].tolist() == [99, 10]
+
+
+def test_reader_after_reset_starts_over(ring_path):
+    writer = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    reader = RingReader(MappedRing(ring_path, TICK_DTYPE, writable=False))
+    writer.append([tick(n) for n in range(3)])
+    reader.read_new()
+
+    writer.reset()
+    writer.append([tick(10)])
+    assert reader.read_new()['time'].tolist() == [10]
+
+
+def test_odd_version_is_recovered_when_writer_reopens(ring_path):
+    writer = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    writer.append([tick(1)])
+    writer._header[4] += 1  # Writer died in the middle of a write
+    writer.close()
+
+    reader = RingReader(MappedRing(ring_path, TICK_DTYPE, writable=False))
+    assert len(reader.read_new()) == 0  # Gives up instead of spinning forever
+
+    writer = MappedRing(ring_path, TICK_DTYPE, capacity=4)
+    assert writer.version % 2 == 0
+    writer.append([tick(2)])
+    assert reader.read_new()['time'].tolist() == [1, 2]
+
+
+def test_mapped_ring_rejects_other_dtype(ring_path):
+    MappedRing(ring_path, TICK_DTYPE, capacity=4).close()
+    with pytest.raises(ValueError):
+        MappedRing(ring_path, BAR_DTYPE, writable=False)
+
+
+@pytest.fixture
+def shm_name():
+    name = f'dtr_test_{os.getpid()}'
+    yield name
+    from multiprocessing import shared_memory
+    try:
+        shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.unlink()
+    shm.close()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='named blocks do not outlive their handles on Windows')
+def test_shared_ring_refuses_block_of_running_writer(shm_name):
+    writer = SharedRing(shm_name, TICK_DTYPE, capacity=4)
+    writer.append([tick(1)])
+    with pytest.raises(RuntimeError):
+        SharedRing(shm_name, TICK_DTYPE, capacity=4)
+    assert writer.is_current()
+    assert writer.count == 1
+    writer.close()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='named blocks do not outlive their handles on Windows')
+def test_shared_ring_replaces_block_of_dead_writer(shm_name):
+    from multiprocessing import shared_memory
+
+    # Block left behind by a writer that was killed
+    stale = SharedRing(shm_name, TICK_DTYPE, capacity=4)
+    stale.append([tick(1)])
+    stale._header[6] = dead_pid()
+    reader = SharedRing(shm_name, TICK_DTYPE, writable=False)
+
+    writer = SharedRing(shm_name, TICK_DTYPE, capacity=4)
+    assert writer.count == 0
+    assert writer.instance != reader.instance
+    assert not reader.is_current()
+
+    # The stale writer must not remove the new block
+    stale.close()
+    assert writer.is_current()
+    writer.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(shm_name)
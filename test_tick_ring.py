@@ -0,0 +1,31 @@
+from tick_ring import TickRing
+
+
+def test_last_returns_newest_ticks_after_wraparound():
+    ring = TickRing(4)
+    for n in range(6):
+        ring.append(n, float(n))
+
+    times, prices = ring.last()
+    assert times.tolist() == [2, 3, 4, 5]
+    assert prices.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert ring.last(2)[0].tolist() == [4, 5]
+
+
+def test_extend_wraps_and_keeps_only_what_fits():
+    ring = TickRing(4)
+    ring.extend([0, 1, 2], [0, 1, 2])
+    ring.extend([3, 4, 5], [3, 4, 5])
+    assert ring.last()[0].tolist() == [2, 3, 4, 5]
+
+    ring.extend(range(10, 20), range(10, 20))
+    assert ring.last()[0].tolist() == [16, 17, 18, 19]
+    assert len(ring) == 4
+
+
+def test_clear_empties_the_ring():
+    ring = TickRing(4)
+    ring.extend([1, 2], [1, 2])
+    ring.clear()
+    assert len(ring) == 0
+    assert len(ring.last()[0]) == 0
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from bar_history import BarHistory
+from timeframes import TimeframeCache, resample_arrays, timeframe_step
+
+
+def minute_bars(start, count):
+    dates = pd.date_range(start, periods=count, freq='min')
+    n = pd.Series(range(count), dtype=float)
+    return pd.DataFrame({'date': dates, 'open': n, 'high': n + 1, 'low': n - 1, 'close': n + 0.5, 'volume': 10.0})
+
+
+def test_resample_aggregates_ohlcv_per_bucket():
+    history = BarHistory()
+    history.upsert(minute_bars('2026-10-16 10:00', 7))
+
+    times, values = resample_arrays(*history.arrays(), timeframe_step('5m'))
+    assert pd.to_datetime(times).tolist() == [pd.Timestamp('2026-10-16 10:00'), pd.Timestamp('2026-10-16 10:05')]
+    assert values[:, 0].tolist() == [0.0, 5.0, -1.0, 4.5, 50.0]
+    assert values[:, 1].tolist() == [5.0, 7.0, 4.0, 6.5, 20.0]
+
+
+def test_cache_updates_only_the_changed_buckets():
+    base = BarHistory()
+    base.upsert(minute_bars('2026-10-16 10:00', 5))
+    cache = TimeframeCache()
+    view = cache.get('NVDA', '5m', base)
+    assert len(view) == 1
+
+    new = minute_bars('2026-10-16 10:05', 2)
+    base.upsert(new)
+    changed = cache.update('NVDA', base, new['date'].min())
+
+    assert changed['5m']['date'].tolist() == [pd.Timestamp('2026-10-16 10:05')]
+    assert len(view) == 2
+    assert cache.get('NVDA', '5m', base) is view
+    assert cache.builds == 1
+
+
+def test_base_timeframe_is_the_base_history():
+    base = BarHistory()
+    assert TimeframeCache().get('NVDA', '1m', base) is base
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import pytest
+
+from vwap import VwapEngine, SESSION_START
+
+
+def test_pre_market_bars_are_ignored():
+    engine = VwapEngine(session_start=SESSION_START)
+    assert engine.update_bar(datetime(2026, 10, 16, 9, 29), 50, 50, 50, 1000) is None
+    point = engine.update_bar(datetime(2026, 10, 16, 9, 30), 11, 9, 10, 100)
+    assert point['VWAP'] == pytest.approx(10)
+
+
+def test_bars_replace_the_forming_and_previous_bar():
+    engine = VwapEngine()
+    engine.update_bar(datetime(2026, 10, 16, 9, 30), 10, 10, 10, 100)
+    engine.update_bar(datetime(2026, 10, 16, 9, 31), 20, 20, 20, 100)
+    # Final values of the previous bar arrive after the next bar has started
+    point = engine.update_bar(datetime(2026, 10, 16, 9, 30), 10, 10, 10, 300)
+    assert point['VWAP'] == pytest.approx(12.5)
+
+
+def test_new_day_resets_the_session():
+    engine = VwapEngine()
+    engine.update_bar(datetime(2026, 10, 15, 15, 59), 50, 50, 50, 1000)
+    point = engine.update_bar(datetime(2026, 10, 16, 9, 30), 10, 10, 10, 100)
+    assert point['VWAP'] == pytest.approx(10)
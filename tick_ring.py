@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class TickRing:
+    """Fixed-capacity in-memory ring of (timestamp, price) ticks.
+
+    The arrays are preallocated once. Every tick is written twice, at slot i and
+    i + capacity, so the newest n ticks (n <= capacity) are always one contiguous
+    slice and last(n) can return views instead of copies. Dropping the oldest tick
+    when the ring is full costs nothing.
+
+    Timestamps are int64 nanoseconds of the naive wall clock time.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = np.zeros(2 * capacity, dtype='i8')
+        self.prices = np.zeros(2 * capacity, dtype='f8')
+        self.count = 0  # Ticks ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, time_ns, price):
+        slot = self.count % self.capacity
+        self.times[slot] = self.times[slot + self.capacity] = time_ns
+        self.prices[slot] = self.prices[slot + self.capacity] = price
+        self.count += 1
+
+    def extend(self, times_ns, prices):
+        """Appends arrays of timestamps and prices."""
+        times_ns = np.asarray(times_ns, dtype='i8')
+        prices = np.asarray(prices, dtype='f8')
+        if len(times_ns) > self.capacity:
+            # Only the newest ticks fit
+            self.count += len(times_ns) - self.capacity
+            times_ns = times_ns[-self.capacity:]
+            prices = prices[-self.capacity:]
+
+        start = self.count % self.capacity
+        n = len(times_ns)
+        first = min(n, self.capacity - start)
+        for offset in (0, self.capacity):
+            self.times[start + offset:start + offset + first] = times_ns[:first]
+            self.prices[start + offset:start + offset + first] = prices[:first]
+            self.times[offset:offset + n - first] = times_ns[first:]
+            self.prices[offset:offset + n - first] = prices[first:]
+        self.count += n
+
+    def last(self, n=None):
+        """Returns views of the timestamps and prices of the newest `n` ticks, oldest first.
+
+        The views are only valid until the ring wraps over them, copy them to keep them.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        end = self.count % self.capacity + self.capacity
+        return self.times[end - n:end], self.prices[end - n:end]
+
+    def clear(self):
+        self.count = 0
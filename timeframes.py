@@ -0,0 +1,105 @@
+from collections import OrderedDict
+
+# NumPy, pandas and bar_history are imported when bars are resampled, so the
+# plotter can read the timeframes before its data libraries have loaded
+
+
+# Timeframe name -> (bar length in seconds, chart watermark). '1m' is the base timeframe of the 1-minute bars.
+TIMEFRAMES = {
+    '1m': (60, '1 min'),
+    '5m': (5 * 60, '5 min'),
+    '15m': (15 * 60, '15 min'),
+    '1h': (3600, '1 hour'),
+    '1D': (86400, '1 day'),
+}
+BASE_TIMEFRAME = '1m'
+
+
+def timeframe_step(timeframe):
+    """Returns the bar length of `timeframe` in nanoseconds."""
+    return TIMEFRAMES[timeframe][0] * 1_000_000_000
+
+
+def resample_arrays(times, values, step):
+    """Aggregates sorted bars into bars of `step` nanoseconds.
+
+    `times` are int64 nanoseconds and `values` a (5, n) array of OHLCV values.
+    A bar starts at the time floored to a multiple of `step`, so daily bars start
+    at midnight of the naive bar times. Returns the times and values of the
+    resampled bars.
+    """
+    import numpy as np
+
+    if len(times) == 0:
+        return times[:0], values[:, :0]
+    buckets = times - times % step
+    starts = np.flatnonzero(np.diff(buckets)) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(times)]))
+
+    open_, high, low, close, volume = values
+    resampled = np.empty((5, len(starts)), dtype='f8')
+    resampled[0] = open_[starts]
+    resampled[1] = np.maximum.reduceat(high, starts)
+    resampled[2] = np.minimum.reduceat(low, starts)
+    resampled[3] = close[ends - 1]
+    resampled[4] = np.add.reduceat(volume, starts)
+    return buckets[starts], resampled
+
+
+class TimeframeCache:
+    """Higher timeframe bars derived from the 1-minute BarHistory of each symbol.
+
+    The derived bars of a (symbol, timeframe) are built with one resample of the
+    base history the first time they are asked for, and kept up to date by update():
+    only the bars of the buckets that the new 1-minute bars fall in are computed
+    again. At most `max_entries` timeframes are kept, the least recently used one
+    is dropped first and built again when it is needed.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (symbol, timeframe) -> BarHistory of the derived bars
+        self.builds = 0  # Full resamples, for the log
+
+    def get(self, symbol, timeframe, base):
+        """Returns the BarHistory of `timeframe` for `symbol`, `base` is the symbol's 1-minute history."""
+        from bar_history import BarHistory
+
+        if timeframe == BASE_TIMEFRAME:
+            return base
+        key = (symbol, timeframe)
+        history = self.entries.get(key)
+        if history is not None:
+            self.entries.move_to_end(key)
+            return history
+
+        history = BarHistory(retention=base.retention)
+        history.upsert_arrays(*resample_arrays(*base.arrays(), timeframe_step(timeframe)))
+        self.builds += 1
+        self.entries[key] = history
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return history
+
+    def update(self, symbol, base, first_time):
+        """Updates the cached timeframes of `symbol` after 1-minute bars from `first_time` on were added to `base`.
+
+        `first_time` is the time of the oldest new or rewritten bar. Returns a dict
+        of timeframe -> DataFrame of the derived bars that changed.
+        """
+        import pandas as pd
+        from bar_history import arrays_to_frame
+
+        changed = {}
+        if pd.isna(first_time):
+            return changed
+        first_time = pd.Timestamp(first_time).value
+        for (entry_symbol, timeframe), history in self.entries.items():
+            if entry_symbol != symbol:
+                continue
+            step = timeframe_step(timeframe)
+            times, values = resample_arrays(*base.arrays(first_time - first_time % step), step)
+            history.upsert_arrays(times, values)
+            changed[timeframe] = arrays_to_frame(times.copy(), values.copy())
+        return changed
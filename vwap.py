@@ -0,0 +1,174 @@
+import math
+from datetime import date, datetime, time as dtime
+
+SESSION_START = dtime(9, 30)  # Start of the regular trading hours, the streamer also writes pre-market bars
+
+
+class VwapEngine:
+    """Streaming VWAP with standard deviation bands.
+
+    Keeps running sums of price*volume, price^2*volume and volume for the closed
+    bars of the session, plus the contributions of the previous bar and the bar that
+    is still forming. Updating either of them only replaces its contribution, so
+    every update costs the same no matter how far into the session we are. The
+    previous bar is kept separately because its final values usually arrive from IB
+    after the first ticks of the next bar.
+
+    The typical price (high + low + close) / 3 of a bar is used as its price, the
+    same way as calculate_vwap does. The sums are reset when a bar from a new day
+    arrives. If `session_start` (datetime.time) is given, bars before it are ignored.
+    """
+
+    def __init__(self, band_multipliers=(1.0, 2.0), session_start=None):
+        self.band_multipliers = band_multipliers
+        self.session_start = session_start
+        self.line_names = ['VWAP'] + [name for m in band_multipliers for name in self.band_names(m)]
+        self.reset()
+
+    @staticmethod
+    def band_names(multiplier):
+        return [f'VWAP +{multiplier:g}SD', f'VWAP -{multiplier:g}SD']
+
+    def reset(self):
+        """Starts a new session."""
+        self.session_date = None
+        self.sum_pv = 0.0  # Closed bars: sum of price * volume
+        self.sum_p2v = 0.0  # Closed bars: sum of price^2 * volume
+        self.sum_v = 0.0  # Closed bars: sum of volume
+        self.previous = None  # (time, price * volume, price^2 * volume, volume) of the previous bar
+        self.bar_time = None  # Forming bar
+        self.bar_high = None
+        self.bar_low = None
+        self.bar_close = None
+        self.bar_volume = 0.0
+
+    @staticmethod
+    def _contribution(time, high, low, close, volume):
+        price = (high + low + close) / 3
+        return (time, price * volume, price * price * volume, volume)
+
+    def _start_bar(self, time):
+        """Moves the forming bar into the previous bar and starts a new one."""
+        if self.session_date is not None and time.date() != self.session_date:
+            self.reset()
+
+        if self.previous is not None:
+            _, pv, p2v, v = self.previous
+            self.sum_pv += pv
+            self.sum_p2v += p2v
+            self.sum_v += v
+        if self.bar_time is not None:
+            self.previous = self._contribution(self.bar_time, self.bar_high, self.bar_low, self.bar_close, self.bar_volume)
+
+        self.session_date = time.date()
+        self.bar_time = time
+        self.bar_volume = 0.0
+
+    def _in_session(self, time):
+        return self.session_start is None or time.time() >= self.session_start
+
+    def update_bar(self, time, high, low, close, volume):
+        """Adds a bar or replaces the forming bar when `time` equals its time.
+
+        A bar with the time of the previous bar replaces its values. Returns the
+        point for the forming bar as a dict, or None if the bar was ignored.
+        """
+        if not self._in_session(time):
+            return None
+        if self.previous is not None and time == self.previous[0]:
+            self.previous = self._contribution(time, high, low, close, volume)
+            return self.point()
+        if self.bar_time is not None and time < self.bar_time:
+            return None
+        if time != self.bar_time:
+            self._start_bar(time)
+
+        self.bar_high = high
+        self.bar_low = low
+        self.bar_close = close
+        self.bar_volume = volume
+        return self.point()
+
+    def add_closed_bar(self, time, high, low, close, volume):
+        """Like update_bar, but a bar older than the forming bar is added to the closed bars.
+
+        For backfilled bars that arrive after the first live ticks have started the
+        forming bar. The caller must not pass the same older bar twice.
+        """
+        if self.bar_time is None or time >= self.bar_time or (self.previous is not None and time == self.previous[0]):
+            return self.update_bar(time, high, low, close, volume)
+        if not self._in_session(time) or time.date() != self.session_date:
+            return None
+
+        _, pv, p2v, v = self._contribution(time, high, low, close, volume)
+        self.sum_pv += pv
+        self.sum_p2v += p2v
+        self.sum_v += v
+        return self.point()
+
+    def update_tick(self, time, price):
+        """Updates the forming bar with a live price. `time` is the start of the tick's bar.
+
+        Ticks carry no size, so the volume of the bar stays the same.
+        """
+        if not self._in_session(time):
+            return None
+        if self.bar_time is not None and time < self.bar_time:
+            return None
+        if time != self.bar_time:
+            self._start_bar(time)
+            self.bar_high = self.bar_low = price
+        else:
+            self.bar_high = max(self.bar_high, price)
+            self.bar_low = min(self.bar_low, price)
+        self.bar_close = price
+        return self.point()
+
+    def state(self):
+        """Returns the accumulators as a JSON-friendly dict, see load_state."""
+        previous = None
+        if self.previous is not None:
+            previous = [self.previous[0].isoformat()] + list(self.previous[1:])
+        return {
+            'session_date': self.session_date.isoformat() if self.session_date is not None else None,
+            'sums': [self.sum_pv, self.sum_p2v, self.sum_v],
+            'previous': previous,
+            'bar': [self.bar_time.isoformat(), self.bar_high, self.bar_low, self.bar_close, self.bar_volume]
+                   if self.bar_time is not None else None,
+        }
+
+    def load_state(self, state):
+        """Continues from a state returned by state(), e.g. after a restart."""
+        self.reset()
+        if state['session_date'] is not None:
+            self.session_date = date.fromisoformat(state['session_date'])
+        self.sum_pv, self.sum_p2v, self.sum_v = state['sums']
+        if state['previous'] is not None:
+            self.previous = (datetime.fromisoformat(state['previous'][0]), *state['previous'][1:])
+        if state['bar'] is not None:
+            bar_time, self.bar_high, self.bar_low, self.bar_close, self.bar_volume = state['bar']
+            self.bar_time = datetime.fromisoformat(bar_time)
+
+    def point(self):
+        """Returns the current VWAP and bands as a dict keyed by line name, plus 'time'."""
+        _, pv, p2v, v = self._contribution(self.bar_time, self.bar_high, self.bar_low, self.bar_close, self.bar_volume)
+        if self.previous is not None:
+            pv += self.previous[1]
+            p2v += self.previous[2]
+            v += self.previous[3]
+
+        total_v = self.sum_v + v
+        if total_v <= 0:
+            # No volume yet, the VWAP is the price itself
+            vwap, std = (self.bar_high + self.bar_low + self.bar_close) / 3, 0.0
+        else:
+            vwap = (self.sum_pv + pv) / total_v
+            variance = (self.sum_p2v + p2v) / total_v - vwap * vwap
+            std = math.sqrt(max(variance, 0.0))
+
+        point = {'time': self.bar_time, 'VWAP': vwap}
+        for multiplier in self.band_multipliers:
+            upper, lower = self.band_names(multiplier)
+            point[upper] = vwap + multiplier * std
+            point[lower] = vwap - multiplier * std
+        return point